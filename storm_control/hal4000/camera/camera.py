@@ -28,6 +28,8 @@ import storm_control.sc_library.parameters as params
 import storm_control.hal4000.camera.cameraControl as cameraControl
 import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
 import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.frameGaps as frameGaps
+import storm_control.hal4000.camera.frameTracing as frameTracing
 import storm_control.hal4000.halLib.halMessage as halMessage
 import storm_control.hal4000.halLib.halModule as halModule
 
@@ -46,11 +48,65 @@ class Camera(halModule.HalModule):
         self.camera_control = a_class(camera_name = self.module_name,
                                       config = camera_params.get("parameters"),
                                       is_master = camera_params.get("master"))
+
+        # All the cameras handle this message.
+        halMessage.addMessage("frame tracing",
+                              validator = {"data" : {"camera" : [False, str],
+                                                     "enabled" : [False, bool],
+                                                     "reset" : [False, bool]},
+                                           "resp" : {"statistics" : [True, dict]}},
+                              check_exists = False)
                                    
     def cleanUp(self, qt_settings):
         self.camera_control.cleanUp()
         super().cleanUp(qt_settings)
 
+    def getGapParameters(self):
+        """
+        Returns a list of parameters with the number of dropped and
+        duplicated frames at each stage for this camera and it's feeds,
+        and where the gaps were (as 'first missing frame:number missing').
+        """
+        gap_params = []
+        stats = frameGaps.monitor.getStatistics(self.module_name)
+        for name in stats:
+            for stage in sorted(stats[name]):
+                s_stats = stats[name][stage]
+                prefix = name.replace(".", "_") + "_"
+                gap_params.append(params.ParameterInt(name = prefix + "dropped_" + stage,
+                                                      value = s_stats["dropped"]))
+                gap_params.append(params.ParameterInt(name = prefix + "duplicated_" + stage,
+                                                      value = s_stats["duplicated"]))
+                if (len(s_stats["gaps"]) > 0):
+                    gaps = ",".join(["{0:d}:{1:d}".format(*gap) for gap in s_stats["gaps"]])
+                    gap_params.append(params.ParameterString(name = prefix + "gaps_" + stage,
+                                                             value = gaps))
+                if (s_stats["dropped"] > 0) or (s_stats["duplicated"] > 0):
+                    print(">> Warning", name, stage, "dropped", s_stats["dropped"], "frames, duplicated", s_stats["duplicated"], "frames")
+        return gap_params
+
+    def getTracingParameters(self):
+        """
+        Returns a list of parameters with the frame latency statistics
+        of this camera and it's feeds, in milliseconds.
+        """
+        tracing_params = []
+        stats = frameTracing.tracer.getStatistics(self.module_name)
+        for name in stats:
+            for stage in frameTracing.stages:
+                if stage in stats[name]:
+                    s_stats = stats[name][stage]
+                    prefix = name.replace(".", "_") + "_latency_" + stage + "_"
+                    for field in ["mean", "p99", "max"]:
+                        tracing_params.append(params.ParameterFloat(name = prefix + field,
+                                                                    value = s_stats[field]))
+                    print(">> {0:s} {1:s} latency (ms), mean {2:.3f} p99 {3:.3f} max {4:.3f}".format(name,
+                                                                                                  stage,
+                                                                                                  s_stats["mean"],
+                                                                                                  s_stats["p99"],
+                                                                                                  s_stats["max"]))
+        return tracing_params
+
     def processMessage(self, message):
 
         if message.isType("configuration"):
@@ -71,6 +127,19 @@ class Camera(halModule.HalModule):
             message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
                                                               data = {"parameters" : self.camera_control.getParameters().copy()}))
             
+        elif message.isType("frame tracing"):
+            # This message can come from anywhere, tracing is global so
+            # enabling it for one camera enables it for all of them.
+            data = message.getData()
+            camera_name = data.get("camera", self.module_name)
+            if (camera_name == self.module_name):
+                if "enabled" in data:
+                    frameTracing.tracer.setEnabled(data["enabled"])
+                if data.get("reset", False):
+                    frameTracing.tracer.reset(self.module_name)
+                message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
+                                                                  data = {"statistics" : frameTracing.tracer.getStatistics(self.module_name)}))
+
         elif message.isType("get functionality"):
             # This message comes from display.cameraDisplay among others.
             if (message.getData()["name"] == self.module_name):
@@ -101,6 +170,9 @@ class Camera(halModule.HalModule):
             # but don't actually do anything until we get a 'configuration'
             # message from timing.timing.
             self.film_settings = message.getData()["film settings"]
+            frameGaps.monitor.reset(self.module_name)
+            if frameTracing.tracer.isEnabled():
+                frameTracing.tracer.reset(self.module_name)
 
         elif message.isType("stop camera"):
             # This message comes from film.film.
@@ -112,6 +184,13 @@ class Camera(halModule.HalModule):
             self.film_length = None
             message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
                                                               data = {"parameters" : self.camera_control.getParameters()}))
+            message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
+                                                              data = {"acquisition" : self.getGapParameters()}))
+            if frameTracing.tracer.isEnabled():
+                tracing_params = self.getTracingParameters()
+                if (len(tracing_params) > 0):
+                    message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
+                                                                      data = {"acquisition" : tracing_params}))
             halModule.runWorkerTask(self, message, self.stopFilm)
 
     def startCamera(self):
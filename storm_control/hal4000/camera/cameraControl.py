@@ -16,6 +16,8 @@ import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.frameGaps as frameGaps
+import storm_control.hal4000.camera.frameTracing as frameTracing
 
 
 class CameraException(halExceptions.HardwareException):
@@ -50,6 +52,9 @@ class CameraControl(QtCore.QThread):
         # The current frame number, this gets reset by startCamera().
         self.frame_number = 0
 
+        # For checking that we get all the frames from the camera thread.
+        self.gap_detector = frameGaps.monitor.getDetector(camera_name, "camera")
+
         # The camera parameters.
         self.parameters = params.StormXMLObject()
 
@@ -203,6 +208,10 @@ class CameraControl(QtCore.QThread):
         self.parameters.set("default_max", config.get("default_max", 2000))
         self.parameters.set("default_min", config.get("default_min", 100))
 
+        # Frame latency tracing (for all cameras), see frameTracing.py.
+        if config.get("frame_tracing", False):
+            frameTracing.tracer.setEnabled(True)
+
         self.finished.connect(self.handleFinished)
         self.newData.connect(self.handleNewData)
 
@@ -243,15 +252,20 @@ class CameraControl(QtCore.QThread):
         Data from the camera should go through this method on it's
         way to the camera functionality object.
         """
-        for frame in frames:
-            if self.film_length is not None:
+        self.gap_detector.checkFrames(frames)
+
+        if self.film_length is not None:
+
+            # This keeps us from emitting more than the expected number
+            # of frames.
+            frames = [frame for frame in frames if (frame.frame_number < self.film_length)]
 
-                # This keeps us from emitting more than the expected number
-                # of newFrame signals.
-                if (frame.frame_number >= self.film_length):
-                    break
-                
-            self.camera_functionality.newFrame.emit(frame)
+        if (len(frames) > 0):
+            emit_time = time.perf_counter()
+            for aframe in frames:
+                aframe.emit_time = emit_time
+                frameTracing.traceFrame(aframe, "emit", aframe.acquisition_time, emit_time)
+            self.camera_functionality.emitNewFrames(frames)
 
     def newParameters(self, parameters):
         """
@@ -320,6 +334,7 @@ class CameraControl(QtCore.QThread):
             self.getTemperature()
         
         self.frame_number = 0
+        frameGaps.monitor.restart(self.camera_name)
 
         # Start the thread to handle data from the camera.
         self.thread_started = False
@@ -365,54 +380,174 @@ class CameraControl(QtCore.QThread):
 class HWCameraControl(CameraControl):
     """
     This class implements what is common to all of the 'hardware' cameras.
+
+    If the camera interface supports it (supportsWait() returns True) the
+    thread blocks in getFrames() until new frames arrive or timeout seconds
+    pass, and the frames are emitted immediately. Otherwise, or if 'frame_wait'
+    is False in the camera configuration, the camera is polled every 5ms.
     """
-    def __init__(self, **kwds):
+    def __init__(self, config = None, **kwds):
+        kwds["config"] = config
         super().__init__(**kwds)
         self.camera_mutex = QtCore.QMutex()
 
+        self.frame_wait = config.get("frame_wait", True)
+        self.frame_wait_timeout = config.get("frame_wait_timeout", 0.1)
+        self.resetLatency()
+
+        # The mean and maximum time in milliseconds between the camera
+        # thread receiving a frame and it being sent to the rest of HAL
+        # during the last acquisition.
+        self.parameters.add(params.ParameterFloat(name = "frame_latency_mean",
+                                                  value = 0.0,
+                                                  is_mutable = False,
+                                                  is_saved = False))
+
+        self.parameters.add(params.ParameterFloat(name = "frame_latency_max",
+                                                  value = 0.0,
+                                                  is_mutable = False,
+                                                  is_saved = False))
+
+        # The number of frames during the last acquisition for which the
+        # camera had to allocate new storage because all of the buffers
+        # in its frame pool were still in use.
+        self.parameters.add(params.ParameterInt(name = "frame_pool_exhausted",
+                                                value = 0,
+                                                is_mutable = False,
+                                                is_saved = False))
+
     def cleanUp(self):
         super().cleanUp()
         self.camera.shutdown()
 
+    def getFramePoolStatistics(self):
+        """
+        Returns the frame pool statistics, or None if the camera
+        interface does not use a frame pool.
+        """
+        frame_pool = getattr(self.camera, "frame_pool", None)
+        if frame_pool is None:
+            return None
+        return frame_pool.getStatistics()
+
+    def getLatencyStatistics(self):
+        """
+        Returns the acquisition to emit latency statistics (in milliseconds).
+        """
+        stats = {"frames" : self.latency_n,
+                 "mean" : 0.0,
+                 "max" : 1000.0 * self.latency_max,
+                 "wait" : self.waitForFrames()}
+        if (self.latency_n > 0):
+            stats["mean"] = 1000.0 * self.latency_sum/self.latency_n
+        return stats
+
+    def handleFinished(self):
+        stats = self.getFramePoolStatistics()
+        if stats is not None:
+            self.parameters.setv("frame_pool_exhausted", stats["exhausted"])
+            if (stats["exhausted"] > 0):
+                print(">> Warning", self.camera_name, "frame pool was exhausted", stats["exhausted"], "times, maximum buffers in use", stats["max_in_use"], "of", stats["buffers"])
+
+        stats = self.getLatencyStatistics()
+        self.parameters.setv("frame_latency_mean", stats["mean"])
+        self.parameters.setv("frame_latency_max", stats["max"])
+        super().handleFinished()
+
+    def handleNewData(self, frames):
+        now = time.perf_counter()
+        for aframe in frames:
+            if aframe.acquisition_time is not None:
+                latency = now - aframe.acquisition_time
+                self.latency_n += 1
+                self.latency_sum += latency
+                if (latency > self.latency_max):
+                    self.latency_max = latency
+        super().handleNewData(frames)
+
+    def resetLatency(self):
+        self.latency_max = 0.0
+        self.latency_n = 0
+        self.latency_sum = 0.0
+
     def run(self):
         #
         # Note: The order is important here, we need to start the camera and
         #       only then set self.running. Otherwise HAL might think the
         #       camera is running when it is not.
         #
+        wait = self.waitForFrames()
+        self.resetLatency()
         self.camera.startAcquisition()
+
+        # Some camera interfaces can tell us if frames were lost in the
+        # camera (or it's driver). We skip these frame numbers so that
+        # the frames that we got keep the camera's frame numbering.
+        frames_lost = 0
+        has_frames_lost = hasattr(self.camera, "getFramesLost")
+
         self.running = True
         self.thread_started = True
         while(self.running):
 
             # Get data from camera and create frame objects.
             self.camera_mutex.lock()
-            [frames, frame_size] = self.camera.getFrames()
+            if wait:
+                [frames, frame_size] = self.camera.getFrames(timeout = self.frame_wait_timeout)
+            else:
+                [frames, frame_size] = self.camera.getFrames()
             self.camera_mutex.unlock()
+            acquisition_time = time.perf_counter()
 
             # Check if we got new frame data.
             if (len(frames) > 0):
 
+                if has_frames_lost:
+                    lost = self.camera.getFramesLost()
+                    if (lost > frames_lost):
+                        self.frame_number += lost - frames_lost
+                        frames_lost = lost
+
                 # Create frame objects.
                 frame_data = []
                 for cam_frame in frames:
+
+                    # Some camera interfaces record when the frame actually arrived.
+                    arrival_time = getattr(cam_frame, "arrival_time", None)
+                    if arrival_time is None:
+                        arrival_time = acquisition_time
+
                     aframe = frame.Frame(cam_frame.getData(),
                                          self.frame_number,
                                          frame_size[0],
                                          frame_size[1],
-                                         self.camera_name)
+                                         self.camera_name,
+                                         acquisition_time = arrival_time)
                     frame_data.append(aframe)
                     self.frame_number += 1
 
                     if self.film_length is not None:                    
-                        if (self.frame_number == self.film_length):
+                        if (self.frame_number >= self.film_length):
                             self.running = False
                             
                 # Emit new data signal.
                 self.newData.emit(frame_data)
-            self.msleep(5)
+
+            if not wait:
+                self.msleep(5)
 
         self.camera.stopAcquisition()
+
+    def waitForFrames(self):
+        """
+        Returns True if the camera thread should block waiting for frames
+        instead of polling.
+        """
+        if not self.frame_wait:
+            return False
+        if not hasattr(self.camera, "supportsWait"):
+            return False
+        return self.camera.supportsWait()
             
 #    def startCamera(self):
 #        print(">start", self.camera_name, self.running)
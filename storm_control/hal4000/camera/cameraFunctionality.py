@@ -24,9 +24,14 @@ class CameraFunctionality(halFunctionality.HalFunctionality):
 
     During a parameter change feed.feed and display.display disconnect
     from camera functionalities and then request new ones.
+
+    New frames are emitted in batches with the newFrames signal, then one
+    at a time with the newFrame signal. Modules that can should use the
+    newFrames signal as this is a lot less overhead at high frame rates.
     """
     emccdGain = QtCore.pyqtSignal(int)
     newFrame = QtCore.pyqtSignal(object)
+    newFrames = QtCore.pyqtSignal(object)
     parametersChanged = QtCore.pyqtSignal()
     shutter = QtCore.pyqtSignal(bool)
     started = QtCore.pyqtSignal()
@@ -72,6 +77,16 @@ class CameraFunctionality(halFunctionality.HalFunctionality):
         # Not used, kept because it may be useful for enforcing invalid functionalities?
         return copy.deepcopy(self)
 
+    def emitNewFrames(self, frames):
+        """
+        Emit a list of new frames. newFrame is only emitted if something
+        is actually connected to it.
+        """
+        self.newFrames.emit(frames)
+        if (self.receivers(self.newFrame) > 0):
+            for aframe in frames:
+                self.newFrame.emit(aframe)
+
     def getCameraName(self):
         return self.camera_name
 
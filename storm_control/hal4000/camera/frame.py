@@ -6,37 +6,87 @@ or the data from a feed and it's meta-information.
 Notes: 
  (1) The numpy data field (np_data) is expected to
      be of type numpy.uint16.
+
+ (2) Feeds can create frames from a strided (non-contiguous)
+     2D view of another frame's data. In this case the
+     contiguous copy of the data is only made if something
+     calls getData(), and then only once.
  
 Hazen 3/17
 """
 
+import numpy
+import threading
+
+# For making the contiguous copy of a frame's data.
+copy_lock = threading.Lock()
+
+
 class Frame(object):
     """
     Class for the storage of a single frame of camera data
     and it's meta-information.
+
+    The time stamps are time.perf_counter() values, or None if
+    the frame has not (yet) reached that stage.
     """
+    __slots__ = ("acquisition_time",
+                 "commit_time",
+                 "display_time",
+                 "emit_time",
+                 "enqueue_time",
+                 "frame_number",
+                 "image_x",
+                 "image_y",
+                 "np_data",
+                 "np_view",
+                 "which_camera")
 
-    def __init__(self, np_data, frame_number, image_x, image_y, which_camera):
+    def __init__(self, np_data, frame_number, image_x, image_y, which_camera, acquisition_time = None):
         """
         Create a camera frame object.
         FIXME: Are we consistent in the use of master vs. camera1?
         
-        np_data - A numpy.uint16 object containing the data for the frame.
+        np_data - A numpy.uint16 object containing the data for the frame,
+                  or a (image_y, image_x) view of part of another frame.
         frame_number - The frame number of this frame.
         image_x - The size of the frame in pixels in x.
         image_y - The size of the frame in pixels in y.
+        acquisition_time - The time when the frame was received from the
+                           camera, if known.
         """
-
+        self.acquisition_time = acquisition_time
         self.image_x = image_x
         self.image_y = image_y
-        self.np_data = np_data
         self.frame_number = frame_number
         self.which_camera = which_camera
 
+        if (np_data.ndim == 2) and not np_data.flags["C_CONTIGUOUS"]:
+            self.np_data = None
+            self.np_view = np_data
+        else:
+            self.np_data = np_data
+            self.np_view = None
+
+        # The time when the frame was emitted in the GUI thread.
+        self.emit_time = None
+
+        # The times when an image writer queued / wrote the frame.
+        self.enqueue_time = None
+        self.commit_time = None
+
+        # The time when the frame was first displayed.
+        self.display_time = None
+
     def getData(self):
         """
-        Returns the numpy object that stores the camera frame data.
+        Returns the numpy object that stores the camera frame data,
+        this is always C contiguous.
         """
+        if self.np_data is None:
+            with copy_lock:
+                if self.np_data is None:
+                    self.np_data = numpy.ascontiguousarray(self.np_view).reshape(-1)
         return self.np_data
 
     def getDataPtr(self):
@@ -44,7 +94,28 @@ class Frame(object):
         Returns a C style pointer to the physical address of the
         camera frame data in the computers memory.
         """
-        return self.np_data.ctypes.data
+        return self.getData().ctypes.data
+
+    def getStrides(self):
+        """
+        Returns the (y, x) strides of getView() in bytes.
+        """
+        return self.getView().strides
+
+    def getView(self):
+        """
+        Returns the frame data as a (image_y, image_x) numpy array
+        without copying it, this may not be C contiguous.
+        """
+        if self.np_view is not None:
+            return self.np_view
+        return self.np_data.reshape(self.image_y, self.image_x)
+
+    def isContiguous(self):
+        """
+        Returns True if getData() will not need to make a copy.
+        """
+        return self.np_data is not None
 
 
 #
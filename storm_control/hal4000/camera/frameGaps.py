@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Detection of dropped and duplicated frames.
+
+Each stage of the acquisition pipeline (the frames from the camera
+thread, the feeds, the image writers and the display) checks that the
+frame numbers it receives are contiguous. Frames that are missing are
+counted as dropped, and the gap is recorded. Frames that arrive again,
+or out of order, are counted as duplicated.
+
+The frame numbers start from zero every time the camera is started, so
+a frame number of zero always starts a new sequence.
+
+Frames that are lost in the camera, or it's driver, are visible as
+gaps at the 'camera' stage if the camera interface supports this (see
+cameraControl.HWCameraControl).
+"""
+
+import threading
+
+import storm_control.hal4000.camera.frameTracing as frameTracing
+
+
+stages = ["camera", "feed", "writer", "display"]
+
+
+class GapDetector(object):
+    """
+    Dropped / duplicated frame detection for a single camera / feed and stage.
+    """
+    def __init__(self, max_gaps = 1000, **kwds):
+        super().__init__(**kwds)
+        self.lock = threading.Lock()
+        self.max_gaps = max_gaps
+        self.reset()
+
+    def addDropped(self, frame_number, n_frames = 1):
+        """
+        Record frames that were dropped at this stage, for example
+        because the image writer queue was full.
+        """
+        self.lock.acquire()
+        self.addGap(frame_number, n_frames)
+        self.lock.release()
+
+    def addGap(self, frame_number, n_frames):
+        self.dropped += n_frames
+
+        # Merge with the previous gap if they are adjacent.
+        if (len(self.gaps) > 0) and ((self.gaps[-1][0] + self.gaps[-1][1]) == frame_number):
+            self.gaps[-1][1] += n_frames
+        elif (len(self.gaps) < self.max_gaps):
+            self.gaps.append([frame_number, n_frames])
+
+    def checkFrame(self, frame_number):
+        """
+        Returns True if frame_number was the expected frame.
+        """
+        self.lock.acquire()
+        ok = True
+        if (frame_number == 0) or (self.expected is None):
+            self.expected = frame_number + 1
+        elif (frame_number == self.expected):
+            self.expected += 1
+        elif (frame_number > self.expected):
+            self.addGap(self.expected, frame_number - self.expected)
+            self.expected = frame_number + 1
+            ok = False
+        else:
+            self.duplicated += 1
+            ok = False
+        self.lock.release()
+        return ok
+
+    def checkFrames(self, frames):
+        """
+        Check a batch of frames, returns True if they were all expected.
+        """
+        ok = True
+        for aframe in frames:
+            if not self.checkFrame(aframe.frame_number):
+                ok = False
+        return ok
+
+    def getStatistics(self):
+        self.lock.acquire()
+        stats = {"dropped" : self.dropped,
+                 "duplicated" : self.duplicated,
+                 "gaps" : [list(gap) for gap in self.gaps]}
+        self.lock.release()
+        return stats
+
+    def reset(self):
+        self.dropped = 0
+        self.duplicated = 0
+        self.expected = None
+        self.gaps = []
+
+    def restart(self):
+        """
+        Start a new sequence of frame numbers without clearing the counters.
+        """
+        self.expected = None
+
+
+class GapMonitor(object):
+    """
+    All of the gap detectors, keyed by camera / feed name and stage.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.detectors = {}
+        self.lock = threading.Lock()
+
+    def getDetector(self, camera_name, stage, instance = None):
+        """
+        Returns the detector for camera_name and stage, the same detector
+        is returned every time so the objects that use them can keep them.
+
+        instance is for stages where there can be more than one consumer
+        of the same frames, for example several displays of one camera.
+        """
+        assert(stage in stages)
+        if instance is not None:
+            stage += "_" + instance
+        self.lock.acquire()
+        key = (camera_name, stage)
+        if not key in self.detectors:
+            self.detectors[key] = GapDetector()
+        detector = self.detectors[key]
+        self.lock.release()
+        return detector
+
+    def getStatistics(self, camera_name = None):
+        """
+        Returns a dictionary keyed by camera / feed name of dictionaries keyed
+        by stage (and instance). If camera_name is specified this only includes
+        that camera and it's feeds.
+        """
+        stats = {}
+        for [key, detector] in self.getDetectors(camera_name):
+            if not key[0] in stats:
+                stats[key[0]] = {}
+            stats[key[0]][key[1]] = detector.getStatistics()
+        return stats
+
+    def getDetectors(self, camera_name):
+        self.lock.acquire()
+        detectors = [[key, self.detectors[key]] for key in sorted(self.detectors) if frameTracing.matchCamera(key[0], camera_name)]
+        self.lock.release()
+        return detectors
+
+    def getWorst(self, camera_name = None):
+        """
+        Returns the largest [dropped, duplicated] at any one stage. This
+        is not the sum as a frame that was dropped by the camera will also
+        be missing at all the stages after the camera.
+        """
+        worst = [0, 0]
+        for [key, detector] in self.getDetectors(camera_name):
+            worst[0] = max(worst[0], detector.dropped)
+            worst[1] = max(worst[1], detector.duplicated)
+        return worst
+
+    def reset(self, camera_name = None):
+        for [key, detector] in self.getDetectors(camera_name):
+            detector.lock.acquire()
+            detector.reset()
+            detector.lock.release()
+
+    def restart(self, camera_name = None):
+        for [key, detector] in self.getDetectors(camera_name):
+            detector.restart()
+
+
+# The monitor that is used by all of HAL.
+monitor = GapMonitor()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
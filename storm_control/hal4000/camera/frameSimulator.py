@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Generates synthetic camera frames for the emulated camera
+(noneCameraControl). Everything is vectorized so this can keep up
+with (at least) a few hundred frames per second at full sCMOS size.
+
+The frame content can be:
+
+ "static" - The original test pattern, rolled by 'roll' pixels per frame.
+
+ "poisson" - Camera offset plus Poisson distributed background.
+
+ "emitters" - Blinking Gaussian emitters on a Poisson background. The
+              emitter positions are fixed, so they are known exactly.
+
+ "focus" - Like "emitters", but the emitters are always on and they
+           get blurrier as 'focus_offset' moves away from zero.
+
+The background noise frames are computed in advance and re-used, as
+Poisson sampling a full sCMOS frame is too slow to do for every frame.
+"""
+
+import math
+import numpy
+
+
+contents = ["static", "poisson", "emitters", "focus"]
+
+
+class FrameSimulator(object):
+
+    def __init__(self,
+                 background = 20.0,
+                 blink_off = 0.3,
+                 blink_on = 0.05,
+                 content = "static",
+                 emitter_intensity = 2000.0,
+                 emitter_sigma = 1.3,
+                 emitters = 200,
+                 focus_depth = 0.5,
+                 focus_offset = 0.0,
+                 n_noise_frames = 8,
+                 offset = 100,
+                 roll = 0.1,
+                 seed = None,
+                 x_pixels = None,
+                 y_pixels = None,
+                 **kwds):
+        """
+        blink_off / blink_on are the per frame probabilities of an emitter
+        switching off / on, focus_offset and focus_depth are in microns.
+        """
+        super().__init__(**kwds)
+        assert(content in contents)
+        self.blink_off = blink_off
+        self.blink_on = blink_on
+        self.content = content
+        self.emitter_intensity = emitter_intensity
+        self.emitter_sigma = emitter_sigma
+        self.focus_depth = focus_depth
+        self.focus_offset = focus_offset
+        self.n_pixels = x_pixels * y_pixels
+        self.rng = numpy.random.RandomState(seed)
+        self.roll = roll
+        self.x_pixels = x_pixels
+        self.y_pixels = y_pixels
+
+        # Test pattern.
+        if (self.content == "static"):
+            x = numpy.arange(x_pixels) % 128
+            y = numpy.arange(y_pixels) % 128
+            self.pattern = (y[:,None] + x[None,:]).astype(numpy.uint16).ravel()
+
+        # Background noise frames.
+        else:
+            self.noise = numpy.empty((n_noise_frames, self.n_pixels), dtype = numpy.uint16)
+            for i in range(n_noise_frames):
+                self.noise[i,:] = offset + self.rng.poisson(background, self.n_pixels)
+
+        # Emitters, these are at least 'margin' pixels from the edge of the frame.
+        margin = 4
+        self.x = self.rng.uniform(margin, max(margin, x_pixels - margin), emitters)
+        self.y = self.rng.uniform(margin, max(margin, y_pixels - margin), emitters)
+        if (self.content == "emitters"):
+            self.on = (self.rng.random_sample(emitters) < (blink_on/(blink_on + blink_off)))
+        else:
+            self.on = numpy.ones(emitters, dtype = numpy.bool_)
+
+    def addEmitters(self, np_data, on):
+        """
+        Add the photons from the emitters that are on to np_data.
+        """
+        x = self.x[on]
+        y = self.y[on]
+        if (x.size == 0):
+            return
+
+        sigma = self.getSigma()
+        r = int(math.ceil(3.0 * sigma))
+        d = numpy.arange(-r, r + 1)
+
+        # Separable integer pixel grids and Gaussians for each emitter.
+        xi = numpy.floor(x).astype(numpy.int64)[:,None] + d[None,:]
+        yi = numpy.floor(y).astype(numpy.int64)[:,None] + d[None,:]
+        norm = 1.0/(math.sqrt(2.0 * math.pi) * sigma)
+        gx = norm * numpy.exp(-(xi + 0.5 - x[:,None])**2/(2.0 * sigma * sigma))
+        gy = norm * numpy.exp(-(yi + 0.5 - y[:,None])**2/(2.0 * sigma * sigma))
+        photons = self.rng.poisson(self.emitter_intensity * gy[:,:,None] * gx[:,None,:])
+
+        xi = numpy.broadcast_to(xi[:,None,:], photons.shape)
+        yi = numpy.broadcast_to(yi[:,:,None], photons.shape)
+        mask = (xi >= 0) & (xi < self.x_pixels) & (yi >= 0) & (yi < self.y_pixels) & (photons > 0)
+        numpy.add.at(np_data, yi[mask] * self.x_pixels + xi[mask], photons[mask].astype(numpy.uint16))
+
+    def getEmitters(self):
+        """
+        Returns the ground truth, [x, y, on], for the last frame. The x and
+        y positions are in pixels with (0.0, 0.0) being the corner of the
+        first pixel.
+        """
+        return [self.x.copy(), self.y.copy(), self.on.copy()]
+
+    def getSigma(self):
+        """
+        The emitter width in pixels, for the "focus" content this is the
+        width of a Gaussian beam with a Rayleigh range of focus_depth.
+        """
+        if (self.content == "focus"):
+            return self.emitter_sigma * math.sqrt(1.0 + (self.focus_offset/self.focus_depth)**2)
+        return self.emitter_sigma
+
+    def newFrame(self, frame_number, np_data):
+        """
+        Fill np_data (a 1D numpy.uint16 array) with frame frame_number.
+        """
+        if (self.content == "static"):
+            shift = int(frame_number * self.roll) % self.n_pixels
+
+            # This is numpy.roll(), but without allocating a new array.
+            np_data[shift:] = self.pattern[:self.n_pixels - shift]
+            np_data[:shift] = self.pattern[self.n_pixels - shift:]
+            return
+
+        np_data[:] = self.noise[frame_number % self.noise.shape[0]]
+
+        if (self.content == "emitters"):
+            switch = self.rng.random_sample(self.on.size)
+            self.on = numpy.where(self.on, switch >= self.blink_off, switch < self.blink_on)
+
+        if (self.content != "poisson"):
+            self.addEmitters(np_data, self.on)
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Opt-in tracing of how long it takes camera frames to get through HAL.
+
+The frames are time stamped (time.perf_counter()) when they are received
+from the camera, when they are emitted in the GUI thread, when they are
+queued and written by the image writers and when they are displayed. When
+tracing is enabled the latency of each of these stages, relative to when
+the frame was received from the camera, is added to a histogram for
+each camera / feed. The 'write' stage is the time between queueing
+and writing a frame.
+
+There is a single tracer for all of HAL, tracing is enabled using the
+'frame_tracing' camera parameter in the config file or the 'frame
+tracing' message (see camera.camera).
+"""
+
+import math
+import threading
+
+
+stages = ["emit", "enqueue", "commit", "write", "display"]
+
+
+class LatencyHistogram(object):
+    """
+    Histogram with log spaced bins, bins_per_decade bins per decade
+    starting at min_latency seconds. Latencies that are smaller than
+    this go in the first bin, latencies that are larger than the
+    largest bin go in the last bin.
+    """
+    def __init__(self, bins_per_decade = 10, decades = 8, min_latency = 1.0e-6, **kwds):
+        super().__init__(**kwds)
+        self.bins_per_decade = bins_per_decade
+        self.min_latency = min_latency
+        self.n_bins = bins_per_decade * decades
+        self.reset()
+
+    def add(self, latency):
+        if (latency > self.min_latency):
+            index = int(self.bins_per_decade * math.log10(latency/self.min_latency))
+            if (index >= self.n_bins):
+                index = self.n_bins - 1
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.n += 1
+        self.total += latency
+        if (latency > self.max):
+            self.max = latency
+
+    def binEdge(self, index):
+        """
+        The upper edge of bin index in seconds.
+        """
+        return self.min_latency * math.pow(10.0, (index + 1)/self.bins_per_decade)
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the statistics in milliseconds. The
+        percentiles are the upper edges of the corresponding bins.
+        """
+        stats = {"count" : self.n,
+                 "mean" : 0.0,
+                 "max" : 1000.0 * self.max,
+                 "p50" : 1000.0 * self.percentile(50.0),
+                 "p90" : 1000.0 * self.percentile(90.0),
+                 "p99" : 1000.0 * self.percentile(99.0),
+                 "histogram" : list(self.counts)}
+        if (self.n > 0):
+            stats["mean"] = 1000.0 * self.total/self.n
+        return stats
+
+    def percentile(self, percent):
+        if (self.n == 0):
+            return 0.0
+        target = 0.01 * percent * self.n
+        total = 0
+        for i in range(self.n_bins):
+            total += self.counts[i]
+            if (total >= target):
+                return min(self.binEdge(i), self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * self.n_bins
+        self.max = 0.0
+        self.n = 0
+        self.total = 0.0
+
+
+class FrameTracer(object):
+    """
+    Collects per camera / feed, per stage latency histograms.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.enabled = False
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def getStatistics(self, camera_name = None):
+        """
+        Returns a dictionary keyed by camera / feed name of dictionaries keyed
+        by stage. If camera_name is specified this only includes that camera
+        and it's feeds.
+        """
+        stats = {}
+        self.lock.acquire()
+        for [name, stage] in sorted(self.histograms):
+            if matchCamera(name, camera_name):
+                if not name in stats:
+                    stats[name] = {}
+                stats[name][stage] = self.histograms[(name, stage)].getStatistics()
+        self.lock.release()
+        return stats
+
+    def isEnabled(self):
+        return self.enabled
+
+    def record(self, camera_name, stage, latency):
+        self.lock.acquire()
+        key = (camera_name, stage)
+        if not key in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        self.histograms[key].add(latency)
+        self.lock.release()
+
+    def reset(self, camera_name = None):
+        self.lock.acquire()
+        for key in list(self.histograms):
+            if matchCamera(key[0], camera_name):
+                del self.histograms[key]
+        self.lock.release()
+
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+
+
+def matchCamera(name, camera_name):
+    """
+    True if name is camera_name or one of it's feeds (or camera_name is None).
+    """
+    if camera_name is None:
+        return True
+    return (name == camera_name) or name.startswith(camera_name + ".")
+
+
+def traceFrame(aframe, stage, start_time, end_time):
+    """
+    Record the latency of a frame for a stage, this does nothing if tracing
+    is not enabled or the frame does not have the necessary time stamps.
+    """
+    if tracer.enabled and (start_time is not None) and (end_time is not None):
+        tracer.record(aframe.which_camera, stage, end_time - start_time)
+
+
+# The tracer that is used by all of HAL.
+tracer = FrameTracer()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -2,19 +2,24 @@
 """
 This class provides software emulation of a camera for testing purposes.
 
+The frames are generated by camera.frameSimulator, the content is set
+with the 'content' parameter. Frames are paced against the clock, if
+the emulation falls behind the frames that are due are sent as a batch.
+
 Hazen 02/17
 """
 
 import ctypes
-import numpy
 import random
 import time
 from PyQt5 import QtCore
 
+import storm_control.sc_library.framePool as framePool
 import storm_control.sc_library.parameters as params
 import storm_control.hal4000.camera.cameraControl as cameraControl
 import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
 import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.frameSimulator as frameSimulator
 
 
 class NoneCameraControl(cameraControl.CameraControl):
@@ -23,10 +28,17 @@ class NoneCameraControl(cameraControl.CameraControl):
         kwds["config"] = config
         super().__init__(**kwds)
         
-        self.fake_frame = 0
         self.fake_frame_size = [0,0]
+        self.frame_pool = None
+        self.frame_simulator = None
+        self.max_batch = config.get("max_batch", 100)
         self.pause_time = config.get("mean_pause", 0.1)
 
+        # Random number generator seed for the emulation, -1 is random.
+        self.seed = config.get("seed", -1)
+        if (self.seed < 0):
+            self.seed = None
+
         #
         # The camera functionality. Note the connection to self.parameters
         # which should not be changed to point to some other parameters
@@ -52,11 +64,11 @@ class NoneCameraControl(cameraControl.CameraControl):
         self.parameters.set("exposure_time", params.ParameterRangeFloat(description = "Exposure time (seconds)", 
                                                                         name = "exposure_time", 
                                                                         value = 0.02,
-                                                                        min_value = 0.01,
+                                                                        min_value = 0.001,
                                                                         max_value = 10.0))
         self.parameters.setv("max_intensity", 512)
         
-        chip_size = 512
+        chip_size = config.get("chip_size", 512)
         for pname in ["x_start", "x_end", "y_start", "y_end"]:
             self.parameters.getp(pname).setMaximum(chip_size)
 
@@ -75,6 +87,36 @@ class NoneCameraControl(cameraControl.CameraControl):
                                                        max_value = 1.0))
         self.parameters.setv("roll", config.get("roll"))
 
+        self.parameters.add(params.ParameterSetString(description = "Emulated frame content",
+                                                      name = "content",
+                                                      value = "static",
+                                                      allowed = frameSimulator.contents))
+        self.parameters.setv("content", config.get("content", "static"))
+
+        self.parameters.add(params.ParameterRangeFloat(description = "Background (photons/pixel)",
+                                                       name = "background",
+                                                       value = config.get("background", 20.0),
+                                                       min_value = 0.0,
+                                                       max_value = 10000.0))
+
+        self.parameters.add(params.ParameterRangeInt(description = "Number of emitters",
+                                                     name = "emitters",
+                                                     value = config.get("emitters", 200),
+                                                     min_value = 0,
+                                                     max_value = 100000))
+
+        self.parameters.add(params.ParameterRangeFloat(description = "Emitter intensity (photons)",
+                                                       name = "emitter_intensity",
+                                                       value = config.get("emitter_intensity", 2000.0),
+                                                       min_value = 0.0,
+                                                       max_value = 100000.0))
+
+        self.parameters.add(params.ParameterRangeFloat(description = "Focus offset (um)",
+                                                       name = "focus_offset",
+                                                       value = 0.0,
+                                                       min_value = -10.0,
+                                                       max_value = 10.0))
+
         self.parameters.add(params.ParameterRangeInt(description = "EMCCD gain",
                                                      name = "emccd_gain",
                                                      value = 10,
@@ -94,6 +136,12 @@ class NoneCameraControl(cameraControl.CameraControl):
 
         self.newParameters(self.parameters, initialization = True)
 
+    def getEmitters(self):
+        """
+        The ground truth emitter positions (see frameSimulator).
+        """
+        return self.frame_simulator.getEmitters()
+
     def newParameters(self, parameters, initialization = False):
         size_x = parameters.get("x_end") - parameters.get("x_start") + 1
         size_y = parameters.get("y_end") - parameters.get("y_start") + 1
@@ -126,16 +174,27 @@ class NoneCameraControl(cameraControl.CameraControl):
 
             # Configure camera.
             p = self.parameters
-            if (p.get("exposure_time") < 0.010):
-                p.set("exposure_time", 0.010)
+            if (p.get("exposure_time") < 0.001):
+                p.set("exposure_time", 0.001)
 
             p.set("fps", 1.0/p.get("exposure_time"))
 
             self.fake_frame_size = [size_x, size_y]
-            self.fake_frame = numpy.zeros(size_x * size_y, dtype = numpy.uint16)
-            for i in range(size_x):
-                for j in range(size_y):
-                    self.fake_frame[j*size_x+i] = i % 128 + j % 128
+            self.frame_simulator = frameSimulator.FrameSimulator(background = p.get("background"),
+                                                                 content = p.get("content"),
+                                                                 emitter_intensity = p.get("emitter_intensity"),
+                                                                 emitters = p.get("emitters"),
+                                                                 focus_offset = p.get("focus_offset"),
+                                                                 roll = p.get("roll"),
+                                                                 seed = self.seed,
+                                                                 x_pixels = size_x,
+                                                                 y_pixels = size_y)
+
+            frame_bytes = 2 * size_x * size_y
+            self.frame_pool = framePool.FramePool(frame_bytes = frame_bytes,
+                                                  n_buffers = framePool.poolSize(frame_bytes,
+                                                                                 max_bytes = 64 * 1024 * 1024,
+                                                                                 max_buffers = 200))
 
             if running:
                 self.startCamera()
@@ -149,25 +208,38 @@ class NoneCameraControl(cameraControl.CameraControl):
         
         self.running = True
         self.thread_started = True
+        period = self.parameters.get("exposure_time")
+        next_time = time.perf_counter() + period
         while(self.running):
-            aframe = frame.Frame(numpy.roll(self.fake_frame,
-                                            int(self.frame_number * self.parameters.get("roll"))),
-                                 self.frame_number,
-                                 self.fake_frame_size[0],
-                                 self.fake_frame_size[1],
-                                 self.camera_name)
-            self.frame_number += 1
-
-            if self.film_length is not None:
-                if (self.frame_number == self.film_length):
-                    self.running = False
 
-            # Emit new data signal.
-            self.newData.emit([aframe])
+            # Wait until the next frame is due.
+            now = time.perf_counter()
+            if (now < next_time):
+                time.sleep(next_time - now)
+                now = time.perf_counter()
 
-            # Sleep if we're still running.
-            if self.running:
-                self.msleep(int(1000.0 * self.parameters.get("exposure_time")))
+            # Make all the frames that are due (up to max_batch).
+            n_frames = min(1 + int((now - next_time)/period), self.max_batch)
+            frames = []
+            for i in range(n_frames):
+                frame_data = self.frame_pool.getFrameData()
+                self.frame_simulator.newFrame(self.frame_number, frame_data.getData())
+                frames.append(frame.Frame(frame_data.getData(),
+                                          self.frame_number,
+                                          self.fake_frame_size[0],
+                                          self.fake_frame_size[1],
+                                          self.camera_name,
+                                          acquisition_time = next_time))
+                self.frame_number += 1
+                next_time += period
+
+                if self.film_length is not None:
+                    if (self.frame_number == self.film_length):
+                        self.running = False
+                        break
+
+            # Emit new data signal.
+            self.newData.emit(frames)
 
         # Also pause on stop.
         #time.sleep(random.expovariate(1.0/self.pause_time))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+A camera that plays back a film that was recorded earlier (a .dax or
+.tif file with the corresponding .xml file) as if it were a live
+camera. This is for benchmarking and testing the downstream modules
+(feeds, image writers, spot counter, etc.) with realistic data.
+
+The film is memory mapped (where possible) and a reader thread copies
+the frames into frame pool buffers ahead of the camera thread, so the
+file reading is not what limits the frame rate. The frames are paced
+against the clock as for the emulated camera, by default at the frame
+rate that the film was recorded at. The film is played in a loop.
+
+To use it in one of the none_*.xml configuration files replace the
+NoneCameraControl class / module with ReplayCameraControl and add a
+'film' parameter, for example:
+
+  <class_name type="string">ReplayCameraControl</class_name>
+  <module_name type="string">storm_control.hal4000.camera.replayCameraControl</module_name>
+  <parameters>
+    <film type="string">C:/Data/movie_01.dax</film>
+    ...
+"""
+
+import numpy
+import os
+import queue
+import random
+import threading
+import time
+
+import storm_control.sc_library.datareader as datareader
+import storm_control.sc_library.framePool as framePool
+import storm_control.sc_library.parameters as params
+import storm_control.hal4000.camera.cameraControl as cameraControl
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.camera.frame as frame
+
+
+class ReplayCameraControl(cameraControl.CameraControl):
+    """
+    Configuration parameters (in addition to the usual camera parameters):
+
+      film - The film to play back.
+      fps - The frame rate, 0.0 (the default) is the rate the film was
+            recorded at (or 10.0 if this is not known).
+      read_ahead - The maximum number of frames to read ahead.
+      max_batch - The maximum number of frames to send at once.
+    """
+    def __init__(self, config = None, is_master = False, **kwds):
+        kwds["config"] = config
+        super().__init__(**kwds)
+
+        self.frame_pool = None
+        self.frame_size = [0, 0]
+        self.loader = None
+        self.loader_stop = None
+        self.max_batch = config.get("max_batch", 100)
+        self.pause_time = config.get("mean_pause", 0.1)
+        self.read_ahead = max(1, config.get("read_ahead", 32))
+        self.ready = None
+
+        #
+        # Open the film. If the film is memory mapped we copy the frames
+        # directly from the map, otherwise we use the readers loadAFrame().
+        #
+        filename = os.path.expanduser(config.get("film"))
+        if not os.path.exists(filename):
+            raise cameraControl.CameraException("Replay film " + filename + " does not exist.")
+        self.film = datareader.reader(filename)
+        self.film_frames = self.film.cameraFrames()
+        [self.film_x, self.film_y, self.film_length_frames] = self.film.filmSize()
+        if (self.film_length_frames == 0):
+            raise cameraControl.CameraException("Replay film " + filename + " has no frames.")
+
+        fps = config.get("fps", 0.0)
+        if (fps <= 0.0):
+            fps = self.film.filmParameters().get(self.film.camera + ".fps", 10.0)
+
+        #
+        # The camera functionality. Note the connection to self.parameters
+        # which should not be changed to point to some other parameters
+        # object when the parameters change. This is enforced by the
+        # getCameraConfiguration() method.
+        #
+        self.camera_functionality = cameraFunctionality.CameraFunctionality(camera_name = self.camera_name,
+                                                                            is_master = is_master,
+                                                                            parameters = self.parameters)
+
+        #
+        # Override defaults with camera specific values.
+        #
+        self.parameters.set("exposure_time", params.ParameterRangeFloat(description = "Exposure time (seconds)",
+                                                                        name = "exposure_time",
+                                                                        value = 1.0/fps,
+                                                                        min_value = 0.0001,
+                                                                        max_value = 10.0))
+        self.parameters.setv("max_intensity", 65535)
+
+        for [pname, size] in [["x_start", self.film_x], ["x_end", self.film_x],
+                              ["y_start", self.film_y], ["y_end", self.film_y]]:
+            self.parameters.getp(pname).setMaximum(size)
+
+        self.parameters.setv("x_end", self.film_x)
+        self.parameters.setv("y_end", self.film_y)
+        self.parameters.setv("x_chip", self.film_x)
+        self.parameters.setv("y_chip", self.film_y)
+
+        #
+        # Replay camera specific parameters.
+        #
+        self.parameters.add(params.ParameterString(description = "Film",
+                                                   name = "film",
+                                                   value = filename,
+                                                   is_mutable = False))
+
+        self.newParameters(self.parameters, initialization = True)
+
+    def cleanUp(self):
+        super().cleanUp()
+        self.film_frames = None
+        self.film.closeFilePtr()
+
+    def copyFrame(self, index, np_data):
+        """
+        Copy the (ROI of the) film frame index into np_data.
+        """
+        if self.film_frames is not None:
+            film_data = self.film_frames[index]
+        else:
+            film_data = numpy.transpose(self.film.loadAFrame(index)).ravel()
+
+        [x_start, y_start] = [self.parameters.get("x_start") - 1, self.parameters.get("y_start") - 1]
+        if (self.frame_size == [self.film_x, self.film_y]):
+            numpy.copyto(np_data, film_data, casting = "unsafe")
+        else:
+            film_data = film_data.reshape(self.film_y, self.film_x)
+            numpy.copyto(np_data.reshape(self.frame_size[1], self.frame_size[0]),
+                         film_data[y_start:y_start + self.frame_size[1], x_start:x_start + self.frame_size[0]],
+                         casting = "unsafe")
+
+    def loadFrames(self, stop_event):
+        """
+        This runs in it's own thread, keeping the ready queue full.
+        """
+        index = 0
+        while not stop_event.is_set():
+            frame_data = self.frame_pool.getFrameData()
+            self.copyFrame(index % self.film_length_frames, frame_data.getData())
+            while not stop_event.is_set():
+                try:
+                    self.ready.put(frame_data, timeout = 0.1)
+                    break
+                except queue.Full:
+                    pass
+            index += 1
+
+    def newParameters(self, parameters, initialization = False):
+        size_x = parameters.get("x_end") - parameters.get("x_start") + 1
+        size_y = parameters.get("y_end") - parameters.get("y_start") + 1
+        parameters.setv("x_pixels", size_x)
+        parameters.setv("y_pixels", size_y)
+        parameters.setv("bytes_per_frame", 2 * size_x * size_y)
+
+        super().newParameters(parameters)
+
+        # Figure out which parameters have changed.
+        if initialization:
+            changed_p_names = parameters.getAttrs()
+        else:
+            changed_p_names = params.difference(parameters, self.parameters)
+
+        # Check if we actually need to do anything.
+        if (len(changed_p_names) > 0):
+            running = self.running
+            if running:
+                self.stopCamera()
+
+            p = self.parameters
+            for pname in changed_p_names:
+                p.set(pname, parameters.get(pname))
+
+            if (p.get("exposure_time") < 0.0001):
+                p.set("exposure_time", 0.0001)
+            p.set("fps", 1.0/p.get("exposure_time"))
+
+            # The pool has to hold the read ahead frames as well as the
+            # frames that are on their way through HAL.
+            self.frame_size = [size_x, size_y]
+            frame_bytes = 2 * size_x * size_y
+            n_buffers = framePool.poolSize(frame_bytes,
+                                           max_bytes = 64 * 1024 * 1024,
+                                           max_buffers = 200)
+            self.frame_pool = framePool.FramePool(frame_bytes = frame_bytes,
+                                                  n_buffers = max(n_buffers, 2 * self.read_ahead))
+
+            if running:
+                self.startCamera()
+
+            self.camera_functionality.parametersChanged.emit()
+
+    def run(self):
+
+        # Start reading ahead while we pause.
+        self.ready = queue.Queue(maxsize = self.read_ahead)
+        self.loader_stop = threading.Event()
+        self.loader = threading.Thread(target = self.loadFrames,
+                                       args = (self.loader_stop,),
+                                       daemon = True)
+        self.loader.start()
+
+        # Pause a random amount of time on start.
+        time.sleep(random.expovariate(1.0/self.pause_time))
+
+        self.running = True
+        self.thread_started = True
+        period = self.parameters.get("exposure_time")
+        next_time = time.perf_counter() + period
+        while(self.running):
+
+            # Wait until the next frame is due.
+            now = time.perf_counter()
+            if (now < next_time):
+                time.sleep(next_time - now)
+                now = time.perf_counter()
+
+            # Send all the frames that are due (up to max_batch). If the
+            # reader has fallen behind we wait for it.
+            n_frames = min(1 + int((now - next_time)/period), self.max_batch)
+            frames = []
+            for i in range(n_frames):
+                try:
+                    frame_data = self.ready.get(timeout = 1.0)
+                except queue.Empty:
+                    break
+                frames.append(frame.Frame(frame_data.getData(),
+                                          self.frame_number,
+                                          self.frame_size[0],
+                                          self.frame_size[1],
+                                          self.camera_name,
+                                          acquisition_time = next_time))
+                self.frame_number += 1
+                next_time += period
+
+                if self.film_length is not None:
+                    if (self.frame_number == self.film_length):
+                        self.running = False
+                        break
+
+            if (len(frames) > 0):
+                self.newData.emit(frames)
+
+        self.loader_stop.set()
+        self.loader.join()
+        self.loader = None
+        self.ready = None
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
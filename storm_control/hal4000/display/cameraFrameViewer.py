@@ -14,12 +14,15 @@ frame display. This includes:
 Hazen 2/17
 """
 import os
+import time
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
+import storm_control.hal4000.camera.frameGaps as frameGaps
+import storm_control.hal4000.camera.frameTracing as frameTracing
 import storm_control.hal4000.colorTables.colorTables as colorTables
 import storm_control.hal4000.halLib.halFunctionality as halFunctionality
 import storm_control.hal4000.halLib.halMessage as halMessage
@@ -111,6 +114,7 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.display_timer = QtCore.QTimer(self)
         self.filming = False
         self.frame = False
+        self.gap_detector = None
         self.parameters = False
         self.rubber_band_rect = None
         self.show_grid = False
@@ -324,7 +328,13 @@ class CameraFrameViewer(QtWidgets.QFrame):
 
     def handleDisplayTimer(self):
         if self.frame:
-            self.camera_widget.updateImageWithFrame(self.frame)
+            [visible_rect, view_scale] = self.camera_view.getVisibleRegion()
+            self.camera_widget.updateImageWithFrame(self.frame,
+                                                    visible_rect = visible_rect,
+                                                    view_scale = view_scale)
+            if self.frame.display_time is None:
+                self.frame.display_time = time.perf_counter()
+                frameTracing.traceFrame(self.frame, "display", self.frame.acquisition_time, self.frame.display_time)
             if self.show_info:
                 self.handleIntensityInfo(*self.camera_widget.getIntensityInfo())
             if self.cfv_functionality.isConnected():
@@ -347,11 +357,11 @@ class CameraFrameViewer(QtWidgets.QFrame):
         # Disconnect current camera functionality. Anything that results
         # in a change in the camera functionality should pass through
         # this method, otherwise we can end up with multiple camera
-        # functionalities connected to handleNewFrame, which will be a
+        # functionalities connected to handleNewFrames, which will be a
         # mess..
         #
         if self.cam_fn is not None:
-            self.cam_fn.newFrame.disconnect(self.handleNewFrame)
+            self.cam_fn.newFrames.disconnect(self.handleNewFrames)
             
         self.parameters.setv("feed_name", str(feed_name))
         self.feedChange.emit(feed_name)
@@ -386,12 +396,19 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.setParameter("center_y", cy)
         self.camera_widget.setClickPos(*self.cam_fn.transformChipToFrame(cx, cy))
 
-    def handleNewFrame(self, frame):
+    def handleNewFrames(self, frames):
+        """
+        Only the last (appropriate) frame of a batch is ever displayed.
+        """
+        self.gap_detector.checkFrames(frames)
         if self.filming and (self.getParameter("sync") != 0):
-            if((frame.frame_number % self.cycle_length) == (self.getParameter("sync") - 1)):
-                self.frame = frame
+            sync = self.getParameter("sync") - 1
+            for frame in reversed(frames):
+                if ((frame.frame_number % self.cycle_length) == sync):
+                    self.frame = frame
+                    break
         else:
-            self.frame = frame
+            self.frame = frames[-1]
 
     def handleNewScale(self, scale):
         self.setParameter("scale", scale)
@@ -474,7 +491,7 @@ class CameraFrameViewer(QtWidgets.QFrame):
         # A sanity check that the old camera functionality is disconnected.
         if self.cam_fn is not None:
             try:
-                self.cam_fn.newFrame.disconnect(self.handleNewFrame)
+                self.cam_fn.newFrames.disconnect(self.handleNewFrames)
             except TypeError:
                 pass
             else:
@@ -483,7 +500,9 @@ class CameraFrameViewer(QtWidgets.QFrame):
                 
         # Connect new camera functionality.
         self.cam_fn = camera_functionality
-        self.cam_fn.newFrame.connect(self.handleNewFrame)
+        self.cam_fn.newFrames.connect(self.handleNewFrames)
+        self.gap_detector = frameGaps.monitor.getDetector(self.cam_fn.getCameraName(), "display", self.display_name)
+        self.gap_detector.restart()
 
         #
         # Add a sub-section for this camera / feed if we don't already have one.
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Processing of feed frames in a pool of worker threads instead of in
+the GUI thread. Most of the work in the feeds is done by numpy which
+releases the GIL, so different feeds (and different batches of frames
+for feeds that don't keep any state) can be processed in parallel.
+
+Feeds that keep state between frames (averaging, etc.) process one
+batch at a time, in order. Feeds that don't (slicing) can have several
+batches in process at once. Either way the feed frames are emitted in
+the order that the camera frames arrived.
+"""
+
+import collections
+import threading
+import time
+import traceback
+
+from PyQt5 import QtCore
+
+
+class FeedJob(QtCore.QRunnable):
+    """
+    Runnable for processing a batch of frames for a feed.
+    """
+    def __init__(self, feed = None, frames = None, sequence = None, signaler = None, **kwds):
+        super().__init__(**kwds)
+        self.done = threading.Event()
+        self.error = None
+        self.feed = feed
+        self.feed_frames = []
+        self.frames = frames
+        self.process_time = 0.0
+        self.sequence = sequence
+        self.signaler = signaler
+        self.stale = False
+
+    def run(self):
+        start_time = time.perf_counter()
+        try:
+            self.feed_frames = self.feed.processFrames(self.frames)
+        except Exception as exception:
+            self.error = exception
+        self.process_time = time.perf_counter() - start_time
+        self.done.set()
+        self.signaler.jobDone.emit(self)
+
+
+class FeedJobSignaler(QtCore.QObject):
+    """
+    Signal class used by FeedJob to indicate that it is done.
+    """
+    jobDone = QtCore.pyqtSignal(object)
+
+
+class FeedWorker(QtCore.QObject):
+    """
+    Schedules the processing of the frames for a single feed and
+    re-sequences the results.
+
+    At most max_in_flight camera frames can be waiting for / in process,
+    batches that would exceed this are dropped. These are only counted
+    in the worker statistics, the feed's gap detector will see them as
+    a gap in the frame numbers (if the feed uses the camera frame numbers).
+    """
+    def __init__(self, feed = None, max_in_flight = None, threadpool = None, **kwds):
+        super().__init__(**kwds)
+        self.feed = feed
+        self.in_flight = 0
+        self.max_in_flight = max_in_flight
+        self.next_emit = 0
+        self.next_sequence = 0
+        self.pending = collections.deque()
+        self.results = {}
+        self.running = []
+        self.threadpool = threadpool
+
+        self.signaler = FeedJobSignaler()
+        self.signaler.jobDone.connect(self.handleJobDone)
+
+        self.resetStatistics()
+
+    def drain(self):
+        """
+        Discard the batches that are waiting and wait for the ones that
+        are being processed, so that the feed can be reset safely. The
+        results of these batches are never emitted.
+        """
+        self.pending.clear()
+        for job in self.running:
+            job.done.wait()
+            job.stale = True
+        self.running = []
+        self.in_flight = 0
+        self.next_emit = 0
+        self.next_sequence = 0
+        self.results = {}
+        self.feed.handleWorkerIdle()
+
+    def getStatistics(self):
+        """
+        Times are in milliseconds.
+        """
+        stats = {"batches" : self.n_batches,
+                 "dropped" : self.n_dropped,
+                 "errors" : self.n_errors,
+                 "frames" : self.n_frames,
+                 "max_in_flight" : self.max_in_flight_seen,
+                 "max_time" : 1.0e+3 * self.max_time,
+                 "mean_time" : 0.0}
+        if (self.n_frames > 0):
+            stats["mean_time"] = 1.0e+3 * self.total_time/self.n_frames
+        return stats
+
+    def handleJobDone(self, job):
+        """
+        This is called in the GUI thread.
+        """
+        # This job was running when the worker was drained.
+        if job.stale:
+            return
+
+        self.running.remove(job)
+        self.in_flight -= len(job.frames)
+
+        self.n_batches += 1
+        self.n_frames += len(job.frames)
+        self.total_time += job.process_time
+        if (job.process_time > self.max_time):
+            self.max_time = job.process_time
+
+        # Emit the results that are ready, in order. A job that failed
+        # has no results, but we still have to move past it.
+        if job.error is not None:
+            self.results[job.sequence] = []
+        else:
+            self.results[job.sequence] = job.feed_frames
+        while self.next_emit in self.results:
+            self.feed.emitFeedFrames(self.results.pop(self.next_emit))
+            self.next_emit += 1
+
+        self.startJobs()
+
+        if not self.isBusy():
+            self.feed.handleWorkerIdle()
+
+        # Report the error, raising it here would kill HAL.
+        if job.error is not None:
+            self.n_errors += 1
+            print(">> Error processing frames for feed", self.feed.getCameraName())
+            traceback.print_exception(type(job.error), job.error, job.error.__traceback__)
+
+    def isBusy(self):
+        return (self.in_flight > 0)
+
+    def resetStatistics(self):
+        self.max_in_flight_seen = 0
+        self.max_time = 0.0
+        self.n_batches = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.n_frames = 0
+        self.total_time = 0.0
+
+    def startJobs(self):
+        while (len(self.pending) > 0) and (self.feed.isStateless() or (len(self.running) == 0)):
+            job = self.pending.popleft()
+            self.running.append(job)
+            self.threadpool.start(job)
+
+    def submit(self, frames):
+        if ((self.in_flight + len(frames)) > self.max_in_flight):
+            self.n_dropped += len(frames)
+            return
+
+        self.in_flight += len(frames)
+        if (self.in_flight > self.max_in_flight_seen):
+            self.max_in_flight_seen = self.in_flight
+
+        job = FeedJob(feed = self.feed,
+                      frames = frames,
+                      sequence = self.next_sequence,
+                      signaler = self.signaler)
+        job.setAutoDelete(False)
+        self.next_sequence += 1
+        self.pending.append(job)
+        self.startJobs()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -3,6 +3,12 @@
 This module enables the processing of camera frame(s) with
 operations like averaging, slicing, etc..
 
+The source of a feed is either a camera or another feed (using the
+feed name from the parameters file). Feeds are lazy, a feed only
+connects to it's source, and so only processes frames, while at
+least one thing (a display, an image writer, another feed, etc.) is
+connected to it's newFrames or newFrame signal.
+
 It is also responsible for keeping tracking of how many
 different cameras / feeds are available for each parameter
 file, whether the cameras / feeds should be saved when
@@ -16,11 +22,14 @@ import numpy
 
 from PyQt5 import QtCore
 
+import storm_control.sc_library.framePool as framePool
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.frameGaps as frameGaps
 import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.feeds.feedWorkers as feedWorkers
 import storm_control.hal4000.halLib.halMessage as halMessage
 import storm_control.hal4000.halLib.halModule as halModule
 
@@ -36,25 +45,85 @@ def checkParameters(parameters):
         return
 
     # Check the feed parameters. For now all we are doing is verifying that
-    # the feed ROI area is a multiple of 4.
+    # the feed sources exist, that the binning / decimation is valid and that
+    # the feed ROI area is a multiple of 4 and not empty.
     #
     feed_parameters = parameters.get("feeds")
     for feed_name in feed_parameters.getAttrs():
         fp = feed_parameters.get(feed_name)
-        cp = parameters.get(fp.get("source"))
-
-        x_start = fp.get("x_start", 1)
-        x_end = fp.get("x_end", cp.get("x_pixels"))
-        x_pixels = x_end - x_start + 1
+        feed_type = fp.get("feed_type", "")
+        if (feed_type == "bin"):
+            if (fp.get("bin_x", 2) < 1) or (fp.get("bin_y", 2) < 1):
+                raise FeedException("The binning must be at least 1 in " + feed_name)
+        elif (feed_type == "decimate"):
+            if (fp.get("target_size", 512) < 1):
+                raise FeedException("The target size must be at least 1 in " + feed_name)
 
-        y_start = fp.get("y_start", 1)
-        y_end = fp.get("y_end", cp.get("y_pixels"))
-        y_pixels = y_end - y_start + 1
+    for feed_name in feed_parameters.getAttrs():
+        [x_pixels, y_pixels] = feedSize(parameters, feed_name)
         
         # Check that the feed size is a multiple of 4 in x.
         if not ((x_pixels % 4) == 0):
             raise FeedException("The x size of the feed ROI must be a multiple of 4 in " + feed_name)
 
+        # Check that the feed is not empty.
+        if (x_pixels < 4) or (y_pixels < 1):
+            raise FeedException("The feed ROI is too small in " + feed_name)
+
+
+def feedSize(parameters, feed_name, visited = None):
+    """
+    Returns the [x_pixels, y_pixels] size of a feed, following the
+    chain of sources back to the camera.
+    """
+    if visited is None:
+        visited = []
+    if feed_name in visited:
+        raise FeedException("Feed '" + feed_name + "' is it's own source.")
+    visited.append(feed_name)
+
+    fp = parameters.get("feeds").get(feed_name)
+    source = fp.get("source")
+    if parameters.get("feeds").has(source):
+        [source_x, source_y] = feedSize(parameters, source, visited)
+    elif parameters.has(source):
+        cp = parameters.get(source)
+        [source_x, source_y] = [cp.get("x_pixels"), cp.get("y_pixels")]
+    else:
+        raise FeedException("Unknown source '" + source + "' for feed '" + feed_name + "'")
+
+    x_pixels = fp.get("x_end", source_x) - fp.get("x_start", 1) + 1
+    y_pixels = fp.get("y_end", source_y) - fp.get("y_start", 1) + 1
+
+    # Some feeds change the size of the image.
+    feed_type = fp.get("feed_type", "")
+    if (feed_type == "bin"):
+        [x_pixels, y_pixels] = binnedSize(x_pixels, y_pixels, fp.get("bin_x", 2), fp.get("bin_y", 2))[:2]
+    elif (feed_type == "decimate"):
+        [x_pixels, y_pixels] = decimatedSize(x_pixels, y_pixels, fp.get("target_size", 512))[:2]
+    return [x_pixels, y_pixels]
+
+
+def binnedSize(x_pixels, y_pixels, bin_x, bin_y):
+    """
+    Returns [x_pixels, y_pixels, x scale, y scale] for binning the feed
+    ROI, any pixels left over at the edges are ignored. The x size is
+    trimmed to a multiple of 4.
+    """
+    return [4 * ((x_pixels//bin_x)//4), y_pixels//bin_y, bin_x, bin_y]
+
+
+def decimatedSize(x_pixels, y_pixels, target_size):
+    """
+    Returns [x_pixels, y_pixels, x scale, y scale] for decimating the
+    feed ROI so that it is no larger than target_size. The x size is
+    trimmed to a multiple of 4.
+    """
+    step = max(1, -(-max(x_pixels, y_pixels)//target_size))
+    x_pixels = 4 * ((-(-x_pixels//step))//4)
+    y_pixels = -(-y_pixels//step)
+    return [x_pixels, y_pixels, step, step]
+
 
 class FeedException(halExceptions.HalException):
     pass
@@ -70,15 +139,31 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
 
     Some functionality is explicitly blocked so we get an error if we accidentally
     try and use this exactly like a camera functionality.
+
+    Sub-classes should override processFrame(), and isStateless() if
+    the frames can be processed independently of each other. Feeds
+    that change the size of the image should also override outputSize().
+
+    The number of subscribers is the number of connections to the
+    newFrames and newFrame signals. This relies on the subscribers
+    explicitly disconnecting when they are done, as everything in HAL
+    does. Connections that are only dropped when the subscriber is
+    garbage collected are not seen by disconnectNotify().
     """
     def __init__(self, feed_name = None, **kwds):
         super().__init__(**kwds)
+        self.active = False
         self.cam_fn = None
         self.feed_name = feed_name
         self.feed_parameters = self.parameters
         self.frame_number = 0
+        self.frame_pool = None
         self.frame_slice = None
+        self.gap_detector = frameGaps.monitor.getDetector(self.camera_name, "feed")
         self.number_connections = 0
+        self.number_subscribers = 0
+        self.stop_pending = False
+        self.worker = None
         self.x_pixels = 0
         self.y_pixels = 0
 
@@ -90,15 +175,22 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
 
     def connectCameraFunctionality(self):
         """
-        Connect the feed to it's camera functionality
+        Connect the feed to it's camera functionality. The feed only
+        gets frames from the camera functionality while it is active.
         """
         # sanity check.
         assert(self.number_connections == 0)
         self.number_connections += 1
         
-        self.cam_fn.newFrame.connect(self.handleNewFrame)
         self.cam_fn.started.connect(self.handleStarted)
         self.cam_fn.stopped.connect(self.handleStopped)
+        self.updateActive()
+
+    def connectNotify(self, signal):
+        if signal.name() in [b"newFrame", b"newFrames"]:
+            self.number_subscribers += 1
+            self.updateActive()
+        super().connectNotify(signal)
 
     def disconnectCameraFunctionality(self):
         """
@@ -109,9 +201,20 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
         self.number_connections += 1
         
         if self.cam_fn is not None:
-            self.cam_fn.newFrame.disconnect(self.handleNewFrame)
             self.cam_fn.started.disconnect(self.handleStarted)
             self.cam_fn.stopped.disconnect(self.handleStopped)
+        self.updateActive()
+
+    def disconnectNotify(self, signal):
+        if signal.name() in [b"newFrame", b"newFrames"]:
+            self.number_subscribers -= 1
+            self.updateActive()
+        super().disconnectNotify(signal)
+
+    def emitFeedFrames(self, feed_frames):
+        if (len(feed_frames) > 0):
+            self.gap_detector.checkFrames(feed_frames)
+            self.emitNewFrames(feed_frames)
 
     def getCameraFunctionality(self):
         """
@@ -119,25 +222,56 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
         """
         return self.cam_fn
 
+    def getFeedData(self):
+        """
+        Returns a (y_pixels, x_pixels) numpy.uint16 array for the data
+        of a new feed frame. These come from a pool so feeds that create
+        their own images don't have to allocate memory for every frame.
+        """
+        return self.frame_pool.getFrameData().getData().reshape(self.y_pixels, self.x_pixels)
+
     def getFeedName(self):
         """
         Return the name of the feed (as specified in the XML file).
         """
         return self.feed_name
 
-    def handleNewFrame(self, new_frame):
-        sliced_data = self.sliceFrame(new_frame)
-        self.newFrame.emit(frame.Frame(sliced_data,
-                                       new_frame.frame_number,
-                                       self.x_pixels,
-                                       self.y_pixels,
-                                       self.camera_name))
+    def getWorkerStatistics(self):
+        """
+        Returns None if this feed is processed in the GUI thread.
+        """
+        if self.worker is None:
+            return None
+        return self.worker.getStatistics()
+
+    def handleNewFrames(self, new_frames):
+        """
+        Process a batch of frames from the camera and emit the resulting
+        batch of feed frames (if any).
+        """
+        if self.worker is None:
+            self.emitFeedFrames(self.processFrames(new_frames))
+        else:
+            self.worker.submit(new_frames)
 
     def handleStarted(self):
         self.started.emit()
 
     def handleStopped(self):
-        self.stopped.emit()
+        """
+        If some of the frames are still being processed we wait for
+        them before passing on the stopped signal, otherwise the image
+        writers would close the film before they got the last frames.
+        """
+        if (self.worker is not None) and self.worker.isBusy():
+            self.stop_pending = True
+        else:
+            self.stopped.emit()
+
+    def handleWorkerIdle(self):
+        if self.stop_pending:
+            self.stop_pending = False
+            self.stopped.emit()
 
     def hasEMCCD(self):
         assert False
@@ -154,14 +288,70 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
     def haveCameraFunctionality(self):
         return (not self.cam_fn is None)
         
+    def isActive(self):
+        return self.active
+
     def isCamera(self):
         return False
 
     def isMaster(self):
         return False
 
+    def isStateless(self):
+        return False
+
+    def newFeedFrame(self, feed_data):
+        """
+        Returns a feed frame with the data from getFeedData().
+        """
+        feed_frame = frame.Frame(feed_data.reshape(-1),
+                                 self.frame_number,
+                                 self.x_pixels,
+                                 self.y_pixels,
+                                 self.camera_name)
+        self.frame_number += 1
+        return feed_frame
+
+    def outputSize(self, x_pixels, y_pixels):
+        """
+        Returns [x_pixels, y_pixels, x scale, y scale] of the feed
+        frames given the size of the feed ROI.
+        """
+        return [x_pixels, y_pixels, 1, 1]
+
+    def processFrame(self, new_frame):
+        """
+        Returns the feed frame for new_frame, or None if this camera
+        frame does not result in a feed frame.
+        """
+        return frame.Frame(self.sliceFrame(new_frame),
+                           new_frame.frame_number,
+                           self.x_pixels,
+                           self.y_pixels,
+                           self.camera_name)
+
+    def processFrames(self, new_frames):
+        """
+        Returns the feed frames for a batch of camera frames. This is
+        called in a worker thread if the feed is using workers.
+        """
+        feed_frames = []
+        for new_frame in new_frames:
+            feed_frame = self.processFrame(new_frame)
+            if feed_frame is not None:
+                feed_frame.acquisition_time = new_frame.acquisition_time
+                feed_frame.emit_time = new_frame.emit_time
+                feed_frames.append(feed_frame)
+        return feed_frames
+
     def reset(self):
+        """
+        Feeds that keep state should reset it here, this is called in the
+        GUI thread after any worker jobs for this feed have finished.
+        """
         self.frame_number = 0
+        if self.worker is not None:
+            self.worker.resetStatistics()
 
     def setCameraFunctionality(self, camera_functionality):
         self.cam_fn = camera_functionality
@@ -179,9 +369,9 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
 
         # Figure out if we need to slice.
         if (p.get("x_end") == 1):
-            p.setv("x_end", self.cam_fn.getParameter("x_end"))
+            p.setv("x_end", self.cam_fn.getParameter("x_pixels"))
         if (p.get("y_end") == 1):
-            p.setv("y_end", self.cam_fn.getParameter("y_end"))
+            p.setv("y_end", self.cam_fn.getParameter("y_pixels"))
 
         p.set("x_pixels", p.get("x_end") - p.get("x_start") + 1)
         p.set("y_pixels", p.get("y_end") - p.get("y_start") + 1)
@@ -220,25 +410,84 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
                       "fps", "max_intensity", "transpose", "x_bin", "y_bin"]:
             p.add(self.cam_fn.parameters.getp(pname).copy())
 
+        # Feeds that change the size of the image are displayed as if
+        # the camera was binning by the same amount.
+        [self.x_pixels, self.y_pixels, scale_x, scale_y] = self.outputSize(p.get("x_pixels"), p.get("y_pixels"))
+        if (scale_x != 1) or (scale_y != 1):
+            p.set("x_pixels", self.x_pixels)
+            p.set("y_pixels", self.y_pixels)
+            p.set("bytes_per_frame", 2 * self.x_pixels * self.y_pixels)
+            for [pname, scale] in [["x", scale_x], ["y", scale_y]]:
+                p_bin = p.getp(pname + "_bin")
+                p_bin.setMaximum(scale * p_bin.getv())
+                p_bin.setv(scale * p_bin.getv())
+                p.setv(pname + "_start", (p.get(pname + "_start") - 1)//scale + 1)
+                p.setv(pname + "_end", p.get(pname + "_start") + p.get(pname + "_pixels") - 1)
+
+        # This is created here rather than when it is first needed as it
+        # may first be needed in several worker threads at once. The pool
+        # memory is only committed as the buffers are used.
+        frame_bytes = 2 * self.x_pixels * self.y_pixels
+        self.frame_pool = framePool.FramePool(frame_bytes = frame_bytes,
+                                              n_buffers = framePool.poolSize(frame_bytes,
+                                                                             max_bytes = 32 * 1024 * 1024,
+                                                                             max_buffers = 100))
+
         # Connect camera functionality signals. We just pass most of
         # these through.
         self.connectCameraFunctionality()
 
     def sliceFrame(self, new_frame):
         """
-        Slices out a part of the frame based on self.frame_slice.
+        Slices out a part of the frame based on self.frame_slice. This
+        does not copy the data, a sliced frame is a strided view of the
+        original frame (see camera.frame).
+        """
+        if self.frame_slice is None:
+            return new_frame.getData()
+        else:
+            return new_frame.getView()[self.frame_slice]
+
+    def sliceView(self, new_frame):
+        """
+        As sliceFrame() but this always returns a (y_pixels, x_pixels)
+        array.
         """
         if self.frame_slice is None:
-            return new_frame.np_data
+            return new_frame.getView()
         else:
-            w = new_frame.image_x
-            h = new_frame.image_y
-            sliced_frame = numpy.reshape(new_frame.np_data, (h,w))[self.frame_slice]
-            return numpy.ascontiguousarray(sliced_frame)
+            return new_frame.getView()[self.frame_slice]
 
     def toggleShutter(self):
         assert False
 
+    def updateActive(self):
+        """
+        Connect to / disconnect from the source's frames depending on
+        whether or not anything is subscribed to this feed.
+        """
+        active = (self.number_connections == 1) and (self.number_subscribers > 0)
+        if (active == self.active):
+            return
+
+        self.active = active
+        if active:
+
+            # We have not seen the frames from the source while we were
+            # inactive, so this starts a new sequence.
+            self.gap_detector.restart()
+            self.cam_fn.newFrames.connect(self.handleNewFrames)
+        else:
+            self.cam_fn.newFrames.disconnect(self.handleNewFrames)
+
+    def useWorkers(self, threadpool, max_in_flight):
+        """
+        Process the frames in threadpool instead of the GUI thread.
+        """
+        self.worker = feedWorkers.FeedWorker(feed = self,
+                                             max_in_flight = max_in_flight,
+                                             threadpool = threadpool)
+
 
 class FeedFunctionalityAverage(FeedFunctionality):
     """
@@ -251,32 +500,138 @@ class FeedFunctionalityAverage(FeedFunctionality):
         self.counts = 0
         self.frames_to_average = self.parameters.get("frames_to_average")
 
-    def handleNewFrame(self, new_frame):
-        sliced_data = self.sliceFrame(new_frame)
+    def processFrame(self, new_frame):
+        sliced_data = self.sliceView(new_frame)
 
         if self.average_frame is None:
-            self.average_frame = sliced_data.astype(numpy.uint32)
+            self.average_frame = numpy.zeros((self.y_pixels, self.x_pixels), dtype = numpy.uint32)
+
+        if (self.counts == 0):
+            numpy.copyto(self.average_frame, sliced_data)
         else:
-            self.average_frame += sliced_data
+            numpy.add(self.average_frame, sliced_data, out = self.average_frame)
         self.counts += 1
 
         if (self.counts == self.frames_to_average):
-            average_frame = self.average_frame/self.frames_to_average
-            self.newFrame.emit(frame.Frame(average_frame.astype(numpy.uint16),
-                                           self.frame_number,
-                                           self.x_pixels,
-                                           self.y_pixels,
-                                           self.camera_name))
-            self.average_frame = None
+            feed_data = self.getFeedData()
+            numpy.floor_divide(self.average_frame, self.frames_to_average, out = feed_data, casting = "unsafe")
             self.counts = 0
-            self.frame_number += 1
+            return self.newFeedFrame(feed_data)
 
     def reset(self):
         super().reset()
-        self.average_frame = None
         self.counts = 0
-        
-    
+
+
+class FeedFunctionalityBin(FeedFunctionality):
+    """
+    The feed functionality for software binning of the frames by
+    bin_x x bin_y, either the sum (clipped at 65535) or the mean.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.bin_x = max(1, self.parameters.get("bin_x"))
+        self.bin_y = max(1, self.parameters.get("bin_y"))
+        self.bin_mode = self.parameters.get("bin_mode")
+        self.sum_frame = None
+
+    def outputSize(self, x_pixels, y_pixels):
+        return binnedSize(x_pixels, y_pixels, self.bin_x, self.bin_y)
+
+    def processFrame(self, new_frame):
+        if self.sum_frame is None:
+            self.sum_frame = numpy.zeros((self.y_pixels, self.x_pixels), dtype = numpy.uint32)
+
+        # Reshaping the (strided) ROI like this does not copy it.
+        image = self.sliceView(new_frame)[:self.y_pixels * self.bin_y, :self.x_pixels * self.bin_x]
+        blocks = image.reshape(self.y_pixels, self.bin_y, self.x_pixels, self.bin_x)
+        numpy.sum(blocks, axis = (1, 3), dtype = numpy.uint32, out = self.sum_frame)
+
+        feed_data = self.getFeedData()
+        if (self.bin_mode == "mean"):
+            numpy.floor_divide(self.sum_frame, self.bin_x * self.bin_y, out = feed_data, casting = "unsafe")
+        else:
+            numpy.minimum(self.sum_frame, 65535, out = self.sum_frame)
+            numpy.copyto(feed_data, self.sum_frame, casting = "unsafe")
+
+        return frame.Frame(feed_data.reshape(-1),
+                           new_frame.frame_number,
+                           self.x_pixels,
+                           self.y_pixels,
+                           self.camera_name)
+
+
+class FeedFunctionalityDecimate(FeedFunctionality):
+    """
+    The feed functionality for decimating the frames (taking every
+    Nth pixel in x and y) so that they are no larger than target_size.
+    This is for overview displays of large cameras.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.step = 1
+        self.target_size = max(4, self.parameters.get("target_size"))
+
+    def isStateless(self):
+        return True
+
+    def outputSize(self, x_pixels, y_pixels):
+        size = decimatedSize(x_pixels, y_pixels, self.target_size)
+        self.step = size[2]
+        return size
+
+    def processFrame(self, new_frame):
+        image = self.sliceView(new_frame)[::self.step, ::self.step]
+        feed_data = self.getFeedData()
+        numpy.copyto(feed_data, image[:self.y_pixels, :self.x_pixels])
+        return frame.Frame(feed_data.reshape(-1),
+                           new_frame.frame_number,
+                           self.x_pixels,
+                           self.y_pixels,
+                           self.camera_name)
+
+
+class FeedFunctionalityEMA(FeedFunctionality):
+    """
+    The feed functionality for an exponential moving average of the
+    frames, with weight alpha for the newest frame.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.alpha = self.parameters.get("alpha")
+        self.average_frame = None
+        self.have_average = False
+        self.temp_frame = None
+
+    def processFrame(self, new_frame):
+        sliced_data = self.sliceView(new_frame)
+
+        if self.average_frame is None:
+            self.average_frame = numpy.zeros((self.y_pixels, self.x_pixels), dtype = numpy.float32)
+            self.temp_frame = numpy.zeros_like(self.average_frame)
+
+        if self.have_average:
+            numpy.multiply(self.average_frame, 1.0 - self.alpha, out = self.average_frame)
+            numpy.multiply(sliced_data, self.alpha, out = self.temp_frame)
+            numpy.add(self.average_frame, self.temp_frame, out = self.average_frame)
+        else:
+            numpy.copyto(self.average_frame, sliced_data)
+            self.have_average = True
+
+        # Round to the nearest integer.
+        feed_data = self.getFeedData()
+        numpy.add(self.average_frame, 0.5, out = self.temp_frame)
+        numpy.copyto(feed_data, self.temp_frame, casting = "unsafe")
+        return self.newFeedFrame(feed_data)
+
+    def reset(self):
+        super().reset()
+        self.have_average = False
+
+
 class FeedFunctionalityInterval(FeedFunctionality):
     """
     The feed functionality for picking out a sub-set of the frames.
@@ -288,36 +643,150 @@ class FeedFunctionalityInterval(FeedFunctionality):
         self.capture_frames = list(map(int, temp.split(",")))
         self.cycle_length = self.parameters.get("cycle_length")
 
-    def handleNewFrame(self, new_frame):
-        sliced_data = self.sliceFrame(new_frame)
-        
+    def processFrame(self, new_frame):
         if (new_frame.frame_number % self.cycle_length) in self.capture_frames:
-            self.newFrame.emit(frame.Frame(sliced_data,
-                                           self.frame_number,
-                                           self.x_pixels,
-                                           self.y_pixels,
-                                           self.camera_name))
+            feed_frame = frame.Frame(self.sliceFrame(new_frame),
+                                     self.frame_number,
+                                     self.x_pixels,
+                                     self.y_pixels,
+                                     self.camera_name)
             self.frame_number += 1
+            return feed_frame
+
+
+class FeedFunctionalityProjection(FeedFunctionality):
+    """
+    The feed functionality for pixel wise projections of the last
+    frames_to_average frames, the median or minimum (for estimating
+    the background) or the maximum ('feed_type'). This is updated
+    every cycle_length frames, or every frames_to_average frames if
+    cycle_length is 0.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.counts = 0
+        self.cycle_length = self.parameters.get("cycle_length")
+        self.frames = None
+        self.frames_to_average = max(1, self.parameters.get("frames_to_average"))
+        self.index = 0
+        self.n_frames = 0
+        self.scratch = None
+        self.statistic = self.parameters.get("feed_type")
+        self.sum_frame = None
+
+        if (self.cycle_length < 1):
+            self.cycle_length = self.frames_to_average
+
+    def median(self, feed_data):
+        """
+        The median of an even number of frames is the average of the
+        two middle values.
+        """
+        scratch = self.scratch[:self.n_frames]
+        numpy.copyto(scratch, self.frames[:self.n_frames])
+        k = self.n_frames//2
+        if ((self.n_frames % 2) == 1):
+            scratch.partition(k, axis = 0)
+            numpy.copyto(feed_data, scratch[k])
+        else:
+            scratch.partition([k - 1, k], axis = 0)
+            numpy.add(scratch[k - 1], scratch[k], out = self.sum_frame)
+            numpy.floor_divide(self.sum_frame, 2, out = feed_data, casting = "unsafe")
+
+    def processFrame(self, new_frame):
+        if self.frames is None:
+            self.frames = numpy.zeros((self.frames_to_average, self.y_pixels, self.x_pixels), dtype = numpy.uint16)
+            if (self.statistic == "median"):
+                self.scratch = numpy.zeros_like(self.frames)
+                self.sum_frame = numpy.zeros((self.y_pixels, self.x_pixels), dtype = numpy.uint32)
+
+        numpy.copyto(self.frames[self.index], self.sliceView(new_frame))
+        self.index = (self.index + 1) % self.frames_to_average
+        self.n_frames = min(self.n_frames + 1, self.frames_to_average)
+        self.counts += 1
+
+        if (self.counts >= self.cycle_length):
+            self.counts = 0
+            feed_data = self.getFeedData()
+            if (self.statistic == "median"):
+                self.median(feed_data)
+            elif (self.statistic == "min"):
+                numpy.min(self.frames[:self.n_frames], axis = 0, out = feed_data)
+            else:
+                numpy.max(self.frames[:self.n_frames], axis = 0, out = feed_data)
+            return self.newFeedFrame(feed_data)
+
+    def reset(self):
+        super().reset()
+        self.counts = 0
+        self.index = 0
+        self.n_frames = 0
+
+
+class FeedFunctionalityRunningAverage(FeedFunctionality):
+    """
+    The feed functionality for the (sliding window) average of the last
+    frames_to_average frames. There is one feed frame per camera frame.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.frames = None
+        self.frames_to_average = max(1, self.parameters.get("frames_to_average"))
+        self.index = 0
+        self.n_frames = 0
+        self.sum_frame = None
+
+    def processFrame(self, new_frame):
+        if self.frames is None:
+            self.frames = numpy.zeros((self.frames_to_average, self.y_pixels, self.x_pixels), dtype = numpy.uint16)
+            self.sum_frame = numpy.zeros((self.y_pixels, self.x_pixels), dtype = numpy.uint32)
+
+        # Replace the oldest frame in the ring with the new frame.
+        oldest = self.frames[self.index]
+        if (self.n_frames == self.frames_to_average):
+            numpy.subtract(self.sum_frame, oldest, out = self.sum_frame)
+        else:
+            self.n_frames += 1
+        numpy.copyto(oldest, self.sliceView(new_frame))
+        numpy.add(self.sum_frame, oldest, out = self.sum_frame)
+        self.index = (self.index + 1) % self.frames_to_average
+
+        feed_data = self.getFeedData()
+        numpy.floor_divide(self.sum_frame, self.n_frames, out = feed_data, casting = "unsafe")
+        return self.newFeedFrame(feed_data)
+
+    def reset(self):
+        super().reset()
+        self.index = 0
+        self.n_frames = 0
+        if self.sum_frame is not None:
+            self.sum_frame.fill(0)
 
 
 class FeedFunctionalitySlice(FeedFunctionality):
     """
     The feed functionality for slicing out sub-sets of frames.
     """
-    pass
+    def isStateless(self):
+        return True
 
         
 class FeedController(object):
     """
     Feed controller.
     """
-    def __init__(self, parameters = None, **kwds):
+    def __init__(self, parameters = None, max_in_flight = 100, threadpool = None, **kwds):
         """
         parameters - This is just the 'feed' section of the parameters.
+        max_in_flight - The maximum number of frames (per feed) waiting for a worker.
+        threadpool - Process the feeds in this QThreadPool, or in the GUI thread if None.
         """
         super().__init__(**kwds)
 
         self.feeds = {}
+        self.sources = {}
         if parameters is None:
             return
 
@@ -380,7 +849,37 @@ class FeedController(object):
                 feed_params.add(params.ParameterInt(description = "Number of frames to average.",
                                                     name = "frames_to_average",
                                                     value = 1))
+
+            elif (feed_type == "bin"):
+                fclass = FeedFunctionalityBin
+
+                feed_params.add(params.ParameterInt(description = "Binning in x.",
+                                                    name = "bin_x",
+                                                    value = 2))
+
+                feed_params.add(params.ParameterInt(description = "Binning in y.",
+                                                    name = "bin_y",
+                                                    value = 2))
+
+                feed_params.add(params.ParameterSetString(description = "Sum or average the binned pixels.",
+                                                          name = "bin_mode",
+                                                          value = "mean",
+                                                          allowed = ["mean", "sum"]))
+
+            elif (feed_type == "decimate"):
+                fclass = FeedFunctionalityDecimate
+
+                feed_params.add(params.ParameterInt(description = "Maximum size of the decimated image.",
+                                                    name = "target_size",
+                                                    value = 512))
                             
+            elif (feed_type == "ema"):
+                fclass = FeedFunctionalityEMA
+
+                feed_params.add(params.ParameterFloat(description = "Weight of the newest frame.",
+                                                      name = "alpha",
+                                                      value = 0.1))
+
             elif (feed_type == "interval"):
                 fclass = FeedFunctionalityInterval
 
@@ -392,6 +891,28 @@ class FeedController(object):
                                                        name = "capture_frames",
                                                        value = "1"))
 
+            elif (feed_type == "max_projection") or (feed_type == "median") or (feed_type == "min"):
+                fclass = FeedFunctionalityProjection
+
+                feed_params.add(params.ParameterInt(description = "Number of frames to use.",
+                                                    name = "frames_to_average",
+                                                    value = 10))
+
+                # By default the maximum projection is updated for every frame.
+                cycle_length = 0
+                if (feed_type == "max_projection"):
+                    cycle_length = 1
+                feed_params.add(params.ParameterInt(description = "Frames between updates (0 = frames to use).",
+                                                    name = "cycle_length",
+                                                    value = cycle_length))
+
+            elif (feed_type == "running_average"):
+                fclass = FeedFunctionalityRunningAverage
+
+                feed_params.add(params.ParameterInt(description = "Number of frames to average.",
+                                                    name = "frames_to_average",
+                                                    value = 1))
+
             elif (feed_type == "slice"):
                 fclass = FeedFunctionalitySlice
             else:
@@ -408,10 +929,21 @@ class FeedController(object):
             # Replace the values in the parameters that were read from a file with these values.
             self.parameters.addSubSection(feed_name, feed_params, overwrite = True)
 
-            camera_name = feed_params.get("source") + "." + feed_name
+            # Feeds that are derived from other feeds are named after the
+            # camera at the start of the chain.
+            camera_name = self.rootCamera(feed_name) + "." + feed_name
             self.feeds[camera_name] = fclass(feed_name = feed_name,
                                              camera_name = camera_name,
                                              parameters = feed_params)
+            if threadpool is not None:
+                self.feeds[camera_name].useWorkers(threadpool, max_in_flight)
+
+        # The source of each feed, either a camera or another feed.
+        for [camera_name, feed] in self.feeds.items():
+            source = feed.getParameter("source")
+            if self.parameters.has(source):
+                source = self.rootCamera(source) + "." + source
+            self.sources[camera_name] = source
 
     def allFeedsFunctional(self):
         for feed in self.getFeeds():
@@ -426,6 +958,12 @@ class FeedController(object):
         for feed in self.getFeeds():
             feed.disconnectCameraFunctionality()
 
+    def getCameraFeeds(self):
+        """
+        Returns the feeds whose source is a camera.
+        """
+        return [self.feeds[name] for name in self.feeds if not (self.sources[name] in self.feeds)]
+
     def getFeed(self, feed_name):
         return self.feeds[feed_name]
         
@@ -438,20 +976,83 @@ class FeedController(object):
     def getParameters(self):
         return self.parameters
 
+    def getWorkerParameters(self):
+        """
+        Returns a list of parameters with the worker statistics of each
+        feed, times are in milliseconds.
+        """
+        worker_params = []
+        for feed in self.getFeeds():
+            stats = feed.getWorkerStatistics()
+            if stats is None:
+                continue
+            prefix = feed.getCameraName().replace(".", "_") + "_worker_"
+            worker_params.append(params.ParameterFloat(name = prefix + "mean_time",
+                                                       value = stats["mean_time"]))
+            worker_params.append(params.ParameterFloat(name = prefix + "max_time",
+                                                       value = stats["max_time"]))
+            worker_params.append(params.ParameterInt(name = prefix + "dropped",
+                                                     value = stats["dropped"]))
+            print(">> {0:s} worker time (ms), mean {1:.3f} max {2:.3f}, dropped {3:d} frames".format(feed.getCameraName(),
+                                                                                                 stats["mean_time"],
+                                                                                                 stats["max_time"],
+                                                                                                 stats["dropped"]))
+        return worker_params
+
     def resetFeeds(self):
         for feed in self.getFeeds():
+            if feed.worker is not None:
+                feed.worker.drain()
             feed.reset()
+
+    def rootCamera(self, feed_name, visited = None):
+        """
+        Returns the camera at the start of the chain of sources for a feed.
+        """
+        if visited is None:
+            visited = []
+        if feed_name in visited:
+            raise FeedException("Feed '" + feed_name + "' is it's own source.")
+        visited.append(feed_name)
+
+        source = self.parameters.get(feed_name).get("source")
+        if self.parameters.has(source):
+            return self.rootCamera(source, visited)
+        return source
+
+    def setCameraFunctionality(self, feed_name, functionality):
+        """
+        Set the camera functionality of a feed, and then this feed
+        as the camera functionality of the feeds derived from it.
+        """
+        self.feeds[feed_name].setCameraFunctionality(functionality)
+        for [name, source] in self.sources.items():
+            if (source == feed_name):
+                self.setCameraFunctionality(name, self.feeds[feed_name])
             
 
 class Feeds(halModule.HalModule):
     """
     Feeds controller.
+
+    The feeds are processed in the GUI thread unless the number of
+    'workers' is specified in the configuration section.
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
         self.camera_names = []
         self.feed_controller = None
         self.feed_names = []
+        self.max_in_flight = 100
+        self.threadpool = None
+
+        if module_params.has("configuration"):
+            configuration = module_params.get("configuration")
+            self.max_in_flight = configuration.get("max_in_flight", 100)
+            workers = configuration.get("workers", 0)
+            if (workers > 0):
+                self.threadpool = QtCore.QThreadPool()
+                self.threadpool.setMaxThreadCount(workers)
         
         # This message comes from the display.display when it creates a new
         # viewer.
@@ -459,6 +1060,11 @@ class Feeds(halModule.HalModule):
                               validator = {"data" : {"extra data" : [False, str]},
                                            "resp" : {"feed names" : [True, list]}})
         
+    def cleanUp(self, qt_settings):
+        if self.threadpool is not None:
+            self.threadpool.waitForDone()
+        super().cleanUp(qt_settings)
+
     def broadcastCurrentFeeds(self):
         """
         Send a 'configuration' message with the current feed names.
@@ -474,8 +1080,8 @@ class Feeds(halModule.HalModule):
 
     def handleResponse(self, message, response):
         if message.isType("get functionality"):
-            feed = self.feed_controller.getFeed(message.getData()["extra data"])
-            feed.setCameraFunctionality(response.getData()["functionality"])
+            self.feed_controller.setCameraFunctionality(message.getData()["extra data"],
+                                                        response.getData()["functionality"])
 
         #
         # If we have camera functionality for all the feeds then it is safe to
@@ -524,13 +1130,16 @@ class Feeds(halModule.HalModule):
                                                                   data = {"old parameters" : self.feed_controller.getParameters().copy()}))
                 self.feed_controller = None
             if params.has("feeds"):
-                self.feed_controller = FeedController(parameters = params.get("feeds"))
+                self.feed_controller = FeedController(parameters = params.get("feeds"),
+                                                      max_in_flight = self.max_in_flight,
+                                                      threadpool = self.threadpool)
             
         elif message.isType("updated parameters"):
             self.feed_names = copy.copy(self.camera_names)
             if self.feed_controller is not None:
                 for feed in self.feed_controller.getFeeds():
                     self.feed_names.append(feed.getCameraName())
+                for feed in self.feed_controller.getCameraFeeds():
                     self.sendMessage(halMessage.HalMessage(m_type = "get functionality",
                                                            data = {"name" : feed.getParameter("source"),
                                                                    "extra data" : feed.getCameraName()}))
@@ -546,4 +1155,8 @@ class Feeds(halModule.HalModule):
             if self.feed_controller is not None:
                 message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
                                                                   data = {"parameters" : self.feed_controller.getParameters()}))
+                worker_params = self.feed_controller.getWorkerParameters()
+                if (len(worker_params) > 0):
+                    message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
+                                                                      data = {"acquisition" : worker_params}))
 
@@ -22,6 +22,7 @@ import storm_control.sc_library.hgit as hgit
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
+import storm_control.hal4000.camera.frameGaps as frameGaps
 import storm_control.hal4000.film.filmRequest as filmRequest
 import storm_control.hal4000.film.filmSettings as filmSettings
 import storm_control.hal4000.halLib.halMessage as halMessage
@@ -84,6 +85,45 @@ class FilmBox(QtWidgets.QGroupBox):
                                                        name = "want_bell",
                                                        value = True))
 
+        self.parameters.add(params.ParameterSetBoolean(description = "Save frames in a separate thread",
+                                                       name = "writer_async",
+                                                       value = False))
+
+        self.parameters.add(params.ParameterRangeInt(description = "Writer batch size in MB (.fast.dax)",
+                                                     name = "writer_batch_size",
+                                                     value = 16,
+                                                     min_value = 1,
+                                                     max_value = 1024))
+
+        self.parameters.add(params.ParameterSetBoolean(description = "Bypass the OS file cache (.fast.dax)",
+                                                       name = "writer_direct_io",
+                                                       value = False))
+
+        self.parameters.add(params.ParameterSetBoolean(description = "Save a per-frame index file",
+                                                       name = "writer_index",
+                                                       value = True))
+
+        self.parameters.add(params.ParameterSetString(description = "What to do when the writer buffer is full",
+                                                      name = "writer_overflow",
+                                                      value = "block",
+                                                      allowed = ["block", "drop"]))
+
+        self.parameters.add(params.ParameterRangeInt(description = "Writer buffer size in frames",
+                                                     name = "writer_queue_depth",
+                                                     value = 200,
+                                                     min_value = 1,
+                                                     max_value = 100000))
+
+        self.parameters.add(params.ParameterString(description = "Comma separated list of directories for striped films (.stripes)",
+                                                   name = "writer_stripe_directories",
+                                                   value = ""))
+
+        self.parameters.add(params.ParameterRangeInt(description = "Frames per block in striped films (.stripes)",
+                                                     name = "writer_stripe_frames",
+                                                     value = 16,
+                                                     min_value = 1,
+                                                     max_value = 10000))
+
         # Initial UI configuration.
         self.ui = filmUi.Ui_GroupBox()
         self.ui.setupUi(self)
@@ -94,6 +134,7 @@ class FilmBox(QtWidgets.QGroupBox):
         for typename in self.parameters.getp("filetype").getAllowed():
             self.ui.filetypeComboBox.addItem(typename)
 
+        self.ui.droppedText.setText("")
         self.ui.framesText.setText("")
         self.ui.sizeText.setText("")
 
@@ -145,7 +186,8 @@ class FilmBox(QtWidgets.QGroupBox):
                                              film_length = film_request.getFrames(),
                                              overwrite = film_request.overwriteOk(),
                                              run_shutters = self.ui.autoShuttersCheckBox.isChecked(),
-                                             tcp_request = True)
+                                             tcp_request = True,
+                                             **self.getWriterSettings())
 
         else:
             reply = QtWidgets.QMessageBox.Yes
@@ -171,10 +213,25 @@ class FilmBox(QtWidgets.QGroupBox):
                                              filetype = self.parameters.get("filetype"),
                                              film_length = self.parameters.get("frames"),
                                              run_shutters = self.ui.autoShuttersCheckBox.isChecked(),
-                                             save_film = self.ui.saveMovieCheckBox.isChecked())
+                                             save_film = self.ui.saveMovieCheckBox.isChecked(),
+                                             **self.getWriterSettings())
 
     def getParameters(self):
         return self.parameters.copy()
+
+    def getWriterSettings(self):
+        stripe_dirs = []
+        for stripe_dir in self.parameters.get("writer_stripe_directories").split(","):
+            if (len(stripe_dir.strip()) > 0):
+                stripe_dirs.append(stripe_dir.strip())
+        return {"writer_async" : self.parameters.get("writer_async"),
+                "writer_batch_size" : self.parameters.get("writer_batch_size"),
+                "writer_direct_io" : self.parameters.get("writer_direct_io"),
+                "writer_index" : self.parameters.get("writer_index"),
+                "writer_overflow" : self.parameters.get("writer_overflow"),
+                "writer_queue_depth" : self.parameters.get("writer_queue_depth"),
+                "writer_stripe_directories" : stripe_dirs,
+                "writer_stripe_frames" : self.parameters.get("writer_stripe_frames")}
     
     def enableUI(self, state):
         for ui_elt in [self.ui.autoIncCheckBox,
@@ -235,6 +292,17 @@ class FilmBox(QtWidgets.QGroupBox):
         self.ui.filenameEdit.setText(parameters.get("filename"))
         self.ui.filetypeComboBox.setCurrentIndex(self.ui.filetypeComboBox.findText(parameters.get("filetype")))
         self.ui.lengthSpinBox.setValue(parameters.get("frames"))
+
+        # These don't have a UI element.
+        for pname in ["writer_async",
+                      "writer_batch_size",
+                      "writer_direct_io",
+                      "writer_index",
+                      "writer_overflow",
+                      "writer_queue_depth",
+                      "writer_stripe_directories",
+                      "writer_stripe_frames"]:
+            self.parameters.setv(pname, parameters.get(pname, self.parameters.get(pname)))
         
         if (parameters.get("acq_mode") == "run_till_abort"):
             self.ui.modeComboBox.setCurrentIndex(0)
@@ -264,7 +332,7 @@ class FilmBox(QtWidgets.QGroupBox):
         return True
 
     def updateFilenameLabel(self):
-        name = self.getBasename() + self.parameters.get("filetype")
+        name = self.getBasename() + imagewriters.fileExtension(self.parameters.get("filetype"))
         full_name = os.path.join(self.parameters.get("directory"), name)
         xml_name = self.getBasename() + ".xml"
         full_xml_name = os.path.join(self.parameters.get("directory"), xml_name)
@@ -280,6 +348,20 @@ class FilmBox(QtWidgets.QGroupBox):
             self.will_overwrite = False
             self.ui.filenameLabel.setStyleSheet("QLabel { color: black}")
         
+    def updateDropped(self, dropped, duplicated):
+        """
+        These are the largest number of dropped / duplicated
+        frames at any stage for any camera or feed.
+        """
+        if (duplicated > 0):
+            self.ui.droppedText.setText("{0:d} ({1:d} duplicated)".format(dropped, duplicated))
+        else:
+            self.ui.droppedText.setText(str(dropped))
+        if (dropped > 0) or (duplicated > 0):
+            self.ui.droppedText.setStyleSheet("QLabel { color: red}")
+        else:
+            self.ui.droppedText.setStyleSheet("QLabel { color: black}")
+
     def updateFrames(self, new_number):
         self.ui.framesText.setText(str(new_number))
 
@@ -441,6 +523,9 @@ class Film(halModule.HalModule):
         # Update display of the number of frames.
         self.view.updateFrames(self.number_frames)
 
+        # Update display of the number of dropped frames.
+        self.view.updateDropped(*frameGaps.monitor.getWorst())
+
         # Update display of the (total) storage used.
         total_size = 0.0
         for writer in self.writers:
@@ -500,6 +585,10 @@ class Film(halModule.HalModule):
 
                 to_save.saveToFile(film_settings.getBasename() + ".xml")
 
+                # Some file formats can also store the parameters.
+                for writer in self.writers:
+                    writer.saveParameters(to_save)
+
                 if self.logfile_fp is not None:
                     msg = ",".join([str(datetime.datetime.now()),
                                     film_settings.getBasename(),
@@ -617,6 +706,14 @@ class Film(halModule.HalModule):
             message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
                                                               data = {"parameters" : self.view.getParameters()}))
 
+            # Add the image writer statistics.
+            writer_params = []
+            for writer in self.writers:
+                writer_params.extend(writer.getAcquisitionParameters())
+            if (len(writer_params) > 0):
+                message.addResponse(halMessage.HalMessageResponse(source = self.module_name,
+                                                                  data = {"acquisition" : writer_params}))
+
         elif message.isType("stop film request"):
             if (self.film_state != "run"):
                 raise halExceptions.HalException("Stop film request received while not filming.")
@@ -697,6 +794,7 @@ class Film(halModule.HalModule):
                     self.writers.append(imagewriters.createFileWriter(camera, self.film_settings))
         if (len(self.writers) == 0):
             self.view.updateSize(0.0)
+        self.view.updateDropped(0, 0)
         
         # Start filming.
         self.waiting_on = copy.copy(self.wait_for)
@@ -747,6 +845,9 @@ class Film(halModule.HalModule):
         """
         Once all the cameras/feeds have stopped close the imagewriters
         and restart the cameras (if we are in live mode).
+
+        All the writers are closed even if some of them fail, any errors
+        are raised once 'stop film' has been sent.
         """
 
         # Check that the writers have stopped. The problem (I think) is a race condition
@@ -760,8 +861,13 @@ class Film(halModule.HalModule):
                 return
 
         # Close writers.
+        writer_errors = []
         for writer in self.writers:
-            writer.closeWriter()
+            try:
+                writer.closeWriter()
+            except imagewriters.ImageWriterException as exception:
+                print(">> Warning closing writer", str(exception))
+                writer_errors.append(str(exception))
 
         # Enable the UI.
         self.view.enableUI(True)
@@ -785,6 +891,9 @@ class Film(halModule.HalModule):
             if self.view.soundBell():
                 print("\7\7")
 
+        if (len(writer_errors) > 0):
+            raise imagewriters.ImageWriterException("Error closing writers: " + ", ".join(writer_errors))
+
         #raise halExceptions.HalException("done now!")
 
 #
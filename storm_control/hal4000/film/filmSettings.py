@@ -17,6 +17,14 @@ class FilmSettings(object):
                  run_shutters = False,
                  save_film = True,
                  tcp_request = False,
+                 writer_async = False,
+                 writer_batch_size = 16,
+                 writer_direct_io = False,
+                 writer_index = True,
+                 writer_overflow = "block",
+                 writer_queue_depth = 200,
+                 writer_stripe_directories = None,
+                 writer_stripe_frames = 16,
                  **kwds):
     
         super().__init__(**kwds)
@@ -29,6 +37,13 @@ class FilmSettings(object):
         assert(isinstance(run_shutters, bool))
         assert(isinstance(save_film, bool))
         assert(isinstance(tcp_request, bool))
+        assert(isinstance(writer_async, bool))
+        assert(isinstance(writer_batch_size, int))
+        assert(isinstance(writer_direct_io, bool))
+        assert(isinstance(writer_index, bool))
+        assert(writer_overflow in ["block", "drop"])
+        assert(isinstance(writer_queue_depth, int))
+        assert(isinstance(writer_stripe_frames, int))
 
         # Either "run_till_abort" or "fixed_length"
         self.acq_mode = acq_mode
@@ -45,6 +60,9 @@ class FilmSettings(object):
         # Whether or not to overwrite an existing file. If this is not True
         # and the file already exists HAL is expected to crash.
         self.overwrite = overwrite
+
+        # The camera pixel size in nanometers (used by the .tif writers).
+        self.pixel_size = pixel_size
         
         # Whether or not to run the shutters.
         self.run_shutters = run_shutters
@@ -55,6 +73,35 @@ class FilmSettings(object):
         # Whether the film request came from the record button or TCP.
         self.tcp_request = tcp_request
 
+        # Whether the image writers save frames in their own thread.
+        self.writer_async = writer_async
+
+        # The size (in MB) of the writes for the writers that batch frames.
+        self.writer_batch_size = writer_batch_size
+
+        # Whether the writers that support it should bypass the OS file cache.
+        self.writer_direct_io = writer_direct_io
+
+        # Whether the image writers also save a (binary) per-frame index file.
+        self.writer_index = writer_index
+
+        # What the image writer threads do when their buffer is full,
+        # either "block" or "drop".
+        self.writer_overflow = writer_overflow
+
+        # The size (in frames) of the image writer thread buffers.
+        self.writer_queue_depth = writer_queue_depth
+
+        # The directories to use for striped films, these are relative to
+        # the film directory unless they are absolute paths.
+        if writer_stripe_directories is None:
+            self.writer_stripe_directories = []
+        else:
+            self.writer_stripe_directories = writer_stripe_directories
+
+        # The number of frames in each block of a striped film.
+        self.writer_stripe_frames = writer_stripe_frames
+
     def getBasename(self):
         return self.basename
 
@@ -66,6 +113,30 @@ class FilmSettings(object):
 
     def getPixelSize(self):
         return self.pixel_size
+
+    def getWriterAsync(self):
+        return self.writer_async
+
+    def getWriterBatchSize(self):
+        return self.writer_batch_size
+
+    def getWriterDirectIO(self):
+        return self.writer_direct_io
+
+    def getWriterIndex(self):
+        return self.writer_index
+
+    def getWriterOverflow(self):
+        return self.writer_overflow
+
+    def getWriterQueueDepth(self):
+        return self.writer_queue_depth
+
+    def getWriterStripeDirectories(self):
+        return self.writer_stripe_directories
+
+    def getWriterStripeFrames(self):
+        return self.writer_stripe_frames
     
     def isFixedLength(self):
         return (self.acq_mode == "fixed_length")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Publishes the frames from cameras / feeds in shared memory ring
+buffers so that they can be analyzed by other processes without
+competing with HAL for the GIL. See sc_library.sharedFrames for
+the client (reader) side.
+
+The name of the ring for a camera / feed is the 'prefix' in the
+configuration plus the camera / feed name, with '.' replaced by
+'_', for example 'hal_camera1' or 'hal_camera1_slice1'.
+
+This requires Python 3.8+ (multiprocessing.shared_memory), with older
+versions of Python this module does nothing.
+"""
+
+import storm_control.sc_library.hdebug as hdebug
+
+# Shared memory is only available in Python 3.8+.
+try:
+    import storm_control.sc_library.sharedFrames as sharedFrames
+except ImportError:
+    sharedFrames = None
+
+import storm_control.hal4000.halLib.halMessage as halMessage
+import storm_control.hal4000.halLib.halModule as halModule
+
+
+def ringName(prefix, camera_name):
+    return prefix + camera_name.replace(".", "_")
+
+
+class Publisher(object):
+    """
+    Publishes the frames from a single camera / feed.
+    """
+    def __init__(self, camera_fn = None, n_slots = None, prefix = None, **kwds):
+        super().__init__(**kwds)
+        self.camera_fn = camera_fn
+        self.ring = sharedFrames.FrameRingWriter(name = ringName(prefix, camera_fn.getCameraName()),
+                                                 n_slots = n_slots,
+                                                 slot_bytes = camera_fn.getParameter("bytes_per_frame"))
+        self.camera_fn.newFrames.connect(self.handleNewFrames)
+
+    def cleanUp(self):
+        self.camera_fn.newFrames.disconnect(self.handleNewFrames)
+        self.ring.close()
+
+    def getRingName(self):
+        return self.ring.getName()
+
+    def handleNewFrames(self, frames):
+        for aframe in frames:
+            self.ring.addFrame(aframe.getView(),
+                               aframe.frame_number,
+                               aframe.image_x,
+                               aframe.image_y,
+                               acquisition_time = aframe.acquisition_time)
+
+
+class FramePublisher(halModule.HalModule):
+    """
+    The configuration specifies which cameras / feeds to publish, a
+    comma separated list, or all of them if this is empty.
+    """
+    def __init__(self, module_params = None, qt_settings = None, **kwds):
+        super().__init__(**kwds)
+        self.feed_names = []
+        self.publishers = []
+
+        configuration = module_params.get("configuration")
+        self.n_slots = configuration.get("n_slots", 64)
+        self.prefix = configuration.get("prefix", "hal_")
+        self.publish = []
+        for name in configuration.get("feeds", "").split(","):
+            if (len(name.strip()) > 0):
+                self.publish.append(name.strip())
+
+        if sharedFrames is None:
+            print(">> Warning! Shared memory is not available, frames will not be published.")
+
+    def cleanUp(self, qt_settings):
+        self.cleanUpPublishers()
+        super().cleanUp(qt_settings)
+
+    def cleanUpPublishers(self):
+        for publisher in self.publishers:
+            publisher.cleanUp()
+        self.publishers = []
+
+    def handleResponses(self, message):
+        if message.isType("get functionality"):
+            assert (len(message.getResponses()) == 1)
+            for response in message.getResponses():
+                publisher = Publisher(camera_fn = response.getData()["functionality"],
+                                      n_slots = self.n_slots,
+                                      prefix = self.prefix)
+                hdebug.logText("Publishing " + message.getData()["name"] + " frames in " + publisher.getRingName())
+                self.publishers.append(publisher)
+
+    def newPublishers(self):
+        """
+        The frame size may have changed so we always create new publishers
+        when the parameters change (or when HAL starts).
+        """
+        self.cleanUpPublishers()
+        if sharedFrames is None:
+            return
+        for name in self.feed_names:
+            if (len(self.publish) == 0) or (name in self.publish):
+                self.sendMessage(halMessage.HalMessage(m_type = "get functionality",
+                                                       data = {"name" : name}))
+
+    def processMessage(self, message):
+
+        if message.isType("changing parameters"):
+            if not message.getData()["changing"]:
+                self.newPublishers()
+
+        elif message.isType("configuration"):
+            if message.sourceIs("feeds"):
+                self.feed_names = []
+                for name in message.getData()["properties"]["feed names"]:
+                    self.feed_names.append(name)
+
+        elif message.isType("start"):
+            self.newPublishers()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -6,6 +6,11 @@ is used to speed up the rendering of the image in the UI. My experience
 was that for large images, such as those from a sCMOS camera, using numpy
 to do the image scaling and type conversion was not fast enough.
 
+If the C library is not available the image is rescaled with a 65536
+entry lookup table instead. The ImageRescaler class caches this table
+and re-uses the rescaled image buffer, so in the display loop there is
+no per-frame allocation with either version.
+
 Hazen 09/15
 """
 
@@ -67,6 +72,76 @@ def compare(image1, image2):
     return image_manip.compare(image1, image2, image1.size)
 
 
+class ImageRescaler(object):
+    """
+    Rescales images for display. The lookup table is only re-calculated
+    when the display range or the saturated value changes and the rescaled
+    image is written into the same buffer each time, so the image that is
+    returned is only valid until the next call to rescaleImage().
+    """
+    def __init__(self, use_numpy = False, **kwds):
+        super().__init__(**kwds)
+        self.lut = None
+        self.lut_key = None
+        self.rescaled = None
+        self.use_numpy = use_numpy or (image_manip is None)
+
+    def getLUT(self, display_range, saturated_value):
+        key = (display_range[0], display_range[1], saturated_value)
+        if (key != self.lut_key):
+            self.lut = makeLUT(display_range, saturated_value)
+            self.lut_key = key
+        return self.lut
+
+    def getRescaled(self, shape):
+        if (self.rescaled is None) or (self.rescaled.shape != shape):
+            self.rescaled = numpy.empty(shape, dtype = numpy.uint8)
+        return self.rescaled
+
+    def rescaleImage(self, image, flip_h, flip_v, transpose, display_range, saturated_value):
+        """
+        See rescaleImage() below.
+        """
+        if transpose:
+            rescaled = self.getRescaled((image.shape[1], image.shape[0]))
+        else:
+            rescaled = self.getRescaled((image.shape[0], image.shape[1]))
+
+        if self.use_numpy:
+            return rescaleImageLUT(image, flip_h, flip_v, transpose, self.getLUT(display_range, saturated_value), rescaled)
+        else:
+            return rescaleImageC(image, flip_h, flip_v, transpose, display_range, saturated_value, rescaled)
+
+
+def makeLUT(display_range, saturated_value):
+    """
+    Returns a numpy.uint8 lookup table for all the possible numpy.uint16
+    values. This uses the same arithmetic as the C library so the results
+    are identical.
+    """
+    [max_range, saturated_value] = maxRange(saturated_value)
+    scale = max_range/max(1, display_range[1] - display_range[0])
+    lut = numpy.arange(65536, dtype = numpy.float64)
+    lut -= display_range[0]
+    lut *= scale
+    numpy.clip(lut, 0.0, max_range, out = lut)
+    lut += 0.5
+    lut = lut.astype(numpy.uint8)
+    if (saturated_value < 65536):
+        lut[int(saturated_value):] = 255
+    return lut
+
+
+def maxRange(saturated_value):
+    """
+    Returns [maximum value in the rescaled image, saturated value].
+    """
+    if saturated_value is not None:
+        return [254.0, saturated_value]
+    else:
+        return [255.0, 65536]
+
+
 def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_value, use_numpy = False):
     """
     This converts a uint16 image into a uint8 image based on the display
@@ -83,7 +158,27 @@ def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_valu
 
     return [numpy.uint8 image, original image minimum, original image maximum]
     """
-    
+    if transpose:
+        rescaled = numpy.empty((image.shape[1], image.shape[0]), dtype = numpy.uint8)
+    else:
+        rescaled = numpy.empty((image.shape[0], image.shape[1]), dtype = numpy.uint8)
+
+    # Use C library for image manipulation, this will be faster and less memory intensive.
+    if (image_manip is not None) and (not use_numpy):
+        return rescaleImageC(image, flip_h, flip_v, transpose, display_range, saturated_value, rescaled)
+
+    # Fall back to using numpy.
+    else:
+        return rescaleImageLUT(image, flip_h, flip_v, transpose, makeLUT(display_range, saturated_value), rescaled)
+
+
+def rescaleImageC(image, flip_h, flip_v, transpose, display_range, saturated_value, rescaled):
+    """
+    Rescale using the C library, rescaled is the (C contiguous) numpy.uint8
+    array to store the result in.
+    """
+    [max_range, saturated_value] = maxRange(saturated_value)
+
     # Create a string specifying the operations that will be performed on the image.
     op_code = ""
     for op in [flip_h, flip_v, transpose]:
@@ -92,67 +187,83 @@ def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_valu
         else:
             op_code += "0"
 
-    # Determine maximum in the rescaled image.
-    if saturated_value is not None:
-        max_range = 254.0
-    else:
-        saturated_value = 65536
-        max_range = 255.0
-        
-    # Use C library for image manipulation, this will be faster and less memory intensive.
-    if (image_manip is not None) and (not use_numpy):
+    # The C library can only handle C contiguous images.
+    image = numpy.ascontiguousarray(image)
 
-        if transpose:
-            rescaled = numpy.empty((image.shape[1], image.shape[0]), dtype = numpy.uint8)
-        else:
-            rescaled = numpy.empty((image.shape[0], image.shape[1]), dtype = numpy.uint8)
+    image_min = ctypes.c_int(0)
+    image_max = ctypes.c_int(0)
 
-        image_min = ctypes.c_int(0)
-        image_max = ctypes.c_int(0)
+    # Get the appropriate C function based on the op_code.
+    image_fn = getattr(image_manip, "rescaleImage" + op_code)
 
-        # Get the appropriate C function based on the op_code.
-        image_fn = getattr(image_manip, "rescaleImage" + op_code)
+    image_fn(rescaled,
+             image,
+             image.shape[0],
+             image.shape[1],
+             display_range[0],
+             display_range[1],
+             saturated_value,
+             max_range,
+             ctypes.byref(image_min),
+             ctypes.byref(image_max))
 
-        image_fn(rescaled,
-                 image,
-                 image.shape[0],
-                 image.shape[1],
-                 display_range[0],
-                 display_range[1],
-                 saturated_value,
-                 max_range,
-                 ctypes.byref(image_min),
-                 ctypes.byref(image_max))
+    return [rescaled, image_min.value, image_max.value]
 
-        image_min = image_min.value
-        image_max = image_max.value
 
-    # Fall back to using numpy.
-    else:
-        image_min = numpy.min(image)
-        image_max = numpy.max(image)
+def rescaleImageFloat(image, flip_h, flip_v, transpose, display_range, saturated_value):
+    """
+    The original numpy version of rescaleImage(). This is slow and uses a lot
+    of memory, it is only kept as a reference for the tests and benchmarks.
+    """
+    [max_range, saturated_value] = maxRange(saturated_value)
+
+    image_min = numpy.min(image)
+    image_max = numpy.max(image)
             
-        if flip_h:
-            image = numpy.fliplr(image)
+    if flip_h:
+        image = numpy.fliplr(image)
             
-        if flip_v:
-            image = numpy.flipud(image)
+    if flip_v:
+        image = numpy.flipud(image)
 
-        if transpose:
-            image = numpy.transpose(image)
+    if transpose:
+        image = numpy.transpose(image)
         
-        rescaled = image.astype(numpy.float64)
-        rescaled = max_range*(rescaled - display_range[0])/(display_range[1] - display_range[0])
-        rescaled[(rescaled > max_range)] = max_range 
-        rescaled[(rescaled < 0.0)] = 0.0
+    rescaled = image.astype(numpy.float64)
+    rescaled = max_range*(rescaled - display_range[0])/(display_range[1] - display_range[0])
+    rescaled[(rescaled > max_range)] = max_range 
+    rescaled[(rescaled < 0.0)] = 0.0
         
-        # Check for saturated pixels
-        if saturated_value is not None:
-            rescaled[(image >= saturated_value)] = 255.0
+    # Check for saturated pixels
+    rescaled[(image >= saturated_value)] = 255.0
+
+    # Convert to contiguous uint8 array.
+    rescaled += 0.5
+    rescaled = rescaled.astype(numpy.uint8, order='C')
+
+    return [rescaled, image_min, image_max]
+
+
+def rescaleImageLUT(image, flip_h, flip_v, transpose, lut, rescaled):
+    """
+    Rescale using a lookup table from makeLUT(), rescaled is the numpy.uint8
+    array to store the result in. The flips and the transpose are just
+    (strided) views of the original image.
+    """
+    image_min = int(image.min())
+    image_max = int(image.max())
+
+    if flip_h:
+        image = image[:, ::-1]
+
+    if flip_v:
+        image = image[::-1, :]
+
+    if transpose:
+        image = image.T
 
-        # Convert to contiguous uint8 array.
-        rescaled += 0.5
-        rescaled = rescaled.astype(numpy.uint8, order='C')
+    # mode = "clip" as otherwise numpy.take() buffers the output.
+    numpy.take(lut, image, out = rescaled, mode = "clip")
 
     return [rescaled, image_min, image_max]
 
@@ -7,15 +7,33 @@ Hazen 03/17
 
 import copy
 import datetime
+import numpy
+import os
 import struct
 import tifffile
 import time
 
 from PyQt5 import QtCore
 
+# HDF5 is optional.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# If available, use the (much faster) Blosc compression filter.
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+import storm_control.sc_library.frameIndex as frameIndex
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
+import storm_control.hal4000.camera.frameGaps as frameGaps
+import storm_control.hal4000.camera.frameTracing as frameTracing
+
 
 class ImageWriterException(halExceptions.HalException):
     pass
@@ -31,10 +49,22 @@ def availableFileFormats(test_mode):
     #        extension.
     #
 
+    formats = [".dax", ".fast.dax", ".stripes", ".tif", ".big.tif"]
+    if h5py is not None:
+        formats.append(".h5")
     if test_mode:
-        return [".dax", ".tif", ".big.tif", ".test"]
-    else:
-        return [".dax", ".tif", ".big.tif"]
+        formats.append(".test")
+    return formats
+
+def commitFrame(frame, commit_time):
+    """
+    Called once a frame has been written to disk (or at least handed
+    off to the OS).
+    """
+    frame.commit_time = commit_time
+    frameTracing.traceFrame(frame, "commit", frame.acquisition_time, commit_time)
+    frameTracing.traceFrame(frame, "write", frame.enqueue_time, commit_time)
+
 
 def createFileWriter(camera_functionality, film_settings):
     """
@@ -45,10 +75,19 @@ def createFileWriter(camera_functionality, film_settings):
     if (ft == ".dax"):
         return DaxFile(camera_functionality = camera_functionality,
                        film_settings = film_settings)
+    elif (ft == ".fast.dax"):
+        return BatchedDaxFile(camera_functionality = camera_functionality,
+                              film_settings = film_settings)
+    elif (ft == ".h5"):
+        return HDF5File(camera_functionality = camera_functionality,
+                        film_settings = film_settings)
     elif (ft == ".big.tif"):
         return TIFFile(bigtiff = True,
                        camera_functionality = camera_functionality,
                        film_settings = film_settings)
+    elif (ft == ".stripes"):
+        return StripedDaxFile(camera_functionality = camera_functionality,
+                              film_settings = film_settings)
     elif (ft == ".spe"):
         return SPEFile(camera_functionality = camera_functionality,
                        film_settings = film_settings)
@@ -61,34 +100,269 @@ def createFileWriter(camera_functionality, film_settings):
     else:
         raise ImageWriterException("Unknown output file format '" + ft + "'")
 
+def fileExtension(filetype):
+    """
+    Return the file extension that is used for a filetype. These are
+    the same except for the file types which are just a different way
+    of writing one of the standard formats.
+    """
+    if (filetype == ".fast.dax"):
+        return ".dax"
+    else:
+        return filetype
 
-class BaseFileWriter(object):
 
+class WriterThread(QtCore.QThread):
+    """
+    Drains a bounded ring buffer of frames in its own thread so that
+    the actual disk I/O does not happen in the GUI thread.
+
+    When the buffer is full addFrame() either blocks until the thread
+    has made some space ("block"), or discards the frame and counts
+    it as dropped ("drop").
+    """
+    def __init__(self, commit_fn = None, overflow = "block", queue_depth = 1, write_fn = None, **kwds):
+        super().__init__(**kwds)
+        assert(overflow in ["block", "drop"])
+        assert(queue_depth > 0)
+
+        self.buffer = [None] * queue_depth
+        self.commit_fn = commit_fn
+        self.count = 0
+        self.dropped = 0
+        self.error = None
+        self.head = 0
+        self.max_count = 0
+        self.overflow = overflow
+        self.running = True
+        self.write_fn = write_fn
+
+        # Write statistics, only used by the thread.
+        self.bytes_written = 0
+        self.time_first = None
+        self.time_last = None
+
+        self.mutex = QtCore.QMutex()
+        self.not_empty = QtCore.QWaitCondition()
+        self.not_full = QtCore.QWaitCondition()
+
+    def addFrame(self, frame):
+        """
+        Add a frame to the buffer. Returns False if the frame was dropped.
+        """
+        self.mutex.lock()
+        if self.overflow == "block":
+            while (self.count == len(self.buffer)) and (self.error is None):
+                self.not_full.wait(self.mutex)
+
+        # If the thread has failed there is nobody to write the frame.
+        if (self.count == len(self.buffer)) or (self.error is not None):
+            self.dropped += 1
+            self.mutex.unlock()
+            return False
+
+        self.buffer[(self.head + self.count) % len(self.buffer)] = frame
+        self.count += 1
+        if (self.count > self.max_count):
+            self.max_count = self.count
+        self.not_empty.wakeOne()
+        self.mutex.unlock()
+        return True
+
+    def getDropped(self):
+        return self.dropped
+
+    def getError(self):
+        return self.error
+
+    def getMaxQueueDepth(self):
+        return self.max_count
+
+    def getWriteRate(self):
+        """
+        Return the sustained write rate in MB/s.
+        """
+        if (self.time_first is None) or (self.time_last <= self.time_first):
+            return 0.0
+        return self.bytes_written * 0.000000953674 / (self.time_last - self.time_first)
+
+    def run(self):
+        while True:
+            self.mutex.lock()
+            while (self.count == 0) and self.running:
+                self.not_empty.wait(self.mutex)
+            if (self.count == 0):
+                self.mutex.unlock()
+                break
+            frame = self.buffer[self.head]
+            self.buffer[self.head] = None
+            self.head = (self.head + 1) % len(self.buffer)
+            self.count -= 1
+            self.not_full.wakeOne()
+            self.mutex.unlock()
+
+            try:
+                if self.time_first is None:
+                    self.time_first = time.perf_counter()
+                self.write_fn(frame)
+                self.bytes_written += frame.getData().nbytes
+                self.time_last = time.perf_counter()
+                if self.commit_fn is not None:
+                    self.commit_fn(frame, self.time_last)
+            except Exception as exception:
+                self.mutex.lock()
+                self.error = exception
+                self.running = False
+                self.dropped += self.count + 1
+                self.buffer = [None] * len(self.buffer)
+                self.count = 0
+                self.not_full.wakeAll()
+                self.mutex.unlock()
+                break
+
+    def stopThread(self):
+        """
+        Wait for the thread to write all of the frames in the buffer.
+        """
+        self.mutex.lock()
+        self.running = False
+        self.not_empty.wakeAll()
+        self.mutex.unlock()
+        self.wait()
+        
+
+class BaseFileWriter(object):
+    """
+    Base class for the image writers. Sub-classes should implement
+    writeFrame(), which is called either directly from the slot that
+    receives the camera frames or from a WriterThread.
+    """
     def __init__(self, camera_functionality = None, film_settings = None, **kwds):
         super().__init__(**kwds)
         self.cam_fn = camera_functionality
         self.film_settings = film_settings
+        self.frame_index = None
+        self.gap_detector = frameGaps.monitor.getDetector(self.cam_fn.getCameraName(), "writer")
         self.stopped = False
+        self.writer_thread = None
 
         # This is the frame size in MB.
         self.frame_size = self.cam_fn.getParameter("bytes_per_frame") *  0.000000953674
+        self.number_committed = 0
         self.number_frames = 0
 
+        # These are for the acquisition statistics.
+        self.bytes_written = 0
+        self.time_first = None
+        self.time_last = None
+
         # Figure out the filename.
         self.basename = self.film_settings.getBasename()
         if (len(self.cam_fn.getParameter("extension")) != 0):
             self.basename += "_" + self.cam_fn.getParameter("extension")
-        self.filename = self.basename + self.film_settings.getFiletype()
+        self.filename = self.basename + fileExtension(self.film_settings.getFiletype())
+
+        # Create the frame index file (if requested).
+        if self.film_settings.getWriterIndex():
+            self.frame_index = frameIndex.FrameIndexWriter(filename = self.basename + ".idx",
+                                                           x_pixels = self.cam_fn.getParameter("x_pixels"),
+                                                           y_pixels = self.cam_fn.getParameter("y_pixels"),
+                                                           extension = fileExtension(self.film_settings.getFiletype()))
+
+        # Start the thread that will do the actual writing (if requested).
+        if self.film_settings.getWriterAsync():
+            self.writer_thread = WriterThread(commit_fn = self.commitFrame,
+                                              overflow = self.film_settings.getWriterOverflow(),
+                                              queue_depth = self.film_settings.getWriterQueueDepth(),
+                                              write_fn = self.writeFrame)
+            self.writer_thread.start(QtCore.QThread.NormalPriority)
 
         # Connect the camera functionality.
-        self.cam_fn.newFrame.connect(self.saveFrame)
+        self.cam_fn.newFrames.connect(self.saveFrames)
         self.cam_fn.stopped.connect(self.handleStopped)
 
     def closeWriter(self):
+        """
+        Sub-classes should call this before closing their file(s), this
+        will block until all the frames in the buffer have been written.
+        """
         assert self.stopped
-        self.cam_fn.newFrame.disconnect(self.saveFrame)
+        self.cam_fn.newFrames.disconnect(self.saveFrames)
         self.cam_fn.stopped.disconnect(self.handleStopped)
 
+        error = None
+        if self.writer_thread is not None:
+            self.writer_thread.stopThread()
+            error = self.writer_thread.getError()
+
+        # The frame index is closed even if writing failed, as it is
+        # needed to recover what was written.
+        try:
+            self.flushWriter()
+        except Exception as exception:
+            if error is None:
+                error = exception
+        if self.frame_index is not None:
+            self.frame_index.close()
+
+        if error is not None:
+            raise ImageWriterException("Writing " + self.filename + " failed, " + str(error))
+
+    def commitFrame(self, frame, commit_time):
+        """
+        Called once a frame has been written, in the order that the
+        frames were saved. This also adds the frame to the frame index.
+        """
+        commitFrame(frame, commit_time)
+        if self.frame_index is not None:
+            [stripe, offset] = self.frameLocation(self.number_committed)
+            self.frame_index.addFrame(self.number_committed,
+                                      frame.frame_number,
+                                      frame.enqueue_time,
+                                      stripe,
+                                      offset)
+        self.number_committed += 1
+
+    def flushWriter(self):
+        """
+        Sub-classes that buffer frames themselves should write (and
+        commit) them here. This is called by closeWriter() before the
+        frame index is closed.
+        """
+        pass
+
+    def frameLocation(self, index):
+        """
+        Returns [stripe, byte offset in the stripe / file] of the frame
+        index of the film. The offset is -1 for formats where this is
+        decided by the library that writes the file (HDF5, TIF).
+        """
+        return [0, -1]
+
+    def getAcquisitionParameters(self):
+        """
+        Return a list of parameters describing how the writing went,
+        these are saved in the 'acquisition' section of the film XML.
+        """
+        prefix = self.cam_fn.getCameraName().replace(".", "_") + "_"
+        if self.writer_thread is not None:
+            dropped = self.writer_thread.getDropped()
+            max_depth = self.writer_thread.getMaxQueueDepth()
+            rate = self.writer_thread.getWriteRate()
+        else:
+            dropped = 0
+            max_depth = 0
+            rate = 0.0
+            if (self.time_first is not None) and (self.time_last > self.time_first):
+                rate = self.bytes_written * 0.000000953674 / (self.time_last - self.time_first)
+
+        return [params.ParameterInt(name = prefix + "dropped_frames",
+                                    value = dropped),
+                params.ParameterInt(name = prefix + "max_queue_depth",
+                                    value = max_depth),
+                params.ParameterFloat(name = prefix + "write_rate",
+                                      value = rate)]
+                    
     def getSize(self):
         return self.frame_size * self.number_frames
     
@@ -97,10 +371,45 @@ class BaseFileWriter(object):
 
     def isStopped(self):
         return self.stopped
+
+    def saveParameters(self, parameters):
+        """
+        Called with the film parameters once the writer has been closed
+        and the film XML file has been saved. Writers for formats that can
+        store this information in the movie file should override this.
+        """
+        pass
         
-    def saveFrame(self):
+    def saveFrame(self, frame):
+        """
+        Note that number_frames only counts the frames that were
+        actually saved (or queued to be saved).
+        """
+        self.gap_detector.checkFrame(frame.frame_number)
+        timestamp = time.perf_counter()
+        frame.enqueue_time = timestamp
+        frameTracing.traceFrame(frame, "enqueue", frame.acquisition_time, timestamp)
+        if self.writer_thread is not None:
+            if not self.writer_thread.addFrame(frame):
+                self.gap_detector.addDropped(frame.frame_number)
+                return
+        else:
+            if self.time_first is None:
+                self.time_first = timestamp
+            self.writeFrame(frame)
+            self.bytes_written += frame.getData().nbytes
+            self.time_last = time.perf_counter()
+            self.commitFrame(frame, self.time_last)
+
         self.number_frames += 1
 
+    def saveFrames(self, frames):
+        for frame in frames:
+            self.saveFrame(frame)
+
+    def writeFrame(self, frame):
+        assert False
+
 
 class DaxFile(BaseFileWriter):
     """
@@ -116,8 +425,20 @@ class DaxFile(BaseFileWriter):
         now stored in the .xml file that is saved with each recording.
         """
         super().closeWriter()
+        self.closeFile()
+        self.writeInfFile()
+
+    def closeFile(self):
         self.fp.close()
 
+    def frameLocation(self, index):
+        return [0, index * self.cam_fn.getParameter("bytes_per_frame")]
+
+    def writeFrame(self, frame):
+        np_data = frame.getData()
+        np_data.tofile(self.fp)
+
+    def writeInfFile(self):
         w = str(self.cam_fn.getParameter("x_pixels"))
         h = str(self.cam_fn.getParameter("y_pixels"))
         with open(self.basename + ".inf", "w") as inf_fp:
@@ -132,10 +453,176 @@ class DaxFile(BaseFileWriter):
                 inf_fp.write("y_end = " + h + "\n")
             inf_fp.close()
 
-    def saveFrame(self, frame):
-        super().saveFrame()
-        np_data = frame.getData()
-        np_data.tofile(self.fp)
+
+class BatchedDaxFile(DaxFile):
+    """
+    Dax file writing class for high data rates. Frames are copied into a
+    large buffer which is written to disk in a single call once it is full.
+    Fixed length films are pre-allocated on disk, and the file is truncated
+    to the actual size when it is closed.
+
+    If requested, and if the OS and file system support it, the file is
+    written with O_DIRECT which bypasses the page cache. Otherwise the OS
+    is told (where possible) that we won't be reading the data back.
+
+    Frames are only committed (and added to the frame index) once the
+    buffer that they are in has been written.
+    """
+    # O_DIRECT requires both the memory and the file offsets to be
+    # aligned to the file system block size.
+    alignment = 4096
+    
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.direct_io = False
+        self.file_bytes = 0
+        self.fadvise = hasattr(os, "posix_fadvise")
+
+        # Batch size in bytes, this is a multiple of the alignment.
+        batch_size = self.film_settings.getWriterBatchSize() * 1024 * 1024
+        batch_size = max(self.alignment, batch_size - (batch_size % self.alignment))
+
+        # Create an aligned buffer.
+        temp = numpy.empty(batch_size + self.alignment, dtype = numpy.uint8)
+        offset = (-temp.ctypes.data) % self.alignment
+        self.buffer = temp[offset:offset+batch_size]
+        self.buffer_bytes = 0
+        self.uncommitted = []
+
+        # Re-open without buffering (and maybe with O_DIRECT).
+        self.fp.close()
+        flags = os.O_WRONLY | getattr(os, "O_BINARY", 0)
+        if self.film_settings.getWriterDirectIO() and hasattr(os, "O_DIRECT"):
+            try:
+                self.fd = os.open(self.filename, flags | os.O_DIRECT)
+                self.direct_io = True
+            except OSError:
+                print(">> O_DIRECT is not supported for", self.filename)
+        if not self.direct_io:
+            self.fd = os.open(self.filename, flags)
+            if self.fadvise:
+                os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        self.fp = os.fdopen(self.fd, "wb", buffering = 0)
+
+        # Pre-allocate the file for fixed length films.
+        if self.film_settings.isFixedLength():
+            size = self.film_settings.getFilmLength() * self.cam_fn.getParameter("bytes_per_frame")
+            try:
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(self.fd, 0, size)
+                else:
+                    os.ftruncate(self.fd, size)
+            except OSError as exception:
+                print(">> Could not pre-allocate", self.filename, str(exception))
+
+    def closeFile(self):
+
+        # Remove pre-allocated space (and padding) that we did not use.
+        os.ftruncate(self.fd, self.file_bytes)
+        self.fp.close()
+
+    def commitFrame(self, frame, commit_time):
+        """
+        The frames are committed by writeBuffer().
+        """
+        pass
+
+    def flushWriter(self):
+
+        # Write whatever is left in the buffer.
+        if (self.buffer_bytes > 0):
+            if self.direct_io:
+                size = self.buffer_bytes + (-self.buffer_bytes % self.alignment)
+                self.buffer[self.buffer_bytes:size] = 0
+                self.writeBuffer(size)
+            else:
+                self.writeBuffer(self.buffer_bytes)
+
+    def writeBuffer(self, size):
+        """
+        Write the first size bytes of the buffer. This can be larger than
+        buffer_bytes if the last block was padded for O_DIRECT.
+        """
+        mv = memoryview(self.buffer[:size])
+        written = 0
+        while (written < size):
+            written += self.fp.write(mv[written:])
+
+        # Hopefully the previous batch has made it to the disk by now.
+        if self.fadvise and not self.direct_io and (self.file_bytes > 0):
+            os.posix_fadvise(self.fd, 0, self.file_bytes, os.POSIX_FADV_DONTNEED)
+
+        self.file_bytes += self.buffer_bytes
+        self.buffer_bytes = 0
+
+        # Commit the frames that were completely in this buffer.
+        commit_time = time.perf_counter()
+        for frame in self.uncommitted:
+            super().commitFrame(frame, commit_time)
+        self.uncommitted = []
+        
+    def writeFrame(self, frame):
+        np_data = frame.getData().reshape(-1).view(numpy.uint8)
+        start = 0
+        while (start < np_data.size):
+            n_bytes = min(np_data.size - start, self.buffer.size - self.buffer_bytes)
+            self.buffer[self.buffer_bytes:self.buffer_bytes+n_bytes] = np_data[start:start+n_bytes]
+            self.buffer_bytes += n_bytes
+            start += n_bytes
+            if (start == np_data.size):
+                self.uncommitted.append(frame)
+            if (self.buffer_bytes == self.buffer.size):
+                self.writeBuffer(self.buffer.size)
+
+
+class HDF5File(BaseFileWriter):
+    """
+    HDF5 file writing class. The frames are stored in the 'movie' data
+    set, one (compressed) chunk per frame, and the film parameters are
+    stored as a XML string in the 'parameters' data set.
+
+    The file is written in single-writer / multiple-reader (SWMR) mode
+    so that the analysis can start while the film is still being taken.
+    The data is flushed to disk at least once a second.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.last_flush = time.time()
+        self.x_pixels = self.cam_fn.getParameter("x_pixels")
+        self.y_pixels = self.cam_fn.getParameter("y_pixels")
+
+        if hdf5plugin is not None:
+            compression = hdf5plugin.Blosc(cname = "lz4",
+                                           clevel = 5,
+                                           shuffle = hdf5plugin.Blosc.SHUFFLE)
+        else:
+            compression = {"compression" : "lzf",
+                           "shuffle" : True}
+
+        self.h5 = h5py.File(self.filename, "w", libver = "latest")
+        self.movie = self.h5.create_dataset("movie",
+                                            shape = (0, self.y_pixels, self.x_pixels),
+                                            maxshape = (None, self.y_pixels, self.x_pixels),
+                                            chunks = (1, self.y_pixels, self.x_pixels),
+                                            dtype = numpy.uint16,
+                                            **compression)
+        self.h5.swmr_mode = True
+
+    def closeWriter(self):
+        super().closeWriter()
+        self.h5.close()
+
+    def saveParameters(self, parameters):
+        with h5py.File(self.filename, "a") as h5:
+            h5.create_dataset("parameters", data = parameters.toString())
+
+    def writeFrame(self, frame):
+        n = self.movie.shape[0]
+        self.movie.resize(n + 1, axis = 0)
+        self.movie[n] = frame.getData().reshape((self.y_pixels, self.x_pixels))
+        if ((time.time() - self.last_flush) > 1.0):
+            self.movie.flush()
+            self.last_flush = time.time()
 
 
 class SPEFile(BaseFileWriter):
@@ -178,10 +665,138 @@ class SPEFile(BaseFileWriter):
         self.fp.seek(1446)
         self.fp.write(struct.pack("i", self.number_frames))
 
-    def saveFrame(self, frame):
-        super().saveFrame()
+    def frameLocation(self, index):
+        return [0, 4100 + index * self.cam_fn.getParameter("bytes_per_frame")]
+
+    def writeFrame(self, frame):
         np_data = frame.getData()
-        np_data.tofile(self.file_ptrs[index])
+        np_data.tofile(self.fp)
+
+
+class DaxStripe(object):
+    """
+    A single stripe of a striped film, this has its own writer thread.
+
+    commit_fn is called with the stripe, the index of the frame in the
+    stripe, the frame and the commit time.
+    """
+    def __init__(self, commit_fn = None, filename = None, queue_depth = None, stripe = None, **kwds):
+        super().__init__(**kwds)
+        self.commit_fn = commit_fn
+        self.filename = filename
+        self.fp = open(self.filename, "wb")
+        self.number_committed = 0
+        self.stripe = stripe
+
+        # This has to block as dropping frames would scramble the film.
+        self.writer_thread = WriterThread(commit_fn = self.commitFrame,
+                                          overflow = "block",
+                                          queue_depth = queue_depth,
+                                          write_fn = self.writeFrame)
+        self.writer_thread.start(QtCore.QThread.NormalPriority)
+
+    def addFrame(self, frame):
+        self.writer_thread.addFrame(frame)
+
+    def close(self):
+        """
+        Returns the writer thread error (if any).
+        """
+        self.writer_thread.stopThread()
+        self.fp.close()
+        return self.writer_thread.getError()
+
+    def commitFrame(self, frame, commit_time):
+        self.commit_fn(self.stripe, self.number_committed, frame, commit_time)
+        self.number_committed += 1
+
+    def getFilename(self):
+        return self.filename
+        
+    def writeFrame(self, frame):
+        frame.getData().tofile(self.fp)
+
+
+class StripedDaxFile(BaseFileWriter):
+    """
+    Striped .dax file writing class. This is for data rates that are too
+    high for a single disk. Blocks of frames are written to each stripe in
+    turn, with one stripe (and writer thread) per directory. Presumably each
+    of these directories is on a different disk.
+
+    The film file is a manifest (in .inf format) that lists the stripes.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.block_frames = self.film_settings.getWriterStripeFrames()
+        self.stripe_frames = 0
+
+        directories = self.film_settings.getWriterStripeDirectories()
+        if (len(directories) == 0):
+            directories = [""]
+
+        film_dir = os.path.dirname(self.basename)
+        film_name = os.path.basename(self.basename)
+        self.stripes = []
+        for i, directory in enumerate(directories):
+            filename = os.path.join(film_dir, directory, film_name + "_s" + str(i) + ".dax")
+            self.stripes.append(DaxStripe(commit_fn = self.commitStripeFrame,
+                                          filename = filename,
+                                          queue_depth = self.film_settings.getWriterQueueDepth(),
+                                          stripe = i))
+        self.stripe_errors = []
+
+        # This is re-written when the film is closed with the final number of frames.
+        self.writeManifest()
+
+    def closeWriter(self):
+        super().closeWriter()
+        self.writeManifest()
+        if (len(self.stripe_errors) > 0):
+            raise ImageWriterException("Writing " + self.filename + " failed, " + "; ".join(self.stripe_errors))
+
+    def commitFrame(self, frame, commit_time):
+        """
+        The frames are committed by the stripe writer threads.
+        """
+        pass
+
+    def commitStripeFrame(self, stripe, stripe_index, frame, commit_time):
+        """
+        This is called from the stripe writer threads, so the frames of
+        the different stripes are not necessarily committed in order.
+        """
+        commitFrame(frame, commit_time)
+        if self.frame_index is not None:
+            block = stripe_index // self.block_frames
+            index = (block * len(self.stripes) + stripe) * self.block_frames + stripe_index % self.block_frames
+            self.frame_index.addFrame(index,
+                                      frame.frame_number,
+                                      frame.enqueue_time,
+                                      stripe,
+                                      stripe_index * self.cam_fn.getParameter("bytes_per_frame"))
+
+    def flushWriter(self):
+        for stripe in self.stripes:
+            error = stripe.close()
+            if error is not None:
+                self.stripe_errors.append(stripe.getFilename() + ", " + str(error))
+
+    def writeFrame(self, frame):
+        stripe = (self.stripe_frames // self.block_frames) % len(self.stripes)
+        self.stripes[stripe].addFrame(frame)
+        self.stripe_frames += 1
+
+    def writeManifest(self):
+        w = str(self.cam_fn.getParameter("x_pixels"))
+        h = str(self.cam_fn.getParameter("y_pixels"))
+        with open(self.filename, "w") as fp:
+            fp.write("data type = 16 bit integers (binary, little endian)\n")
+            fp.write("frame dimensions = " + w + " x " + h + "\n")
+            fp.write("number of frames = " + str(self.stripe_frames) + "\n")
+            fp.write("block frames = " + str(self.block_frames) + "\n")
+            for stripe in self.stripes:
+                fp.write("stripe = " + os.path.abspath(stripe.getFilename()) + "\n")
 
 
 class TestFile(DaxFile):
@@ -206,6 +821,16 @@ class TestFile(DaxFile):
 class TIFFile(BaseFileWriter):
     """
     TIF file writing class. This supports both normal and 'big' tiff.
+
+    The frames are written as a single contiguous series. This means that
+    tifffile only writes the frame data as it arrives, the metadata is
+    written once and the page information is written when the file is
+    closed.
+
+    Note that the frames are passed to tifffile one at a time because it
+    will only append data with exactly the same shape to a contiguous
+    series, so the last (partial) batch of a batched write would start
+    a new series.
     """
     def __init__(self, bigtiff = False, **kwds):
         super().__init__(**kwds)
@@ -220,17 +845,22 @@ class TIFFile(BaseFileWriter):
             self.tif = tifffile.TiffWriter(self.filename,
                                            imagej = True)
 
+        # tifffile renamed save() to write().
+        if hasattr(self.tif, "write"):
+            self.tif_write = self.tif.write
+        else:
+            self.tif_write = self.tif.save
+
     def closeWriter(self):
         super().closeWriter()
         self.tif.close()
         
-    def saveFrame(self, frame):
-        super().saveFrame()
+    def writeFrame(self, frame):
         image = frame.getData()
-        self.tif.save(image.reshape((frame.image_y, frame.image_x)),
-                      metadata = self.metadata,
-                      resolution = self.resolution)
-
+        self.tif_write(image.reshape((frame.image_y, frame.image_x)),
+                       contiguous = True,
+                       metadata = self.metadata,
+                       resolution = self.resolution)
 
 #
 # The MIT License
@@ -8,6 +8,7 @@ Hazen 3/17.
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+import math
 import numpy
 
 import storm_control.hal4000.halLib.c_image_manipulation_c as c_image
@@ -23,6 +24,10 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
 
     If the image is binned then the rendered image needs to be
     up-sampled appropriately to compensate for the binning.
+
+    If the image is larger than it's size on the screen then only
+    the visible part of the image is rendered, and only every Nth
+    pixel of that if the image is zoomed out.
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
@@ -41,9 +46,11 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
         self.frame_y_offset = 0
         self.image_max = 0
         self.image_min = 0
+        self.image_rect = QtCore.QRectF()
         self.intensity_info = 0
         self.max_intensity = None
         self.q_image = None
+        self.rescaler = c_image.ImageRescaler()
         self.scale_x = 1
         self.scale_y = 1
 
@@ -91,10 +98,8 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
     def paint(self, painter, option, widget):
         if self.q_image is not None:
 
-            # Draw the image.
-            painter.drawImage(self.frame_x_offset,
-                              self.frame_y_offset,
-                              self.q_image)
+            # Draw the image, this also up-samples it as necessary.
+            painter.drawImage(self.image_rect, self.q_image)
             
             # Draw the grid into the buffer.
             if self.draw_grid:
@@ -137,9 +142,16 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
     def setShowTarget(self, show):
         self.draw_target = show
         
-    def updateImageWithFrame(self, frame):
+    def updateImageWithFrame(self, frame, visible_rect = None, view_scale = 1.0):
         """
         Convert the frame to a QImage, then call update() to display it.
+
+        visible_rect is the part of the chip that is visible (in chip
+        coordinates), and view_scale is the size of a chip pixel in screen
+        pixels. If visible_rect is None the whole frame is rendered.
+
+        Note that the image minimum and maximum are those of the part of
+        the frame that was rendered.
         """
         #
         # For reasons lost in the mists of time 'frame' is a 1D numpy array
@@ -158,21 +170,42 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
         if not self.display_saturated_pixels:
             max_intensity = None
 
+        # Figure out which pixels of the frame we actually need.
+        if visible_rect is not None:
+            [x_start, x_end, x_step] = visibleRange(visible_rect.left(),
+                                                    visible_rect.right(),
+                                                    self.frame_x_offset,
+                                                    self.scale_x,
+                                                    view_scale,
+                                                    w)
+            [y_start, y_end, y_step] = visibleRange(visible_rect.top(),
+                                                    visible_rect.bottom(),
+                                                    self.frame_y_offset,
+                                                    self.scale_y,
+                                                    view_scale,
+                                                    h)
+        else:
+            [x_start, x_end, x_step] = [0, w, 1]
+            [y_start, y_end, y_step] = [0, h, 1]
+        display_data = image_data[y_start:y_end:y_step, x_start:x_end:x_step]
+        [d_h, d_w] = display_data.shape
+
         # Rescale the image & record it's minimum and maximum.
-        [temp, self.image_min, self.image_max] = c_image.rescaleImage(image_data,
-                                                                      False,
-                                                                      False,
-                                                                      False,
-                                                                      self.display_range,
-                                                                      max_intensity)
+        [temp, self.image_min, self.image_max] = self.rescaler.rescaleImage(display_data,
+                                                                            False,
+                                                                            False,
+                                                                            False,
+                                                                            self.display_range,
+                                                                            max_intensity)
         
-        # Create QImage & re-scale to compensate for binning, if any.
-        temp_image = QtGui.QImage(temp.data, w, h, QtGui.QImage.Format_Indexed8)
-        if (self.scale_x != 1) or (self.scale_y != 1):
-            self.q_image = temp_image.scaled(w * self.scale_x, h * self.scale_y)
-        else:
-            self.q_image = temp_image
+        # Create QImage, the scaling to compensate for binning and decimation
+        # (if any) is done when the image is drawn.
+        self.q_image = QtGui.QImage(temp.data, d_w, d_h, d_w, QtGui.QImage.Format_Indexed8)
         self.q_image.ndarray = temp
+        self.image_rect = QtCore.QRectF(self.frame_x_offset + x_start * self.scale_x,
+                                        self.frame_y_offset + y_start * self.scale_y,
+                                        (min(x_start + d_w * x_step, w) - x_start) * self.scale_x,
+                                        (min(y_start + d_h * y_step, h) - y_start) * self.scale_y)
 
         # Set the images color table.
         self.setColorTable()
@@ -192,6 +225,34 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
 
 class QtCameraGraphicsScene(QtWidgets.QGraphicsScene):
     pass
+
+
+def visibleRange(v_min, v_max, offset, frame_scale, view_scale, size):
+    """
+    Returns [start, end, step] of the frame pixels to render in one
+    dimension.
+
+    v_min, v_max - The visible range in chip coordinates.
+    offset - The chip coordinate of the first frame pixel.
+    frame_scale - The size of a frame pixel in chip pixels (binning).
+    view_scale - The size of a chip pixel in screen pixels (zoom).
+    size - The size of the frame in pixels.
+    """
+    step = max(1, int(1.0/(view_scale * frame_scale)))
+
+    # Add a margin so that there are no blank edges while scrolling.
+    margin = 0.25 * (v_max - v_min)
+    start = max(0, int(math.floor((v_min - margin - offset)/frame_scale)))
+    end = min(size, int(math.ceil((v_max + margin - offset)/frame_scale)))
+
+    # Nothing is visible, render all of it.
+    if (end <= start):
+        [start, end] = [0, size]
+
+    # Start on a multiple of step so that the pixels that are
+    # rendered don't change when the view moves.
+    start = step * (start//step)
+    return [start, end, step]
         
         
 #
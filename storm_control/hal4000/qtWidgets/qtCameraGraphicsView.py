@@ -38,6 +38,7 @@ class QtCameraGraphicsView(QtWidgets.QGraphicsView):
         self.max_scale = 8
         self.min_scale = -8
         self.transform = QtGui.QTransform()
+        self.view_scale = 1.0
         self.viewport_min = 100
 
         self.setAcceptDrops(True)
@@ -60,6 +61,14 @@ class QtCameraGraphicsView(QtWidgets.QGraphicsView):
         self.center_y = center.y()
         self.newCenter.emit(self.center_x, self.center_y)
         
+    def getVisibleRegion(self):
+        """
+        Returns [the visible part of the scene (chip coordinates),
+        the size of a scene (chip) pixel in screen pixels].
+        """
+        visible_rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        return [visible_rect, self.view_scale * self.devicePixelRatioF()]
+
     def keyPressEvent(self, event):
         if self.can_drag and (event.key() == QtCore.Qt.Key_Control):
             self.ctrl_key_down = True
@@ -197,6 +206,7 @@ class QtCameraGraphicsView(QtWidgets.QGraphicsView):
             flt_scale = 1.0/(-self.display_scale + 1)
 
         self.drag_scale = 1.0/flt_scale
+        self.view_scale = flt_scale
         transform = QtGui.QTransform()
         transform.scale(flt_scale, flt_scale)
         self.setTransform(self.transform * transform)
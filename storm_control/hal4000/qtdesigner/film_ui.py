@@ -139,6 +139,16 @@ class Ui_GroupBox(object):
         self.sizeText.setObjectName("sizeText")
         self.horizontalLayout_6.addWidget(self.sizeText)
         self.verticalLayout.addLayout(self.horizontalLayout_6)
+        self.horizontalLayout_7 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
+        self.droppedLabel = QtWidgets.QLabel(GroupBox)
+        self.droppedLabel.setObjectName("droppedLabel")
+        self.horizontalLayout_7.addWidget(self.droppedLabel)
+        self.droppedText = QtWidgets.QLabel(GroupBox)
+        self.droppedText.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.droppedText.setObjectName("droppedText")
+        self.horizontalLayout_7.addWidget(self.droppedText)
+        self.verticalLayout.addLayout(self.horizontalLayout_7)
         self.horizontalLayout_5 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_5.setObjectName("horizontalLayout_5")
         self.autoShuttersCheckBox = QtWidgets.QCheckBox(GroupBox)
@@ -191,6 +201,8 @@ class Ui_GroupBox(object):
         self.framesText.setText(_translate("GroupBox", "asdf"))
         self.sizeLabel.setText(_translate("GroupBox", "Size:"))
         self.sizeText.setText(_translate("GroupBox", "asdf"))
+        self.droppedLabel.setText(_translate("GroupBox", "Dropped:"))
+        self.droppedText.setText(_translate("GroupBox", "asdf"))
         self.autoShuttersCheckBox.setText(_translate("GroupBox", "Run Shutters"))
         self.saveMovieCheckBox.setText(_translate("GroupBox", "Save Movie"))
         self.liveModeCheckBox.setText(_translate("GroupBox", "Live Mode"))
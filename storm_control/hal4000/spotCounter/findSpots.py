@@ -148,6 +148,10 @@ class SpotCounter(QtCore.QObject):
         if was_dropped:
             self.dropped += 1
 
+    def newFramesToAnalyze(self, camera_name, frames, threshold):
+        for frame in frames:
+            self.newFrameToAnalyze(camera_name, frame, threshold)
+
 
 #
 # The MIT License
@@ -54,11 +54,11 @@ class Analyzer(QtCore.QObject):
                                                      scale_bar_len = parameters.get("scale_bar_len"),
                                                      shutters_info = shutters_info)
 
-        self.camera_fn.newFrame.connect(self.handleNewFrame)
+        self.camera_fn.newFrames.connect(self.handleNewFrames)
         self.spot_counter.imageProcessed.connect(self.handleProcessedImage)
 
     def cleanUp(self):
-        self.camera_fn.newFrame.disconnect(self.handleNewFrame)
+        self.camera_fn.newFrames.disconnect(self.handleNewFrames)
         self.spot_counter.imageProcessed.disconnect(self.handleProcessedImage)
         
     def getCameraName(self):
@@ -73,10 +73,10 @@ class Analyzer(QtCore.QObject):
     def getSpotPicture(self):
         return self.spot_picture
     
-    def handleNewFrame(self, frame):
-        self.spot_counter.newFrameToAnalyze(self.camera_fn.getCameraName(),
-                                            frame,
-                                            self.threshold)
+    def handleNewFrames(self, frames):
+        self.spot_counter.newFramesToAnalyze(self.camera_fn.getCameraName(),
+                                             frames,
+                                             self.threshold)
         
     def handleProcessedImage(self, frame_analysis):
         if (frame_analysis.getCameraName() == self.camera_fn.getCameraName()):
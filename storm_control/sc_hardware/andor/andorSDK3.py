@@ -17,6 +17,7 @@
 import ctypes
 import numpy
 import time
+import storm_control.sc_library.framePool as framePool
 import storm_control.sc_library.halExceptions as halExceptions
 
 sdk3 = None
@@ -241,25 +242,6 @@ class AndorRawData(object):
         return self.np_array.ctypes.data
 
 
-## AndorFrameData
-#
-# This class stores the converted data from the Andor camera.
-#
-class AndorFrameData(object):
-    
-    def __init__(self, size = None, **kwds):
-        super().__init__(**kwds)
-        
-        self.np_array = numpy.ascontiguousarray(numpy.empty(size, dtype = numpy.uint16))
-        self.size = size
-
-    def getData(self):
-        return self.np_array
-
-    def getDataPtr(self):
-        return self.np_array.ctypes.data
-
-
 ## SDK3Camera
 #
 # The interface to and Andor SDK3 controlled camera.
@@ -299,8 +281,7 @@ class SDK3Camera(object):
                                      "TemperatureStatus",
                                      "TriggerMode"])
         self.frame_bytes = 0
-        self.frame_data = []
-        self.frame_data_cur = 0
+        self.frame_pool = None
         self.frame_x = 0
         self.frame_y = 0
         self.pixel_encoding = ""
@@ -323,9 +304,9 @@ class SDK3Camera(object):
 
         # Create new buffers if the image size has changed. This will allocate
         # space for ~4GB of buffers (2GB for raw buffers and 2GB for the the
-        # frames), or space for 4000 frames (2000 for raw buffers and 2000 for
-        # the frames). In theory we will not be able to write over active
-        # frames because they would also be active buffers..
+        # frame pool), or space for 4000 frames (2000 for raw buffers and 2000
+        # for the frame pool). Frame pool buffers are not re-used until HAL is
+        # done with them.
         #
         if (frame_bytes != self.frame_bytes):
             self.raw_data = []
@@ -334,32 +315,38 @@ class SDK3Camera(object):
                 
         # frame_bytes can be the same even when the frame size is different.
         #
-        if ((frame_x * frame_y) != (self.frame_x * self.frame_y)):
-            self.frame_data = []
-            for i in range(n_buffers):
-                self.frame_data.append(AndorFrameData(size = frame_x * frame_y))
+        if ((frame_x * frame_y) != (self.frame_x * self.frame_y)) or (self.frame_pool is None):
+            self.frame_pool = framePool.FramePool(frame_bytes = 2 * frame_x * frame_y,
+                                                  n_buffers = n_buffers)
+        self.frame_pool.resetStatistics()
 
         for a_buffer in self.raw_data:
             sdk3.AT_QueueBuffer(self.camera_handle, 
                                 ctypes.c_void_p(a_buffer.getDataPtr()), 
                                 ctypes.c_int(a_buffer.size))
 
-        self.frame_data_cur = 0
         self.frame_x = frame_x
         self.frame_y = frame_y
         self.frame_bytes = frame_bytes
 
-    def getFrames(self):
+    def getFrames(self, timeout = 0.0):
+        """
+        Returns all of the available frames, if there are none this will
+        wait up to timeout seconds for the next frame.
+        """
         frames = []
         #current_buffer = ctypes.POINTER(ctypes.c_char)()
         current_buffer = ctypes.c_void_p()
         buffer_size = ctypes.c_longlong()
 
-        while(self.waitBuffer(current_buffer, buffer_size)):
+        wait_ms = int(1000 * timeout)
+        while(self.waitBuffer(current_buffer, buffer_size, wait_ms)):
+            wait_ms = 0
 
             # Convert the buffer to an image.
+            frame_data = self.frame_pool.getFrameData()
             check(sdk3_utility.AT_ConvertBuffer(current_buffer,
-                                                ctypes.c_void_p(self.frame_data[self.frame_data_cur].getDataPtr()),
+                                                ctypes.c_void_p(frame_data.getDataPtr()),
                                                 ctypes.c_long(self.frame_x),
                                                 ctypes.c_long(self.frame_y),
                                                 ctypes.c_long(self.stride),
@@ -367,12 +354,7 @@ class SDK3Camera(object):
                                                 ctypes.c_wchar_p("Mono16")),
                   "AT_ConvertBuffer")
 
-            frames.append(self.frame_data[self.frame_data_cur])
-
-            # Update current frame.
-            self.frame_data_cur += 1
-            if (self.frame_data_cur == len(self.frame_data)):
-                self.frame_data_cur = 0
+            frames.append(frame_data)
 
             # Re-queue the buffers.
             check(sdk3.AT_QueueBuffer(self.camera_handle, current_buffer, buffer_size))
@@ -464,8 +446,17 @@ class SDK3Camera(object):
         sendCommand(self.camera_handle, "AcquisitionStop")
         check(sdk3.AT_Flush(self.camera_handle), "AT_Flush")
 
-    def waitBuffer(self, current_buffer, buffer_size):
-        resp = sdk3.AT_WaitBuffer(self.camera_handle, ctypes.byref(current_buffer), ctypes.byref(buffer_size), 0)
+    def supportsWait(self):
+        """
+        getFrames() can block in AT_WaitBuffer.
+        """
+        return True
+
+    def waitBuffer(self, current_buffer, buffer_size, timeout = 0):
+        """
+        timeout is in milliseconds.
+        """
+        resp = sdk3.AT_WaitBuffer(self.camera_handle, ctypes.byref(current_buffer), ctypes.byref(buffer_size), ctypes.c_uint(timeout))
         if (resp == 100):
             raise AndorException("Andor thinks there will be a buffer overflow, sigh..")
         elif (resp == 0):
@@ -15,6 +15,7 @@ import ctypes
 import ctypes.util
 import numpy
 
+import storm_control.sc_library.framePool as framePool
 import storm_control.sc_library.halExceptions as halExceptions
 
 # Hamamatsu constants.
@@ -259,8 +260,8 @@ class HamamatsuCamera(object):
     Basic camera interface class.
     
     This version uses the Hamamatsu library to allocate camera buffers.
-    Storage for the data from the camera is allocated dynamically and
-    copied out of the camera buffers.
+    The data from the camera is copied out of the camera buffers into
+    buffers from a frame pool.
     """
     def __init__(self, camera_id = None, **kwds):
         """
@@ -273,6 +274,8 @@ class HamamatsuCamera(object):
         self.debug = False
         self.encoding = 'utf-8'
         self.frame_bytes = 0
+        self.frame_pool = None
+        self.frames_lost = 0
         self.frame_x = 0
         self.frame_y = 0
         self.last_frame_number = 0
@@ -316,6 +319,7 @@ class HamamatsuCamera(object):
         get the camera configured properly.
         """
         self.buffer_index = -1
+        self.frames_lost = 0
         self.last_frame_number = 0
 
         # Set sub array mode.
@@ -390,15 +394,15 @@ class HamamatsuCamera(object):
                              "dcamprop_getname")
         return properties
 
-    def getFrames(self):
+    def getFrames(self, timeout = 0.1):
         """
         Gets all of the available frames.
     
-        This will block waiting for new frames even if 
-        there new frames available when it is called.
+        This will block waiting for new frames (for up to timeout
+        seconds) even if there new frames available when it is called.
         """
         frames = []
-        for n in self.newFrames():
+        for n in self.newFrames(timeout = timeout):
 
             paramlock = DCAMBUF_FRAME(
                     0, 0, 0, n, None, 0, 0, 0, 0, 0, 0, 0, 0, 0)
@@ -409,8 +413,8 @@ class HamamatsuCamera(object):
                                                 ctypes.byref(paramlock)),
                              "dcambuf_lockframe")
 
-            # Create storage for the frame & copy into this storage.
-            hc_data = HCamData(self.frame_bytes)
+            # Get storage for the frame & copy into this storage.
+            hc_data = self.frame_pool.getFrameData()
             hc_data.copyData(paramlock.buf)
 
             frames.append(hc_data)
@@ -418,6 +422,13 @@ class HamamatsuCamera(object):
 
         return [frames, [self.frame_x, self.frame_y]]
 
+    def getFramesLost(self):
+        """
+        Returns the number of frames that were lost to buffer overruns
+        in the current acquisition.
+        """
+        return self.frames_lost
+
     def getModelInfo(self, camera_id):
         """
         Returns the model of the camera
@@ -586,13 +597,14 @@ class HamamatsuCamera(object):
         else:
             return False
 
-    def newFrames(self):
+    def newFrames(self, timeout = 0.1):
         """
         Return a list of the ids of all the new frames since the last check.
         Returns an empty list if the camera has already stopped and no frames
         are available.
     
-        This will block waiting for at least one new frame.
+        This will block waiting for at least one new frame, or until
+        timeout seconds have passed.
         """
 
         captureStatus = ctypes.c_int32(0)
@@ -605,7 +617,7 @@ class HamamatsuCamera(object):
                     0, 
                     0, 
                     DCAMWAIT_CAPEVENT_FRAMEREADY | DCAMWAIT_CAPEVENT_STOPPED, 
-                    100)
+                    int(1000 * timeout))
             paramstart.size = ctypes.sizeof(paramstart)
             self.checkStatus(dcam.dcamwait_start(self.wait_handle,
                                             ctypes.byref(paramstart)),
@@ -626,6 +638,7 @@ class HamamatsuCamera(object):
         backlog = cur_frame_number - self.last_frame_number
         if (backlog > self.number_image_buffers):
             print(">> Warning! hamamatsu camera frame buffer overrun detected!")
+            self.frames_lost += backlog - self.number_image_buffers
         if (backlog > self.max_backlog):
             self.max_backlog = backlog
         self.last_frame_number = cur_frame_number
@@ -729,6 +742,12 @@ class HamamatsuCamera(object):
         """
         self.captureSetup()
 
+        # Create a new frame pool if the frame size has changed.
+        if (self.frame_pool is None) or (self.frame_pool.frame_bytes != self.frame_bytes):
+            self.frame_pool = framePool.FramePool(frame_bytes = self.frame_bytes,
+                                                  n_buffers = framePool.poolSize(self.frame_bytes))
+        self.frame_pool.resetStatistics()
+
         #
         # Allocate Hamamatsu image buffers.
         # We allocate enough to buffer 2 seconds of data or the specified 
@@ -791,6 +810,12 @@ class HamamatsuCamera(object):
         text_values = self.getPropertyText(property_name)
         return sorted(text_values, key = text_values.get)
 
+    def supportsWait(self):
+        """
+        getFrames() blocks on a DCAM wait event.
+        """
+        return True
+
 
 class HamamatsuCameraMR(HamamatsuCamera):
     """
@@ -822,18 +847,18 @@ class HamamatsuCameraMR(HamamatsuCamera):
 
         self.setPropertyValue("output_trigger_kind[0]", 2)
 
-    def getFrames(self):
+    def getFrames(self, timeout = 0.1):
         """
         Gets all of the available frames.
         
-        This will block waiting for new frames even if there new frames 
-        available when it is called.
+        This will block waiting for new frames (for up to timeout seconds)
+        even if there new frames available when it is called.
         
         FIXME: It does not always seem to block? The length of frames can
                be zero. Are frames getting dropped? Some sort of race condition?
         """
         frames = []
-        for n in self.newFrames():
+        for n in self.newFrames(timeout = timeout):
             frames.append(self.hcam_data[n])
 
         return [frames, [self.frame_x, self.frame_y]]
@@ -8,6 +8,7 @@ import ctypes
 import numpy
 import sys
 
+import storm_control.sc_library.framePool as framePool
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_hardware.photometrics.pvcam_constants as pvc
 
@@ -98,6 +99,7 @@ class PVCAMCamera(object):
         self.buffer_len = None
         self.data_buffer = None
         self.frame_bytes = None
+        self.frame_pool = None
         self.frame_x = None
         self.frame_y = None
         self.n_captured = pvc.uns32(0) # No more than 4 billion frames in a single capture..
@@ -156,6 +158,12 @@ class PVCAMCamera(object):
         self.data_buffer = numpy.ascontiguousarray(numpy.zeros(size, dtype = numpy.uint8))
         self.buffer_len = int(size/self.frame_bytes)
 
+        # Create a new frame pool if the frame size has changed.
+        if (self.frame_pool is None) or (self.frame_pool.frame_bytes != self.frame_bytes):
+            self.frame_pool = framePool.FramePool(frame_bytes = self.frame_bytes,
+                                                  n_buffers = framePool.poolSize(self.frame_bytes))
+        self.frame_pool.resetStatistics()
+
     def getFrames(self):
         frames = []
 
@@ -173,7 +181,7 @@ class PVCAMCamera(object):
                                                 ctypes.byref(data_ptr)),
                   "pl_exp_get_oldest_frame")
 
-            pv_data = PVCAMFrameData(self.frame_bytes)
+            pv_data = self.frame_pool.getFrameData()
             pv_data.copyData(data_ptr)
             frames.append(pv_data)
             
@@ -421,34 +429,6 @@ class PVCAMCamera(object):
               "pl_exp_stop_cont")
 
 
-class PVCAMFrameData(object):
-    """
-    Store PVCAM frame data in a HAL friendly format. 
-
-    By now you'd think we'd have a generic base class for this..
-    """
-    def __init__(self, size = None, **kwds):
-        """
-        Create a data object of the appropriate size.
-        """
-        super().__init__(**kwds)
-        self.np_array = numpy.ascontiguousarray(numpy.empty(int(size/2), dtype=numpy.uint16))
-        self.size = size
-
-    def copyData(self, address):
-        """
-        Uses the C memmove function to copy data from an address in memory
-        into memory allocated for the numpy array of this object.
-        """
-        ctypes.memmove(self.np_array.ctypes.data, address, self.size)
-        
-    def getData(self):
-        return self.np_array
-
-    def getDataPtr(self):
-        return self.np_array.ctypes.data
-    
-
 if (__name__ == "__main__"):
     import tifffile
     import time
@@ -13,6 +13,10 @@ Hazen 01/19
 import numpy
 import os
 import PySpin
+import threading
+import time
+
+import storm_control.sc_library.framePool as framePool
 
 
 # Global variables.
@@ -148,21 +152,6 @@ def pySpinFinalize():
 # Classes
 #
 
-class SCamData(object):
-    """
-    Storage of camera data.
-    """
-    def __init__(self, np_array = None, **kwds):
-        super().__init__(**kwds)
-        self.np_array = np_array
-
-    def getData(self):
-        return self.np_array
-
-    def getDataPtr(self):
-        return self.np_array.ctypes.data
-    
-    
 class SpinCamera(object):
     """
     The interface to a single camera.
@@ -177,6 +166,7 @@ class SpinCamera(object):
         super().__init__(**kwds)
 
         self.frames = []
+        self.frame_pool = None
         self.frame_size = None
         self.h_camera = h_camera
         self.image_event_handler = None
@@ -187,28 +177,37 @@ class SpinCamera(object):
         # Get interface.
         self.nodemap_applayer = self.h_camera.GetNodeMap()
 
+        # This is used by SpinImageEventHandler to signal that there are new images.
+        self.frames_condition = threading.Condition()
+
         # Register for image events.
-        self.image_event_handler = SpinImageEventHandler(frame_buffer = self.frames)
+        self.image_event_handler = SpinImageEventHandler(frame_buffer = self.frames,
+                                                         frame_condition = self.frames_condition)
         self.h_camera.RegisterEvent(self.image_event_handler)
                 
         # Cached properties, these are called 'nodes' in Spinakker.
         self.properties = {}
 
-    def getFrames(self):
+    def getFrames(self, timeout = 0.0):
         """
-        Get all frames that are currently available. 
+        Get all frames that are currently available. If there are no
+        frames this waits up to timeout seconds for a new frame.
 
         The SpinImageEventHandler appends images to self.frames() each time
         there is a new image. Here we make a copy of the current list and
         reset the original.
         """
-        # Make a copy of the current list of frames.
-        tmp = self.frames.copy()
+        with self.frames_condition:
+            if (len(self.frames) == 0) and (timeout > 0.0):
+                self.frames_condition.wait(timeout)
 
-        # Need to use clear() because if we create a new list the SpinImageEventHandler
-        # will still be working with the old list.
-        #
-        self.frames.clear()
+            # Make a copy of the current list of frames.
+            tmp = self.frames.copy()
+
+            # Need to use clear() because if we create a new list the SpinImageEventHandler
+            # will still be working with the old list.
+            #
+            self.frames.clear()
         
         return [tmp, self.frame_size]
 
@@ -298,10 +297,25 @@ class SpinCamera(object):
         if finalize:
             pySpinFinalize()
             
+    def supportsWait(self):
+        """
+        getFrames() can block waiting for the next image event.
+        """
+        return True
+
     def startAcquisition(self):
         self.image_event_handler.resetNImages()
         self.frame_size = (self.getProperty("Width").getValue(),
                            self.getProperty("Height").getValue())
+
+        # Create a new frame pool if the frame size has changed.
+        frame_bytes = 2 * self.frame_size[0] * self.frame_size[1]
+        if (self.frame_pool is None) or (self.frame_pool.frame_bytes != frame_bytes):
+            self.frame_pool = framePool.FramePool(frame_bytes = frame_bytes,
+                                                  n_buffers = framePool.poolSize(frame_bytes))
+        self.frame_pool.resetStatistics()
+        self.image_event_handler.setFramePool(self.frame_pool)
+
         self.frames.clear()
         self.image_event_handler.setAcquiring(True)
         self.h_camera.BeginAcquisition()
@@ -314,20 +328,24 @@ class SpinCamera(object):
 
 class SpinImageEventHandler(PySpin.ImageEvent):
     """
-    This handles a new image from the camera. It converts it to a SCamData
-    object and adds the object to the cameras list of frames.
+    This handles a new image from the camera. It converts it to a
+    framePool.FramePoolData object and adds the object to the cameras
+    list of frames.
     """
-    def __init__(self, frame_buffer = None, **kwds):
+    def __init__(self, frame_buffer = None, frame_condition = None, **kwds):
         super().__init__(**kwds)
 
         self.acquiring = False
         self.frame_buffer = frame_buffer
+        self.frame_condition = frame_condition
+        self.frame_pool = None
         self.n_images = 0
 
     def getNImages(self):
         return self.n_images
     
     def OnImageEvent(self, image):
+        arrival_time = time.perf_counter()
 
         # Does this happen? It was in the ImageEvents example..
         if image.IsIncomplete():
@@ -362,18 +380,22 @@ class SpinImageEventHandler(PySpin.ImageEvent):
         #
         # 1. Does this make a copy? Or will the numpy array be invalid when
         #    the image is garbage collected? Is the image garbage collected?
-        #    This doesn't matter if we are also right shifting the array.
+        #    This doesn't matter as we are also right shifting the array.
         #
-        np_array = image_converted.GetNDArray().flatten()
+        np_array = image_converted.GetNDArray()
 
         # Spinnaker will return the image in the highest 16 bits. We shift
         # bits to the right under the assumption that we are dealing with a
-        # 12 bit camera.
+        # 12 bit camera. The result goes directly into a frame pool buffer.
         #
-        np_array = numpy.right_shift(np_array, 4)
+        frame_data = self.frame_pool.getFrameData()
+        numpy.right_shift(np_array, 4, out = frame_data.getData().reshape(np_array.shape))
+        frame_data.arrival_time = arrival_time
 
-        # Add to cameras list of images.
-        self.frame_buffer.append(SCamData(np_array = np_array))
+        # Add to cameras list of images and wake up the camera thread.
+        with self.frame_condition:
+            self.frame_buffer.append(frame_data)
+            self.frame_condition.notify()
 
         self.n_images += 1
 
@@ -382,6 +404,9 @@ class SpinImageEventHandler(PySpin.ImageEvent):
 
     def setAcquiring(self, acquiring):
         self.acquiring = acquiring
+
+    def setFramePool(self, frame_pool):
+        self.frame_pool = frame_pool
     
 
 class SpinNode(object):
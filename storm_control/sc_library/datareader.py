@@ -14,13 +14,42 @@ Hazen 07/15
 #        to whatever HALs current filetype is anyway?
 #
 
+import collections
 import numpy
 import os
-from PIL import Image
 import re
+import threading
+import tifffile
+from xml.etree import ElementTree
 
 import storm_control.sc_library.parameters as parameters
 
+# HDF5 is optional.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# This is needed to read files that were compressed with Blosc.
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+def hdf5ToXmlObject(filename):
+    """
+    Creates a StormXMLObject from the parameters that are
+    saved in a HDF5 movie file.
+    """
+    with h5py.File(filename, "r") as h5:
+        if not ("parameters" in h5):
+            raise IOError("No parameters found in " + filename)
+        xml_string = h5["parameters"][()]
+    if isinstance(xml_string, bytes):
+        xml_string = xml_string.decode()
+    return parameters.StormXMLObject(ElementTree.fromstring(xml_string), recurse = True)
+
 
 def infToXmlObject(filename):
     """
@@ -112,16 +141,149 @@ def infToXmlObject(filename):
     return xml
 
 
-def reader(filename):
+class LRUCache(object):
+    """
+    A thread safe least recently used cache. The size of the cache is
+    the sum of sizeof() of the values, by default this is just the
+    number of entries.
+    """
+    def __init__(self, max_size = 100, sizeof = None, **kwds):
+        super().__init__(**kwds)
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.misses = 0
+        self.size = 0
+        if sizeof is None:
+            self.sizeof = lambda x : 1
+        else:
+            self.sizeof = sizeof
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size = 0
+
+    def get(self, key):
+        """
+        Returns None if key is not in the cache.
+        """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+            return None
+
+    def getStatistics(self):
+        with self.lock:
+            return {"entries" : len(self.cache),
+                    "hits" : self.hits,
+                    "max_size" : self.max_size,
+                    "misses" : self.misses,
+                    "size" : self.size}
+
+    def put(self, key, value):
+        value_size = self.sizeof(value)
+        with self.lock:
+            if key in self.cache:
+                self.size -= self.sizeof(self.cache.pop(key))
+            if (value_size > self.max_size):
+                return
+            self.cache[key] = value
+            self.size += value_size
+            while (self.size > self.max_size):
+                [old_key, old_value] = self.cache.popitem(last = False)
+                self.size -= self.sizeof(old_value)
+
+    def resetStatistics(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def setMaxSize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while (self.size > self.max_size):
+                [old_key, old_value] = self.cache.popitem(last = False)
+                self.size -= self.sizeof(old_value)
+
+
+#
+# These are shared by everything in the process that uses this module.
+#
+# The frame cache is limited to 256MB of frames, the parameters
+# cache to 64 parsed XML files.
+#
+frame_cache = LRUCache(max_size = 256 * 1024 * 1024,
+                       sizeof = lambda x : x[0].nbytes)
+parameters_cache = LRUCache(max_size = 64)
+
+
+def cacheKey(filename):
+    """
+    Files that have changed (or been replaced) will have a different key.
+    """
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+def cacheStatistics():
+    return {"frames" : frame_cache.getStatistics(),
+            "parameters" : parameters_cache.getStatistics()}
+
+def loadImage(filename, frame_number = 0):
+    """
+    Returns [frame, film size, film parameters] for a frame of a movie
+    using the frame cache. The frame is a (read-only) copy so it does not
+    depend on the movie file staying open. The film parameters are shared
+    with other users of the cache so they should not be changed.
+    """
+    key = cacheKey(filename) + (frame_number,)
+    cached = frame_cache.get(key)
+    if cached is None:
+        movie = reader(filename, shared_parameters = True)
+        try:
+            frame = numpy.array(movie.loadAFrame(frame_number))
+            frame.flags.writeable = False
+            cached = (frame, movie.filmSize(), movie.filmParameters())
+        finally:
+            movie.closeFilePtr()
+        frame_cache.put(key, cached)
+    return list(cached)
+
+def loadParameters(xml_filename):
+    """
+    Returns the parameters in xml_filename using the parameters cache. As
+    with loadImage() these are shared so they should not be changed.
+    """
+    key = cacheKey(xml_filename)
+    xml = parameters_cache.get(key)
+    if xml is None:
+        xml = parameters.parameters(xml_filename, recurse = True)
+        parameters_cache.put(key, xml)
+    return xml
+
+def reader(filename, shared_parameters = False):
     """
     Returns the appropriate object based on the file type as
     saved in the corresponding XML file.
+
+    The film parameters are a copy of the cached parameters, unless
+    shared_parameters is True, in which case they should not be changed.
     """
     no_ext_name = os.path.splitext(filename)[0]
 
+    # Big TIFs have a two part extension.
+    if no_ext_name.endswith(".big"):
+        no_ext_name = no_ext_name[:-4]
+
     # Look for XML file.
     if os.path.exists(no_ext_name + ".xml"):
-        xml = parameters.parameters(no_ext_name + ".xml", recurse = True)
+        xml = loadParameters(no_ext_name + ".xml")
+        if not shared_parameters:
+            xml = xml.copy()
 
     # If it does not exist, then create the xml object
     # from the .inf file.
@@ -133,23 +295,33 @@ def reader(filename):
     elif os.path.exists(no_ext_name + ".inf"):
         xml = infToXmlObject(no_ext_name + ".inf")
 
+    # HDF5 files can contain their own parameters.
+    elif (os.path.splitext(filename)[1] == ".h5") and (h5py is not None):
+        xml = hdf5ToXmlObject(filename)
+
     else:
         raise IOError("Could not find an associated .xml or .inf file for " + filename)
 
     file_type = xml.get("film.filetype")
 
-    if (file_type == ".dax"):
+    if (file_type == ".dax") or (file_type == ".fast.dax"):
         return DaxReader(filename = filename,
                          xml = xml)
+    elif (file_type == ".h5") and (h5py is not None):
+        return HDF5Reader(filename = filename,
+                          xml = xml)
     elif (file_type == ".spe"):
         return SpeReader(filename = filename,
                          xml = xml)
-    elif (file_type == ".tif"): 
+    elif (file_type == ".stripes"):
+        return StripedDaxReader(filename = filename,
+                                xml = xml)
+    elif (file_type == ".tif") or (file_type == ".big.tif"):
         return TifReader(filename = filename,
                          xml = xml)
     else:
         print(file_type, "is not a recognized file type")
-    raise IOError("only .dax, .spe and .tif are supported (case sensitive..)")
+    raise IOError("only .dax, .h5, .spe, .stripes and .tif are supported (case sensitive..)")
 
 
 class DataReader(object):
@@ -165,6 +337,10 @@ class DataReader(object):
 
      2. loadAFrame(self, frame_number)
         Load the requested frame and return it as numpy array.
+
+    Subclasses can also implement loadFrames() if they can do
+    better than loading the frames one at a time, or if they can
+    return views of the frames when copy is False.
     """
     def __init__(self, filename = None, xml = None, **kwds):
         super().__init__(**kwds)
@@ -189,6 +365,14 @@ class DataReader(object):
     def __del__(self):
         self.closeFilePtr()
 
+    def cameraFrames(self):
+        """
+        Returns the movie as a (frames, pixels) array, with the pixels of
+        each frame in the order that they came from the camera, or None
+        if the movie is not memory mapped.
+        """
+        return None
+
     # Check the requested frame number to be sure it is in range.
     def checkFrameNumber(self, frame_number):
         if (frame_number < 0):
@@ -213,10 +397,33 @@ class DataReader(object):
     def filmSize(self):
         return [self.image_width, self.image_height, self.number_frames]
 
+    def loadFrames(self, start = 0, stop = None, step = 1, copy = True):
+        """
+        Load a range of frames (as for a slice) and return them as a
+        (frames, height, width) numpy array.
+
+        If copy is True (the default) the array is a writable copy of the
+        frames. If copy is False readers that can (DaxReader) return a
+        read-only view of the frames instead, other readers still return
+        a copy.
+        """
+        frames = []
+        for i in range(*slice(start, stop, step).indices(self.number_frames)):
+            frames.append(self.loadAFrame(i))
+        if (len(frames) == 0):
+            return numpy.zeros((0, self.image_height, self.image_width), dtype = numpy.uint16)
+        return numpy.array(frames)
+
 
 class DaxReader(DataReader):
     """
     Dax reader class. This is a Zhuang lab custom format.
+
+    The file is memory mapped. loadAFrame() returns a (native byte
+    order) copy of the frame as before, loadFrames(copy = False) and
+    filmData() return read-only views of the mapped file without copying.
+    For big endian films the bytes are only swapped when the frames
+    are copied.
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
@@ -230,20 +437,85 @@ class DaxReader(DataReader):
         # we need to make sure this is int or this will cause trouble in Python3.
         #
         self.number_frames = int(self.xml.get("acquisition.number_frames"))
-        
-        # open the dax file
-        self.fileptr = open(self.filename, "rb")
+
+        # Map the dax file, this could be shorter than expected if HAL crashed.
+        if self.bigendian:
+            dtype = numpy.dtype(">u2")
+        else:
+            dtype = numpy.dtype("<u2")
+        frame_size = self.image_height * self.image_width
+        mapped_frames = min(self.number_frames, os.path.getsize(self.filename) // (2 * frame_size))
+        if (mapped_frames > 0):
+            movie_data = numpy.memmap(self.filename,
+                                      dtype = dtype,
+                                      mode = "r",
+                                      shape = (mapped_frames, self.image_width, self.image_height))
+        else:
+            movie_data = numpy.zeros((0, self.image_width, self.image_height), dtype = dtype)
+
+        # This is (frames, height, width), with each frame oriented as
+        # in the original version of loadAFrame().
+        self.movie_data = numpy.transpose(movie_data.view(numpy.ndarray), (0, 2, 1))
+
+    def cameraFrames(self):
+        if self.movie_data is None:
+            return None
+        return numpy.transpose(self.movie_data, (0, 2, 1)).reshape(self.movie_data.shape[0], -1)
+
+    def closeFilePtr(self):
+        """
+        The file is unmapped once there are no more references to any of
+        the frames.
+        """
+        self.movie_data = None
+
+    def filmData(self):
+        """
+        Returns the whole movie as a (frames, height, width) array.
+        """
+        return self.movie_data
+
+    # load a frame & return it as a numpy array
+    def loadAFrame(self, frame_number):
+        if self.movie_data is not None:
+            self.checkFrameNumber(frame_number)
+            if (frame_number >= self.movie_data.shape[0]):
+                raise IOError("frame " + str(frame_number) + " is missing from " + self.filename)
+            return self.movie_data[frame_number].astype(numpy.uint16)
+
+    def loadFrames(self, start = 0, stop = None, step = 1, copy = True):
+        """
+        Returns a (native byte order) copy of the requested frames, or a
+        view of them if copy is False.
+        """
+        frames = self.movie_data[start:stop:step]
+        if copy:
+            return frames.astype(numpy.uint16)
+        return frames
+
+
+class HDF5Reader(DataReader):
+    """
+    HDF5 reader class. The file may still be being written by
+    HAL, use refresh() to update the number of frames.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        self.fileptr = h5py.File(self.filename, "r", libver = "latest", swmr = True)
+        self.movie = self.fileptr["movie"]
+        self.refresh()
 
     # load a frame & return it as a numpy array
     def loadAFrame(self, frame_number):
         if self.fileptr:
             self.checkFrameNumber(frame_number)
-            self.fileptr.seek(frame_number * self.image_height * self.image_width * 2)
-            image_data = numpy.fromfile(self.fileptr, dtype=numpy.uint16, count = self.image_height * self.image_width)
-            image_data = numpy.transpose(numpy.reshape(image_data, [self.image_width, self.image_height]))
-            if self.bigendian:
-                image_data.byteswap(True)
-            return image_data
+            image_data = self.movie[frame_number]
+            return numpy.transpose(numpy.reshape(image_data, [self.image_width, self.image_height]))
+
+    def refresh(self):
+        self.movie.refresh()
+        [self.number_frames, self.image_height, self.image_width] = self.movie.shape
 
 
 class SpeReader(DataReader):
@@ -295,31 +567,124 @@ class SpeReader(DataReader):
             return image_data
 
 
+class StripedDaxReader(DataReader):
+    """
+    Reader for films that were saved in blocks of frames spread
+    over several .dax files (stripes). The film file is the manifest
+    that lists the stripes.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+
+        size_re = re.compile(r'frame dimensions = ([\d]+) x ([\d]+)')
+        length_re = re.compile(r'number of frames = ([\d]+)')
+        block_re = re.compile(r'block frames = ([\d]+)')
+        stripe_re = re.compile(r'stripe = (.+)')
+
+        stripe_names = []
+        with open(self.filename) as fp:
+            for line in fp:
+                m = size_re.match(line)
+                if m:
+                    self.image_width = int(m.group(1))
+                    self.image_height = int(m.group(2))
+
+                m = length_re.match(line)
+                if m:
+                    self.number_frames = int(m.group(1))
+
+                m = block_re.match(line)
+                if m:
+                    self.block_frames = int(m.group(1))
+
+                m = stripe_re.match(line)
+                if m:
+                    stripe_names.append(m.group(1).strip())
+
+        # If the stripes have been moved, look for them in the same
+        # directory as the manifest.
+        self.stripes = []
+        for stripe_name in stripe_names:
+            if not os.path.exists(stripe_name):
+                stripe_name = os.path.join(os.path.dirname(self.filename), os.path.basename(stripe_name))
+            self.stripes.append(open(stripe_name, "rb"))
+
+    def closeFilePtr(self):
+        for stripe in getattr(self, "stripes", []):
+            stripe.close()
+
+    def loadAFrame(self, frame_number):
+        self.checkFrameNumber(frame_number)
+        frame_size = self.image_height * self.image_width
+
+        # Figure out which stripe the frame is in, and where.
+        block = frame_number // self.block_frames
+        stripe = self.stripes[block % len(self.stripes)]
+        stripe_frame = (block // len(self.stripes)) * self.block_frames + frame_number % self.block_frames
+
+        stripe.seek(stripe_frame * frame_size * 2)
+        image_data = numpy.fromfile(stripe, dtype=numpy.uint16, count = frame_size)
+        return numpy.transpose(numpy.reshape(image_data, [self.image_width, self.image_height]))
+
+
 class TifReader(DataReader):
     """
-    TIF reader class.
+    TIF reader class, this also handles big TIFs.
+
+    If the frames are stored contiguously, which is the case for films
+    saved by HAL, the file is memory mapped. Otherwise the frames are
+    read using the page (IFD) index that tifffile builds when the file
+    is opened.
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
-                
-        self.fileptr = False
-        self.im = Image.open(filename)
-        self.isize = self.im.size
 
-        # FIXME: Should check that these match the XML file.
-        self.image_width = self.isize[1]
-        self.image_height = self.isize[0]
+        self.fileptr = tifffile.TiffFile(self.filename)
+        self.fileptr.pages.cache = True
+        self.number_frames = len(self.fileptr.pages)
+
+        page = self.fileptr.pages[0]
+        if (len(page.shape) != 2):
+            raise IOError("Not a monochrome tif image " + self.filename)
+        [self.image_height, self.image_width] = page.shape
+
+        # Check that these match the XML file.
+        for [pname, value] in [[".x_pixels", self.image_width], [".y_pixels", self.image_height]]:
+            xml_value = self.xml.get(self.camera + pname, value)
+            if (xml_value != value):
+                raise IOError("Size mismatch, " + self.camera + pname + " is " + str(xml_value) + " in the XML but " + str(value) + " in " + self.filename)
+
+        try:
+            movie_data = tifffile.memmap(self.filename, mode = "r")
+            movie_data = numpy.reshape(movie_data.view(numpy.ndarray), (-1, self.image_height, self.image_width))
+            assert(movie_data.shape[0] == self.number_frames)
+        except (AssertionError, ValueError):
+            movie_data = None
+
+        # This is (frames, width, height), with each frame oriented as
+        # in the original (PIL) version of this class.
+        if movie_data is not None:
+            self.movie_data = numpy.transpose(movie_data, (0, 2, 1))
+        else:
+            self.movie_data = None
+
+    def cameraFrames(self):
+        if self.movie_data is None:
+            return None
+        return numpy.transpose(self.movie_data, (0, 2, 1)).reshape(self.number_frames, -1)
 
-        self.number_frames = self.xml.get("acquisition.number_frames")
+    def closeFilePtr(self):
+        super().closeFilePtr()
+        self.movie_data = None
 
     def loadAFrame(self, frame_number, cast_to_int16 = True):
         self.checkFrameNumber(frame_number)
-        self.im.seek(frame_number)
-        image_data = numpy.array(list(self.im.getdata()))
-        assert len(image_data.shape) == 1, "not a monochrome tif image."
+        if self.movie_data is not None:
+            image_data = self.movie_data[frame_number]
+        else:
+            image_data = numpy.transpose(self.fileptr.pages[frame_number].asarray())
         if cast_to_int16:
             image_data = image_data.astype(numpy.int16)
-        image_data = numpy.transpose(numpy.reshape(image_data, (self.image_width, self.image_height)))
         return image_data
 
 
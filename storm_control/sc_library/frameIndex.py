@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""
+Per-frame index files. These are written by the image writers next
+to the movie file. They consist of a fixed size header followed by
+a fixed size record for each frame that was saved:
+
+ (1) The frame number in the movie file.
+ (2) The frame number from the camera.
+ (3) The (monotonic) host time when the writer received the frame.
+ (4) The stripe that the frame is in (0 except for .stripes films).
+ (5) The offset of the frame in bytes in the file / stripe, or -1
+     for formats where this is decided by the library that writes
+     the file (.h5, .tif).
+
+A frame is only added to the index once it has been written (or at
+least handed off to the OS). For striped films the frames of the
+different stripes may not be in order.
+
+The index is flushed to disk periodically so if HAL crashes it can
+be used to recover the movie meta-data, run this as a script to do
+that.
+"""
+
+import numpy
+import os
+import re
+import struct
+import threading
+import time
+
+import storm_control.sc_library.parameters as params
+
+
+# Magic, version, x_pixels, y_pixels, bytes_per_frame, start time, movie file extension.
+header = struct.Struct("<8sIIIId8s8x")
+magic = b"HALFIDX\0"
+version = 2
+
+record = struct.Struct("<Qqdqq")
+record_dtype = numpy.dtype([("index", "<u8"),
+                            ("frame_number", "<i8"),
+                            ("timestamp", "<f8"),
+                            ("stripe", "<i8"),
+                            ("offset", "<i8")])
+
+
+class FrameIndexException(Exception):
+    pass
+
+
+class FrameIndexWriter(object):
+    """
+    Writes the index file, the records are saved in memory and
+    written to disk every flush_interval seconds. Frames can be
+    added from several threads (the stripes of a striped film).
+    """
+    def __init__(self, filename = None, x_pixels = None, y_pixels = None, extension = None, flush_interval = 1.0, **kwds):
+        super().__init__(**kwds)
+        self.bytes_per_frame = 2 * x_pixels * y_pixels
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.records = bytearray()
+
+        self.fp = open(filename, "wb")
+        self.fp.write(header.pack(magic,
+                                  version,
+                                  x_pixels,
+                                  y_pixels,
+                                  self.bytes_per_frame,
+                                  time.time(),
+                                  extension.encode()))
+        self.fp.flush()
+
+    def addFrame(self, index, frame_number, timestamp, stripe, offset):
+        """
+        index is the frame number in the movie file, stripe and offset
+        are where the writer put the frame.
+        """
+        self.lock.acquire()
+        self.records += record.pack(index,
+                                    frame_number,
+                                    timestamp,
+                                    stripe,
+                                    offset)
+        if ((time.time() - self.last_flush) > self.flush_interval):
+            self.flush()
+        self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        self.flush()
+        self.fp.close()
+        self.lock.release()
+
+    def flush(self):
+        """
+        The caller should have the lock.
+        """
+        self.fp.write(self.records)
+        self.fp.flush()
+        self.records = bytearray()
+        self.last_flush = time.time()
+
+
+def readFrameIndex(filename):
+    """
+    Returns a dictionary with the header information and a numpy
+    array with the records. Partial records (from a crash) are ignored.
+    """
+    with open(filename, "rb") as fp:
+        data = fp.read(header.size)
+        if (len(data) != header.size):
+            raise FrameIndexException(filename + " is not a frame index file.")
+        fields = header.unpack(data)
+        if (fields[0] != magic):
+            raise FrameIndexException(filename + " is not a frame index file.")
+        if (fields[1] != version):
+            raise FrameIndexException("Unknown frame index version " + str(fields[1]))
+
+        n_records = (os.path.getsize(filename) - header.size) // record.size
+        records = numpy.fromfile(fp, dtype = record_dtype, count = n_records)
+
+    info = {"x_pixels" : fields[2],
+            "y_pixels" : fields[3],
+            "bytes_per_frame" : fields[4],
+            "start_time" : fields[5],
+            "extension" : fields[6].rstrip(b"\0").decode()}
+    return [info, records]
+
+
+def committedRecords(records):
+    """
+    Returns the records (in film order) of the frames that were all
+    committed, i.e. up to the first frame that is missing from the
+    index. After a crash these are the frames that can be recovered.
+    """
+    records = numpy.sort(records, order = "index")
+    missing = numpy.nonzero(records["index"] != numpy.arange(records.size))[0]
+    if (missing.size > 0):
+        records = records[:missing[0]]
+    return records
+
+
+def rebuildManifest(filename, number_frames):
+    """
+    Update the number of frames in a .stripes manifest. This is written
+    with 0 frames when the film is started.
+    """
+    with open(filename) as fp:
+        lines = fp.readlines()
+    with open(filename, "w") as fp:
+        for line in lines:
+            if re.match(r'number of frames = ', line):
+                line = "number of frames = " + str(number_frames) + "\n"
+            fp.write(line)
+
+
+def timingStatistics(records):
+    """
+    Returns a dictionary with the inter-frame timing statistics (in seconds).
+    """
+    stats = {"number_frames" : records.size,
+             "frame_rate" : 0.0,
+             "interval_mean" : 0.0,
+             "interval_std" : 0.0,
+             "interval_max" : 0.0,
+             "camera_frames_missing" : 0}
+    if (records.size > 1):
+        intervals = numpy.diff(records["timestamp"])
+        stats["interval_mean"] = float(numpy.mean(intervals))
+        stats["interval_std"] = float(numpy.std(intervals))
+        stats["interval_max"] = float(numpy.max(intervals))
+        if (stats["interval_mean"] > 0.0):
+            stats["frame_rate"] = 1.0/stats["interval_mean"]
+        steps = numpy.diff(records["frame_number"])
+        stats["camera_frames_missing"] = int(numpy.sum(steps[steps > 1] - 1))
+    return stats
+
+
+def recoverFilm(index_filename, overwrite = False, verbose = True):
+    """
+    Re-creates the .inf file (for .dax movies) and a basic .xml file
+    for a movie using its index file. Existing files are not changed
+    unless overwrite is True, except for the number of frames in the
+    manifest of .stripes movies.
+
+    Returns the number of frames that were recovered.
+    """
+    basename = os.path.splitext(index_filename)[0]
+    [info, records] = readFrameIndex(index_filename)
+    movie_filename = basename + info["extension"]
+
+    if not os.path.exists(movie_filename):
+        raise FrameIndexException("Could not find " + movie_filename)
+
+    # Only the frames that are in the index were written. Note that
+    # .fast.dax films may have been pre-allocated to their full length,
+    # so the size of the .dax file does not tell us anything.
+    records = committedRecords(records)
+    number_frames = records.size
+    if (info["extension"] == ".dax"):
+        number_frames = min(number_frames, os.path.getsize(movie_filename) // info["bytes_per_frame"])
+        records = records[:number_frames]
+
+    # .stripes manifest.
+    if (info["extension"] == ".stripes"):
+        rebuildManifest(movie_filename, number_frames)
+
+    if verbose:
+        print("Recovering", number_frames, "frames of", movie_filename)
+
+    # .inf file.
+    if (info["extension"] == ".dax"):
+        if overwrite or not os.path.exists(basename + ".inf"):
+            w = str(info["x_pixels"])
+            h = str(info["y_pixels"])
+            with open(basename + ".inf", "w") as inf_fp:
+                inf_fp.write("binning = 1 x 1\n")
+                inf_fp.write("data type = 16 bit integers (binary, little endian)\n")
+                inf_fp.write("frame dimensions = " + w + " x " + h + "\n")
+                inf_fp.write("number of frames = " + str(number_frames) + "\n")
+                inf_fp.write("x_start = 1\n")
+                inf_fp.write("x_end = " + w + "\n")
+                inf_fp.write("y_start = 1\n")
+                inf_fp.write("y_end = " + h + "\n")
+        elif verbose:
+            print(" ", basename + ".inf", "exists, not changed.")
+
+    # .xml file.
+    if overwrite or not os.path.exists(basename + ".xml"):
+        to_save = params.StormXMLObject()
+
+        acq_p = to_save.addSubSection("acquisition")
+        acq_p.add(params.ParameterString(name = "camera", value = "camera1"))
+        acq_p.add(params.ParameterInt(name = "number_frames", value = number_frames))
+        acq_p.add(params.ParameterSetBoolean(name = "recovered", value = True))
+        acq_p.add(params.ParameterString(name = "start_time",
+                                         value = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["start_time"]))))
+        for [key, value] in timingStatistics(records).items():
+            if (key == "number_frames"):
+                continue
+            elif isinstance(value, int):
+                acq_p.add(params.ParameterInt(name = key, value = value))
+            else:
+                acq_p.add(params.ParameterFloat(name = key, value = value))
+
+        cam_p = to_save.addSubSection("camera1")
+        cam_p.add(params.ParameterInt(name = "x_pixels", value = info["x_pixels"]))
+        cam_p.add(params.ParameterInt(name = "y_pixels", value = info["y_pixels"]))
+        cam_p.add(params.ParameterInt(name = "bytes_per_frame", value = info["bytes_per_frame"]))
+
+        film_p = to_save.addSubSection("film")
+        film_p.add(params.ParameterString(name = "filetype", value = info["extension"]))
+
+        to_save.saveToFile(basename + ".xml")
+    elif verbose:
+        print(" ", basename + ".xml", "exists, not changed.")
+
+    return number_frames
+
+
+if (__name__ == "__main__"):
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Recover movie meta-data from a HAL frame index file.')
+    parser.add_argument('index', type = str, nargs = '+', help = "The name of the index file(s).")
+    parser.add_argument('--overwrite', dest = 'overwrite', action = 'store_true', default = False,
+                        help = "Replace existing .inf and .xml files.")
+    parser.add_argument('--stats', dest = 'stats', action = 'store_true', default = False,
+                        help = "Only print the frame timing statistics.")
+
+    args = parser.parse_args()
+
+    for index_filename in args.index:
+        if args.stats:
+            [info, records] = readFrameIndex(index_filename)
+            print(index_filename)
+            for [key, value] in sorted(timingStatistics(records).items()):
+                print(" ", key, "=", value)
+        else:
+            recoverFilm(index_filename, overwrite = args.overwrite)
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+A pool of pre-allocated frame buffers for the camera interfaces.
+
+The camera interfaces copy (or convert) the data for each new frame
+into one of the buffers in the pool instead of allocating a new numpy
+array for every frame. The buffer is returned to the pool automatically
+once nothing (feeds, image writers, the display, etc.) has a reference
+to the frame data, or any view of it, anymore.
+
+If all the buffers are in use a new (un-pooled) buffer is allocated
+so no frames are lost, but this is counted as a pool exhaustion. If
+this happens a lot the pool should be made larger.
+"""
+
+import ctypes
+import numpy
+import threading
+import weakref
+
+
+def poolSize(frame_bytes, max_bytes = 512 * 1024 * 1024, max_buffers = 1000, min_buffers = 4):
+    """
+    Returns a reasonable number of buffers for a pool, the pool memory
+    is only committed by the OS as the buffers are actually used.
+    """
+    return max(min_buffers, min(int(max_bytes/frame_bytes), max_buffers))
+
+
+class FramePoolData(object):
+    """
+    Storage of a single frame of camera data. This has the same interface
+    as the camera specific classes (HCamData, etc.).
+    """
+    def __init__(self, np_array = None, **kwds):
+        super().__init__(**kwds)
+        self.np_array = np_array
+        self.size = np_array.nbytes
+
+        # The (time.perf_counter()) time when the frame arrived, for
+        # camera interfaces that know this.
+        self.arrival_time = None
+
+    def copyData(self, address):
+        """
+        Uses the C memmove function to copy data from an address in memory
+        into memory allocated for the numpy array of this object.
+        """
+        ctypes.memmove(self.np_array.ctypes.data, address, self.size)
+
+    def getData(self):
+        return self.np_array
+
+    def getDataPtr(self):
+        return self.np_array.ctypes.data
+
+
+class FramePool(object):
+    """
+    A ring of aligned numpy.uint16 buffers, all of them are allocated
+    in a single block of memory.
+    """
+    def __init__(self, frame_bytes = None, n_buffers = None, alignment = 4096, **kwds):
+        super().__init__(**kwds)
+        self.alignment = alignment
+        self.frame_bytes = frame_bytes
+        self.lock = threading.Lock()
+        self.n_buffers = n_buffers
+
+        # Each buffer starts on an alignment boundary.
+        self.stride = alignment * ((frame_bytes + alignment - 1)//alignment)
+        self.raw_data = numpy.empty(n_buffers * self.stride + alignment, dtype = numpy.uint8)
+        offset = (-self.raw_data.ctypes.data) % alignment
+        raw_view = memoryview(self.raw_data)
+        self.buffers = []
+        for i in range(n_buffers):
+            start = offset + i * self.stride
+            self.buffers.append(raw_view[start:start + frame_bytes])
+
+        self.free = list(range(n_buffers - 1, -1, -1))
+        self.resetStatistics()
+
+    def getFrameData(self):
+        """
+        Returns a FramePoolData object for the next frame.
+        """
+        self.lock.acquire()
+        if self.free:
+            index = self.free.pop()
+            self.n_acquired += 1
+            in_use = self.n_buffers - len(self.free)
+            if (in_use > self.max_in_use):
+                self.max_in_use = in_use
+        else:
+            index = None
+            self.n_exhausted += 1
+        self.lock.release()
+
+        if index is None:
+            return FramePoolData(np_array = self.newArray())
+
+        # The numpy array uses a memoryview as its base, so views of the
+        # array will also keep it alive. This means that the buffer will
+        # only be released when the array and all of its views are gone.
+        np_array = numpy.frombuffer(self.buffers[index], dtype = numpy.uint16)
+        weakref.finalize(np_array, self.releaseBuffer, index)
+        return FramePoolData(np_array = np_array)
+
+    def getStatistics(self):
+        self.lock.acquire()
+        stats = {"buffers" : self.n_buffers,
+                 "acquired" : self.n_acquired,
+                 "exhausted" : self.n_exhausted,
+                 "in_use" : self.n_buffers - len(self.free),
+                 "max_in_use" : self.max_in_use}
+        self.lock.release()
+        return stats
+
+    def newArray(self):
+        """
+        An aligned array that is not part of the pool.
+        """
+        raw = numpy.empty(self.frame_bytes + self.alignment, dtype = numpy.uint8)
+        offset = (-raw.ctypes.data) % self.alignment
+        return raw[offset:offset + self.frame_bytes].view(numpy.uint16)
+
+    def releaseBuffer(self, index):
+        self.lock.acquire()
+        self.free.append(index)
+        self.lock.release()
+
+    def resetStatistics(self):
+        self.n_acquired = 0
+        self.n_exhausted = 0
+        self.max_in_use = 0
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""
+Shared memory ring buffers of camera frames. HAL publishes the frames
+from a camera / feed in one of these (see hal4000.framePublisher) and
+analysis programs running in other processes read them with the
+FrameRingReader class.
+
+The shared memory block consists of:
+
+ (1) A header with the magic string, the version, the number of slots,
+     the slot size in bytes and the sequence number of the last frame
+     that was written (or -1 if the publisher has closed the ring).
+
+ (2) A table with one row per slot, the frame sequence number, camera
+     frame number, x pixels, y pixels and number of bytes.
+
+ (3) The (time.perf_counter()) acquisition time of each frame.
+
+ (4) The frame data, each slot starts on a 4096 byte boundary.
+
+Frame sequence numbers start at 1 and increase by one for each frame
+that is published. The publisher sets the slot sequence number to 0
+while it is writing a frame, so a reader can tell if the frame data
+it is using (without copying) has been over-written by checking that
+the slot sequence number has not changed (FrameRingReader.isValid()).
+
+HAL re-creates the rings when the parameters change, as the frame
+size may have changed. When this happens FrameRingReader.getFrame()
+raises a SharedFramesException and the reader should be re-created.
+
+Example:
+
+  reader = sharedFrames.FrameRingReader("hal_camera1")
+  while True:
+      aframe = reader.getFrame(timeout = 1.0)
+      if aframe is not None:
+          result = analyze(aframe.getData())
+          if reader.isValid(aframe):
+              ...
+"""
+
+import numpy
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+
+
+magic = 0x534d52494e473031 # "SMRING01"
+version = 1
+
+# Header fields.
+h_magic = 0
+h_version = 1
+h_slots = 2
+h_slot_bytes = 3
+h_sequence = 4
+header_size = 8
+
+# Slot table fields.
+s_sequence = 0
+s_frame_number = 1
+s_x_pixels = 2
+s_y_pixels = 3
+s_bytes = 4
+slot_size = 8
+
+alignment = 4096
+
+
+class SharedFramesException(Exception):
+    pass
+
+
+def layout(n_slots, slot_bytes):
+    """
+    Returns [table offset, times offset, data offset, data stride, total size].
+    """
+    table_offset = 8 * header_size
+    times_offset = table_offset + 8 * slot_size * n_slots
+    data_offset = alignment * ((times_offset + 8 * n_slots + alignment - 1)//alignment)
+    stride = alignment * ((slot_bytes + alignment - 1)//alignment)
+    return [table_offset, times_offset, data_offset, stride, data_offset + n_slots * stride]
+
+
+class SharedFrame(object):
+    """
+    A frame in a shared memory ring. By default the data is a view
+    of the shared memory, so it is only valid until the publisher
+    re-uses the slot.
+    """
+    def __init__(self, np_data = None, frame_number = None, acquisition_time = None, sequence = None, slot = None, x_pixels = None, y_pixels = None, **kwds):
+        super().__init__(**kwds)
+        self.acquisition_time = acquisition_time
+        self.frame_number = frame_number
+        self.np_data = np_data
+        self.sequence = sequence
+        self.slot = slot
+        self.x_pixels = x_pixels
+        self.y_pixels = y_pixels
+
+    def getData(self):
+        """
+        Returns the frame as a 2D numpy.uint16 array.
+        """
+        return self.np_data
+
+
+class FrameRing(object):
+    """
+    Numpy views of the different parts of a shared memory ring.
+    """
+    def __init__(self, shm = None, n_slots = None, slot_bytes = None, **kwds):
+        super().__init__(**kwds)
+        self.n_slots = n_slots
+        self.shm = shm
+        self.slot_bytes = slot_bytes
+
+        [table_offset, times_offset, data_offset, stride, size] = layout(n_slots, slot_bytes)
+        self.header = numpy.ndarray((header_size,), dtype = numpy.int64, buffer = shm.buf)
+        self.table = numpy.ndarray((n_slots, slot_size), dtype = numpy.int64, buffer = shm.buf, offset = table_offset)
+        self.times = numpy.ndarray((n_slots,), dtype = numpy.float64, buffer = shm.buf, offset = times_offset)
+        self.data = numpy.ndarray((n_slots, stride//2), dtype = numpy.uint16, buffer = shm.buf, offset = data_offset)
+
+    def close(self):
+        # The numpy views have to go before the shared memory can be closed.
+        self.header = None
+        self.table = None
+        self.times = None
+        self.data = None
+        try:
+            self.shm.close()
+
+        # Some frames (views of the shared memory) still exist, the memory
+        # will be unmapped once they are garbage collected.
+        except BufferError:
+            pass
+
+    def getName(self):
+        return self.shm.name
+
+
+class FrameRingWriter(FrameRing):
+    """
+    Publishes frames, there should only be one of these per ring.
+    """
+    def __init__(self, name = None, n_slots = 64, slot_bytes = None, **kwds):
+        size = layout(n_slots, slot_bytes)[4]
+        try:
+            shm = shared_memory.SharedMemory(name = name, create = True, size = size)
+        except FileExistsError:
+
+            # Left over from a publisher that crashed?
+            old = shared_memory.SharedMemory(name = name)
+            old.close()
+            old.unlink()
+            shm = shared_memory.SharedMemory(name = name, create = True, size = size)
+        kwds["shm"] = shm
+        kwds["n_slots"] = n_slots
+        kwds["slot_bytes"] = slot_bytes
+        super().__init__(**kwds)
+
+        self.sequence = 0
+        self.header[:] = 0
+        self.header[h_slots] = n_slots
+        self.header[h_slot_bytes] = slot_bytes
+        self.header[h_version] = version
+        self.header[h_magic] = magic
+
+    def addFrame(self, np_data, frame_number, x_pixels, y_pixels, acquisition_time = None):
+        """
+        np_data is a numpy.uint16 array with x_pixels * y_pixels elements,
+        this can also be a strided (y_pixels, x_pixels) view.
+        """
+        if (np_data.nbytes > self.slot_bytes):
+            raise SharedFramesException("Frame is larger than the ring slot size, " + str(np_data.nbytes) + " > " + str(self.slot_bytes))
+
+        self.sequence += 1
+        slot = self.sequence % self.n_slots
+        row = self.table[slot]
+
+        # Invalidate the slot while we are writing to it.
+        row[s_sequence] = 0
+        self.data[slot, :np_data.size].reshape(np_data.shape)[...] = np_data
+        row[s_frame_number] = frame_number
+        row[s_x_pixels] = x_pixels
+        row[s_y_pixels] = y_pixels
+        row[s_bytes] = np_data.nbytes
+        if acquisition_time is None:
+            acquisition_time = time.perf_counter()
+        self.times[slot] = acquisition_time
+        row[s_sequence] = self.sequence
+
+        self.header[h_sequence] = self.sequence
+
+    def close(self):
+        """
+        Tell the readers that we are done, then remove the ring.
+        """
+        self.header[h_sequence] = -1
+        super().close()
+        self.shm.unlink()
+
+
+class FrameRingReader(FrameRing):
+    """
+    Reads frames from a ring, there can be any number of these per ring.
+
+    If the reader falls so far behind that the frames it has not read
+    yet have been over-written, these frames are counted as missed and
+    the reader skips ahead to the oldest frame that is still available.
+    """
+    def __init__(self, name = None, from_start = False, poll_interval = 5.0e-4, **kwds):
+        """
+        If from_start is True the reader starts with the oldest frame that
+        is still in the ring, otherwise it only gets frames that are
+        published after it was created.
+        """
+        shm = attach(name)
+        header = numpy.ndarray((header_size,), dtype = numpy.int64, buffer = shm.buf)
+        if (header[h_magic] != magic) or (header[h_version] != version):
+            del header
+            shm.close()
+            raise SharedFramesException(name + " is not a (compatible) frame ring.")
+        kwds["shm"] = shm
+        kwds["n_slots"] = int(header[h_slots])
+        kwds["slot_bytes"] = int(header[h_slot_bytes])
+        del header
+        super().__init__(**kwds)
+
+        self.missed = 0
+        self.poll_interval = poll_interval
+        self.next_sequence = int(self.header[h_sequence]) + 1
+        if from_start:
+            self.next_sequence = max(1, self.next_sequence - self.n_slots + 1)
+
+    def getFrame(self, timeout = None, copy = False):
+        """
+        Returns the next frame, or None if there was no new frame within
+        timeout seconds (if timeout is None this will wait forever). If
+        copy is False the frame data is a view of the shared memory.
+        """
+        start_time = time.perf_counter()
+        while True:
+            aframe = self.nextFrame(copy)
+            if aframe is not None:
+                return aframe
+            if self.isClosed():
+                raise SharedFramesException("The publisher closed " + self.getName())
+            if (timeout is not None) and ((time.perf_counter() - start_time) > timeout):
+                return None
+            time.sleep(self.poll_interval)
+
+    def getFrames(self, copy = False):
+        """
+        Returns all of the available frames without waiting.
+        """
+        frames = []
+        aframe = self.nextFrame(copy)
+        while aframe is not None:
+            frames.append(aframe)
+            aframe = self.nextFrame(copy)
+        return frames
+
+    def getMissed(self):
+        return self.missed
+
+    def isClosed(self):
+        return (self.header[h_sequence] < 0)
+
+    def isValid(self, aframe):
+        """
+        Returns True if the frame has not been over-written (yet).
+        """
+        return (self.table[aframe.slot, s_sequence] == aframe.sequence)
+
+    def nextFrame(self, copy):
+        latest = int(self.header[h_sequence])
+        if (latest < self.next_sequence):
+            return None
+
+        # Skip frames that have already been over-written.
+        oldest = latest - self.n_slots + 1
+        if (self.next_sequence < oldest):
+            self.missed += oldest - self.next_sequence
+            self.next_sequence = oldest
+
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        slot = sequence % self.n_slots
+        row = self.table[slot]
+        [frame_number, x_pixels, y_pixels] = [int(row[s_frame_number]), int(row[s_x_pixels]), int(row[s_y_pixels])]
+        acquisition_time = float(self.times[slot])
+        np_data = self.data[slot, :x_pixels * y_pixels].reshape(y_pixels, x_pixels)
+        if copy:
+            np_data = np_data.copy()
+
+        # Check that the publisher did not start re-writing this slot while
+        # we were reading it's meta-data (or copying it's data).
+        if (row[s_sequence] != sequence):
+            self.missed += 1
+            return self.nextFrame(copy)
+
+        return SharedFrame(np_data = np_data,
+                           frame_number = frame_number,
+                           acquisition_time = acquisition_time,
+                           sequence = sequence,
+                           slot = slot,
+                           x_pixels = x_pixels,
+                           y_pixels = y_pixels)
+
+
+def attach(name):
+    """
+    Attach to an existing shared memory block without registering it with
+    the multiprocessing resource tracker, which would otherwise remove it
+    when the reader process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+
+    # Python < 3.13 doesn't have the track argument.
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype : None
+        try:
+            return shared_memory.SharedMemory(name = name)
+        finally:
+            resource_tracker.register = register
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
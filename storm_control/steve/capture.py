@@ -406,9 +406,7 @@ class Capture(QtCore.QObject):
         tries = 0
         while (not success) and (tries < 4):
             try:
-                movie = datareader.reader(filename)
-                frame = movie.loadAFrame(frame_num)
-                movie.closeFilePtr()
+                [frame, film_size, xml] = datareader.loadImage(filename, frame_num)
                 success = True
 
             except IOError:
@@ -423,7 +421,7 @@ class Capture(QtCore.QObject):
             # Check if the movie contains all the XML or if the XML is
             # just faked, for example by generating it from a .inf file.
             #
-            if movie.xml.get("faked_xml", False):
+            if xml.get("faked_xml", False):
                 
                 # Prompt user for settings for the first film.
                 if not self.fake_got_settings:
@@ -434,12 +432,14 @@ class Capture(QtCore.QObject):
 
                 obj_name = "obj" + str(self.fake_objective)
                 settings = mosaicDialog.getMosaicSettings()
-                
-                movie.xml.set("mosaic." + obj_name, ",".join(map(str, settings[4:])))
-                movie.xml.set("mosaic.objective", obj_name)
-                movie.xml.set("mosaic.flip_horizontal", settings[0])
-                movie.xml.set("mosaic.flip_vertical", settings[1])
-                movie.xml.set("mosaic.transpose", settings[2])
+
+                # The cached version of the parameters should not be changed.
+                xml = xml.copy()
+                xml.set("mosaic." + obj_name, ",".join(map(str, settings[4:])))
+                xml.set("mosaic.objective", obj_name)
+                xml.set("mosaic.flip_horizontal", settings[0])
+                xml.set("mosaic.flip_vertical", settings[1])
+                xml.set("mosaic.transpose", settings[2])
 
             else:
                 
@@ -449,20 +449,20 @@ class Capture(QtCore.QObject):
                 #
                 if not self.got_settings:
                     i = 1
-                    while movie.xml.has("mosaic.obj" + str(i)):
-                        obj_data = movie.xml.get("mosaic.obj" + str(i))
+                    while xml.has("mosaic.obj" + str(i)):
+                        obj_data = xml.get("mosaic.obj" + str(i))
                         self.newObjectiveData.emit(obj_data.split(","))
                         i += 1
                         
-            if movie.xml.get("mosaic.flip_horizontal", False):
+            if xml.get("mosaic.flip_horizontal", False):
                 frame = numpy.fliplr(frame)
-            if movie.xml.get("mosaic.flip_vertical", False):
+            if xml.get("mosaic.flip_vertical", False):
                 frame = numpy.flipud(frame)
-            if movie.xml.get("mosaic.transpose", False):
+            if xml.get("mosaic.transpose", False):
                 frame = numpy.transpose(frame)
             image = Image(frame,
-                          movie.filmSize(),
-                          movie.filmParameters())
+                          film_size,
+                          xml)
 
             self.captureComplete.emit(image)
 
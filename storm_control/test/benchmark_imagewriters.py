@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+Hand run throughput benchmark for the image writers. This does not
+need a camera or HAL, the writers are driven directly with synthetic
+frames at a fixed rate (or as fast as possible).
+
+For each file type and frame size this reports the achieved write
+rate in MB/s, the per-frame latency (the time that the camera thread
+would be blocked for) percentiles, the CPU time and the peak RSS. The
+results can also be saved as JSON for comparison between releases.
+
+Example:
+
+$ python benchmark_imagewriters.py --directory /dev/shm --sizes 2048x2048 --frames 500 --report bench.json
+"""
+
+import datetime
+import json
+import numpy
+import os
+import platform
+import resource
+import sys
+import time
+
+import storm_control.sc_library.hgit as hgit
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.film.filmSettings as filmSettings
+import storm_control.hal4000.halLib.imagewriters as imagewriters
+
+
+def makeCameraFunctionality(x_pixels, y_pixels):
+    p = params.StormXMLObject()
+    p.add(params.ParameterInt(name = "bytes_per_frame", value = 2 * x_pixels * y_pixels))
+    p.add(params.ParameterString(name = "extension", value = ""))
+    p.add(params.ParameterInt(name = "x_pixels", value = x_pixels))
+    p.add(params.ParameterInt(name = "y_pixels", value = y_pixels))
+    return cameraFunctionality.CameraFunctionality(camera_name = "camera1",
+                                                   parameters = p)
+
+def makeFrames(x_pixels, y_pixels, n_frames = 8):
+    """
+    A small pool of (noisy) frames, these are re-used so that making
+    them is not part of the benchmark.
+    """
+    rng = numpy.random.RandomState(0)
+    frames = []
+    for i in range(n_frames):
+        np_data = rng.poisson(100.0, size = x_pixels * y_pixels).astype(numpy.uint16)
+        frames.append(frame.Frame(np_data, i, x_pixels, y_pixels, "camera1"))
+    return frames
+
+def peakRSS():
+    """
+    Return the peak resident set size in MB.
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return float(line.split()[1])/1024.0
+    except IOError:
+        pass
+    # This is KB on Linux, and can't be reset.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def resetPeakRSS():
+    """
+    Linux only, the peak RSS is otherwise the peak for the whole benchmark.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except IOError:
+        pass
+
+def removeFiles(basename):
+    directory = os.path.dirname(basename)
+    name = os.path.basename(basename)
+    for fname in os.listdir(directory):
+        if fname.startswith(name):
+            os.remove(os.path.join(directory, fname))
+
+def runBenchmark(directory = None,
+                 filetype = ".dax",
+                 frame_rate = 0.0,
+                 keep = False,
+                 n_frames = 100,
+                 x_pixels = 512,
+                 y_pixels = 512,
+                 **writer_settings):
+    """
+    Benchmark a single file type and frame size. writer_settings are
+    passed to FilmSettings, i.e. writer_async, writer_queue_depth, etc.
+
+    Returns a dictionary with the results.
+    """
+    basename = os.path.join(directory, "benchmark_" + filetype.replace(".", "_").strip("_") + "_" + str(x_pixels) + "x" + str(y_pixels))
+    removeFiles(basename)
+
+    cam_fn = makeCameraFunctionality(x_pixels, y_pixels)
+    frames = makeFrames(x_pixels, y_pixels)
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = filetype,
+                                              film_length = n_frames,
+                                              **writer_settings)
+
+    resetPeakRSS()
+    cpu_start = time.process_time()
+    time_start = time.perf_counter()
+
+    writer = imagewriters.createFileWriter(cam_fn, film_settings)
+    latencies = numpy.zeros(n_frames)
+    for i in range(n_frames):
+
+        # Wait until it is time for the next frame.
+        if (frame_rate > 0.0):
+            delay = time_start + i/frame_rate - time.perf_counter()
+            if (delay > 0.0):
+                time.sleep(delay)
+
+        aframe = frame.Frame(frames[i % len(frames)].getData(), i, x_pixels, y_pixels, "camera1")
+        t1 = time.perf_counter()
+        cam_fn.emitNewFrames([aframe])
+        latencies[i] = time.perf_counter() - t1
+
+    time_last_frame = time.perf_counter()
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+    time_stop = time.perf_counter()
+    cpu_time = time.process_time() - cpu_start
+
+    acq_p = {}
+    for p in writer.getAcquisitionParameters():
+        acq_p[p.getName().replace("camera1_", "")] = p.getv()
+
+    if not keep:
+        removeFiles(basename)
+
+    total_mb = n_frames * 2 * x_pixels * y_pixels/(1024.0 * 1024.0)
+    elapsed = time_stop - time_start
+    latencies = 1000.0 * latencies
+    return {"filetype" : filetype,
+            "x_pixels" : x_pixels,
+            "y_pixels" : y_pixels,
+            "frames" : n_frames,
+            "frames_saved" : writer.number_frames,
+            "frames_dropped" : acq_p.get("dropped_frames", 0),
+            "requested_frame_rate" : frame_rate,
+            "achieved_frame_rate" : n_frames/(time_last_frame - time_start),
+            "data_mb" : total_mb,
+            "elapsed_s" : elapsed,
+            "close_s" : time_stop - time_last_frame,
+            "throughput_mb_s" : total_mb/elapsed,
+            "latency_ms" : {"mean" : float(numpy.mean(latencies)),
+                            "p50" : float(numpy.percentile(latencies, 50)),
+                            "p90" : float(numpy.percentile(latencies, 90)),
+                            "p99" : float(numpy.percentile(latencies, 99)),
+                            "max" : float(numpy.max(latencies))},
+            "max_queue_depth" : acq_p.get("max_queue_depth", 0),
+            "cpu_s" : cpu_time,
+            "peak_rss_mb" : peakRSS(),
+            "writer_settings" : writer_settings}
+
+def systemInfo():
+    info = {"date" : str(datetime.datetime.now()),
+            "machine" : platform.machine(),
+            "numpy" : numpy.__version__,
+            "platform" : platform.platform(),
+            "processor" : platform.processor(),
+            "python" : platform.python_version(),
+            "version" : hgit.getVersion()}
+    try:
+        import tifffile
+        info["tifffile"] = tifffile.__version__
+    except (ImportError, AttributeError):
+        pass
+    return info
+
+
+if (__name__ == "__main__"):
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description = 'Image writer throughput benchmark.')
+    parser.add_argument('--directory', dest = 'directory', type = str, required = False, default = None,
+                        help = "Where to write the test films, the default is the system temporary directory.")
+    parser.add_argument('--filetypes', dest = 'filetypes', type = str, required = False, default = None,
+                        help = "Comma separated list of file types, the default is all of them.")
+    parser.add_argument('--sizes', dest = 'sizes', type = str, required = False, default = "512x512,2048x2048",
+                        help = "Comma separated list of frame sizes, i.e. '512x512,2048x2048'.")
+    parser.add_argument('--frames', dest = 'frames', type = int, required = False, default = 200,
+                        help = "The number of frames in each film.")
+    parser.add_argument('--rate', dest = 'rate', type = float, required = False, default = 0.0,
+                        help = "Frames per second, the default (0) is as fast as possible.")
+    parser.add_argument('--async', dest = 'writer_async', action = 'store_true', default = False,
+                        help = "Write the frames in a separate thread.")
+    parser.add_argument('--overflow', dest = 'overflow', type = str, required = False, default = "block",
+                        help = "Thread buffer overflow policy, 'block' or 'drop'.")
+    parser.add_argument('--queue-depth', dest = 'queue_depth', type = int, required = False, default = 200,
+                        help = "Thread buffer size in frames.")
+    parser.add_argument('--batch-size', dest = 'batch_size', type = int, required = False, default = 16,
+                        help = "Batch size in MB for the writers that batch.")
+    parser.add_argument('--direct-io', dest = 'direct_io', action = 'store_true', default = False,
+                        help = "Bypass the OS file cache (if supported).")
+    parser.add_argument('--keep', dest = 'keep', action = 'store_true', default = False,
+                        help = "Don't delete the test films.")
+    parser.add_argument('--report', dest = 'report', type = str, required = False, default = None,
+                        help = "Save the results in this (JSON) file.")
+
+    args = parser.parse_args()
+
+    if args.directory is None:
+        args.directory = tempfile.gettempdir()
+
+    if args.filetypes is None:
+        filetypes = imagewriters.availableFileFormats(False)
+    else:
+        filetypes = args.filetypes.split(",")
+
+    sizes = []
+    for size in args.sizes.split(","):
+        [x, y] = size.lower().split("x")
+        sizes.append([int(x), int(y)])
+
+    writer_settings = {"writer_async" : args.writer_async,
+                       "writer_batch_size" : args.batch_size,
+                       "writer_direct_io" : args.direct_io,
+                       "writer_overflow" : args.overflow,
+                       "writer_queue_depth" : args.queue_depth}
+
+    results = []
+    print("{0:>10s} {1:>11s} {2:>9s} {3:>8s} {4:>8s} {5:>8s} {6:>8s} {7:>7s} {8:>8s}".format("type", "size", "MB/s", "p50 ms", "p99 ms", "max ms", "CPU s", "dropped", "RSS MB"))
+    for filetype in filetypes:
+        for [x_pixels, y_pixels] in sizes:
+            result = runBenchmark(directory = args.directory,
+                                  filetype = filetype,
+                                  frame_rate = args.rate,
+                                  keep = args.keep,
+                                  n_frames = args.frames,
+                                  x_pixels = x_pixels,
+                                  y_pixels = y_pixels,
+                                  **writer_settings)
+            results.append(result)
+            print("{0:>10s} {1:>11s} {2:9.1f} {3:8.3f} {4:8.3f} {5:8.3f} {6:8.2f} {7:7d} {8:8.1f}".format(filetype,
+                                                                                                      str(x_pixels) + "x" + str(y_pixels),
+                                                                                                      result["throughput_mb_s"],
+                                                                                                      result["latency_ms"]["p50"],
+                                                                                                      result["latency_ms"]["p99"],
+                                                                                                      result["latency_ms"]["max"],
+                                                                                                      result["cpu_s"],
+                                                                                                      result["frames_dropped"],
+                                                                                                      result["peak_rss_mb"]))
+            sys.stdout.flush()
+
+    if args.report is not None:
+        with open(args.report, "w") as fp:
+            json.dump({"system" : systemInfo(),
+                       "directory" : os.path.abspath(args.directory),
+                       "results" : results},
+                      fp,
+                      indent = 2)
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Hand run benchmark for the display image rescaling, this compares the
+original numpy version, the lookup table version and (if it is
+available) the C library version.
+
+For each version and orientation this reports the median and the
+minimum time per frame in milliseconds.
+
+Example:
+
+$ python benchmark_rescale.py --size 2048x2048 --repeats 50
+"""
+
+import numpy
+import time
+
+import storm_control.hal4000.halLib.c_image_manipulation_c as c_image
+
+
+def timeIt(fn, repeats):
+    """
+    Returns [median, minimum] time per call in milliseconds.
+    """
+    times = []
+    for i in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        times.append(1.0e+3 * (time.perf_counter() - start_time))
+    return [numpy.median(times), numpy.min(times)]
+
+
+def runBenchmark(x_pixels = 2048, y_pixels = 2048, repeats = 20, saturated_value = 60000):
+    rng = numpy.random.RandomState(0)
+    image = rng.poisson(1000.0, size = (y_pixels, x_pixels)).astype(numpy.uint16)
+    display_range = [900, 1200]
+
+    lut_rescaler = c_image.ImageRescaler(use_numpy = True)
+    versions = [["float", lambda ori : c_image.rescaleImageFloat(image, *ori, display_range, saturated_value)],
+                ["lut", lambda ori : lut_rescaler.rescaleImage(image, *ori, display_range, saturated_value)]]
+    if c_image.image_manip is not None:
+        c_rescaler = c_image.ImageRescaler()
+        versions.append(["C", lambda ori : c_rescaler.rescaleImage(image, *ori, display_range, saturated_value)])
+
+    results = []
+    for ori in [[False, False, False], [True, False, False], [False, False, True], [True, True, True]]:
+        for [name, fn] in versions:
+
+            # Warm up, this also makes the lookup table / output buffer.
+            fn(ori)
+            [median, minimum] = timeIt(lambda : fn(ori), repeats)
+            results.append({"version" : name,
+                            "orientation" : "".join(["1" if op else "0" for op in ori]),
+                            "median_ms" : median,
+                            "min_ms" : minimum})
+    return results
+
+
+if (__name__ == "__main__"):
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Display image rescaling benchmark.')
+    parser.add_argument('--size', dest = 'size', type = str, required = False, default = "2048x2048",
+                        help = "The image size, i.e. '2048x2048'.")
+    parser.add_argument('--repeats', dest = 'repeats', type = int, required = False, default = 20,
+                        help = "The number of times to rescale the image.")
+
+    args = parser.parse_args()
+
+    [x, y] = args.size.lower().split("x")
+
+    print("{0:>8s} {1:>12s} {2:>10s} {3:>10s}".format("version", "orientation", "median ms", "min ms"))
+    for result in runBenchmark(x_pixels = int(x), y_pixels = int(y), repeats = args.repeats):
+        print("{0:>8s} {1:>12s} {2:10.2f} {3:10.2f}".format(result["version"],
+                                                            result["orientation"],
+                                                            result["median_ms"],
+                                                            result["min_ms"]))
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
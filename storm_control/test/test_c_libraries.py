@@ -29,8 +29,8 @@ def testCImageManipulation():
 
             # Convert to integer so that we don't have overflow issues when we
             # compare for differences between the two images.
-            c_nim = c_nim.astype(numpy.int)
-            py_nim = py_nim.astype(numpy.int)
+            c_nim = c_nim.astype(int)
+            py_nim = py_nim.astype(int)
 
             assert(c_image_min == py_image_min)
             assert(c_image_max == py_image_max)
@@ -38,6 +38,36 @@ def testCImageManipulation():
 
 
 
+def testCImageManipulationLUT():
+    import storm_control.hal4000.halLib.c_image_manipulation_c as cIM
+
+    nim = numpy.random.randint(65536, size = (48,64)).astype(numpy.uint16)
+
+    rescaler = cIM.ImageRescaler(use_numpy = True)
+    for ori in [[False, False, False], [True, False, True], [False, True, True], [True, True, False]]:
+        [flip_h, flip_v, transpose] = ori
+
+        for [display_range, max_v] in [[[0, 100], None], [[1000, 40000], 30000], [[200, 201], 65535]]:
+            [f_nim, f_image_min, f_image_max] = cIM.rescaleImageFloat(nim, flip_h, flip_v, transpose, [0, 100], max_v)
+            [l_nim, l_image_min, l_image_max] = rescaler.rescaleImage(nim, flip_h, flip_v, transpose, [0, 100], max_v)
+
+            assert(l_nim.flags["C_CONTIGUOUS"])
+            assert(l_image_min == f_image_min)
+            assert(l_image_max == f_image_max)
+            assert(numpy.allclose(l_nim.astype(int), f_nim.astype(int), atol = 1.1))
+
+            # The lookup table should give exactly the same result as the C library.
+            if cIM.image_manip is not None:
+                [c_nim, c_image_min, c_image_max] = cIM.rescaleImage(nim, flip_h, flip_v, transpose, display_range, max_v)
+                [l_nim, l_image_min, l_image_max] = rescaler.rescaleImage(nim, flip_h, flip_v, transpose, display_range, max_v)
+                assert(numpy.array_equal(c_nim, l_nim))
+
+    # The rescaled image buffer is re-used.
+    [im1, image_min, image_max] = rescaler.rescaleImage(nim, False, False, False, [0, 100], None)
+    [im2, image_min, image_max] = rescaler.rescaleImage(nim, True, False, False, [0, 100], None)
+    assert(im1 is im2)
+
+
 def testFocusQuality():
     import storm_control.hal4000.camera.frame as frame
     import storm_control.hal4000.focusLock.focusQuality as fq
@@ -88,6 +118,7 @@ def testLMMoment():
 
 if (__name__ == "__main__"):
     testCImageManipulation()
+    testCImageManipulationLUT()
     testFocusQuality()
     testLMMoment()
     
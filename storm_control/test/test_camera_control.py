@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Tests of the hardware camera control acquisition loop, using
+a fake camera interface.
+"""
+import numpy
+import time
+
+import storm_control.sc_library.framePool as framePool
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraControl as cameraControl
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+
+
+class FakeCamera(object):
+    """
+    Returns one frame for each call to getFrames().
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.frame_pool = framePool.FramePool(frame_bytes = 16 * 8 * 2, n_buffers = 4)
+        self.timeouts = []
+
+    def getFrames(self, **kwds):
+        self.timeouts.append(kwds.get("timeout"))
+        frame_data = self.frame_pool.getFrameData()
+        frame_data.getData()[:] = len(self.timeouts)
+        return [[frame_data], [16, 8]]
+
+    def startAcquisition(self):
+        pass
+
+    def stopAcquisition(self):
+        pass
+
+
+class FakeWaitCamera(FakeCamera):
+
+    def supportsWait(self):
+        return True
+
+
+def runCamera(camera, config):
+    control = cameraControl.HWCameraControl(camera_name = "camera1",
+                                            config = config)
+    control.camera = camera
+    control.camera_functionality = cameraFunctionality.CameraFunctionality(camera_name = "camera1",
+                                                                           parameters = control.parameters)
+    frames = []
+    control.camera_functionality.newFrame.connect(frames.append)
+
+    control.film_length = 10
+    control.run()
+    control.handleFinished()
+    return [control, frames]
+
+
+def test_camera_control_1():
+    """
+    Cameras that support it block in getFrames() instead of polling.
+    """
+    config = params.StormXMLObject()
+    camera = FakeWaitCamera()
+
+    start_time = time.perf_counter()
+    [control, frames] = runCamera(camera, config)
+
+    # No 5ms sleeps between frames.
+    assert((time.perf_counter() - start_time) < 0.04)
+    assert(camera.timeouts == [0.1] * 10)
+    assert(len(frames) == 10)
+    assert(numpy.all(frames[-1].getData() == 10))
+    assert(frames[0].acquisition_time is not None)
+
+    stats = control.getLatencyStatistics()
+    assert(stats["wait"])
+    assert(stats["frames"] == 10)
+    assert(stats["max"] >= stats["mean"])
+    assert(control.parameters.get("frame_latency_max") == stats["max"])
+    assert(control.parameters.get("frame_pool_exhausted") == 6)
+
+
+def test_camera_control_2():
+    """
+    Polling fallback, either because the camera does not support
+    waiting or because this was disabled in the configuration.
+    """
+    for [camera, frame_wait] in [[FakeCamera(), True], [FakeWaitCamera(), False]]:
+        config = params.StormXMLObject()
+        config.add(params.ParameterSetBoolean(name = "frame_wait", value = frame_wait))
+
+        start_time = time.perf_counter()
+        [control, frames] = runCamera(camera, config)
+        assert((time.perf_counter() - start_time) > 0.04)
+        assert(camera.timeouts == [None] * 10)
+        assert(len(frames) == 10)
+        assert(not control.getLatencyStatistics()["wait"])
+
+
+if (__name__ == "__main__"):
+    test_camera_control_1()
+    test_camera_control_2()
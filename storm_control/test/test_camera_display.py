@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Tests of the camera display rendering.
+"""
+import numpy
+import sys
+
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.qtWidgets.qtCameraGraphicsScene as qtCameraGraphicsScene
+
+
+def makeItem(x_offset = 0, y_offset = 0, scale = 1):
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+
+    item = qtCameraGraphicsScene.QtCameraGraphicsItem()
+    item.display_range = [0, 255]
+    item.frame_x_offset = x_offset
+    item.frame_y_offset = y_offset
+    item.scale_x = scale
+    item.scale_y = scale
+    return [app, item]
+
+def makeFrame(x_pixels, y_pixels):
+    np_data = (numpy.arange(x_pixels * y_pixels) % 251).astype(numpy.uint16)
+    return frame.Frame(np_data, 0, x_pixels, y_pixels, "camera1")
+
+
+def test_camera_display_1():
+    """
+    Without a visible region the whole frame is rendered.
+    """
+    [app, item] = makeItem(x_offset = 8, y_offset = 4, scale = 2)
+    aframe = makeFrame(64, 32)
+    item.updateImageWithFrame(aframe)
+
+    assert([item.q_image.width(), item.q_image.height()] == [64, 32])
+    assert(item.image_rect == QtCore.QRectF(8, 4, 128, 64))
+    assert(item.getAutoScale() == [0, 250])
+
+
+def test_camera_display_2():
+    """
+    Zoomed out, every Nth pixel is rendered.
+    """
+    [app, item] = makeItem()
+    aframe = makeFrame(400, 200)
+    item.updateImageWithFrame(aframe,
+                              visible_rect = QtCore.QRectF(-100, -100, 600, 400),
+                              view_scale = 0.25)
+
+    assert([item.q_image.width(), item.q_image.height()] == [100, 50])
+    assert(item.image_rect == QtCore.QRectF(0, 0, 400, 200))
+
+    image = aframe.getData().reshape(200, 400)[::4, ::4]
+    rendered = numpy.array(item.q_image.ndarray)
+    assert(numpy.array_equal(rendered, image.astype(numpy.uint8)))
+
+
+def test_camera_display_3():
+    """
+    Zoomed in, only the visible part (and a margin) is rendered.
+    """
+    [app, item] = makeItem()
+    aframe = makeFrame(400, 200)
+    item.updateImageWithFrame(aframe,
+                              visible_rect = QtCore.QRectF(100, 40, 40, 20),
+                              view_scale = 4.0)
+
+    assert([item.q_image.width(), item.q_image.height()] == [60, 30])
+    assert(item.image_rect == QtCore.QRectF(90, 35, 60, 30))
+
+    image = aframe.getData().reshape(200, 400)[35:65, 90:150]
+    assert(numpy.array_equal(numpy.array(item.q_image.ndarray), image.astype(numpy.uint8)))
+
+
+if (__name__ == "__main__"):
+    test_camera_display_1()
+    test_camera_display_2()
+    test_camera_display_3()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Tests of sc_library.datareader.
+"""
+import numpy
+import os
+import tifffile
+
+import storm_control.sc_library.datareader as datareader
+import storm_control.sc_library.parameters as params
+
+import storm_control.test as test
+
+
+def makeXml(basename, filetype, n_frames, x_pixels, y_pixels, big_endian = False):
+    xml = params.StormXMLObject()
+    acq_p = xml.addSubSection("acquisition")
+    acq_p.add(params.ParameterInt(name = "number_frames", value = n_frames))
+    cam_p = xml.addSubSection("camera1")
+    cam_p.add(params.ParameterInt(name = "x_pixels", value = x_pixels))
+    cam_p.add(params.ParameterInt(name = "y_pixels", value = y_pixels))
+    film_p = xml.addSubSection("film")
+    film_p.add(params.ParameterString(name = "filetype", value = filetype))
+    film_p.add(params.ParameterSetBoolean(name = "want_big_endian", value = big_endian))
+    xml.saveToFile(basename + ".xml")
+
+def makeDax(name, n_frames, x_pixels, y_pixels, big_endian = False):
+    """
+    Returns the frames as they were written.
+    """
+    basename = os.path.join(test.dataDirectory(), name)
+    data = numpy.arange(n_frames * x_pixels * y_pixels, dtype = numpy.uint16)
+    if big_endian:
+        data.astype(">u2").tofile(basename + ".dax")
+    else:
+        data.tofile(basename + ".dax")
+    makeXml(basename, ".dax", n_frames, x_pixels, y_pixels, big_endian = big_endian)
+    return data.reshape(n_frames, -1)
+
+def makeTif(name, filetype, n_frames, x_pixels, y_pixels, **kwds):
+    """
+    Returns the frames as they were written.
+    """
+    basename = os.path.join(test.dataDirectory(), name)
+    movie = numpy.arange(n_frames * x_pixels * y_pixels, dtype = numpy.uint16)
+    movie = movie.reshape(n_frames, y_pixels, x_pixels)
+    with tifffile.TiffWriter(basename + filetype, bigtiff = (filetype == ".big.tif")) as tf:
+        for i in range(n_frames):
+            tf.write(movie[i], **kwds)
+    makeXml(basename, filetype, n_frames, x_pixels, y_pixels)
+    return movie
+
+
+def test_datareader_1():
+    """
+    Memory mapped .dax reading, the frames should be the same as
+    with the original seek() / fromfile() reader.
+    """
+    raw = makeDax("reader_01", 10, 40, 30)
+    movie = datareader.reader(os.path.join(test.dataDirectory(), "reader_01.dax"))
+    assert(movie.filmSize() == [40, 30, 10])
+
+    for i in [0, 3, 9]:
+        expected = numpy.transpose(numpy.reshape(raw[i], [40, 30]))
+        image = movie.loadAFrame(i)
+        assert(image.shape == (30, 40))
+        assert(numpy.array_equal(image, expected))
+        assert(image.flags.writeable)
+        assert(not numpy.shares_memory(image, movie.filmData()))
+
+    # Views.
+    frames = movie.loadFrames(2, 8, 2, copy = False)
+    assert(not frames.flags.writeable)
+    assert(frames.shape == (3, 30, 40))
+    assert(numpy.array_equal(frames[1], movie.loadAFrame(4)))
+    assert(numpy.shares_memory(frames, movie.filmData()))
+
+    # Copies, this is the default.
+    frames = movie.loadFrames()
+    assert(frames.shape == (10, 30, 40))
+    assert(frames.flags.writeable)
+    assert(not numpy.shares_memory(frames, movie.filmData()))
+
+    # Frames are still valid after closing the file.
+    image = movie.loadAFrame(1)
+    movie.closeFilePtr()
+    assert(numpy.array_equal(image, numpy.transpose(numpy.reshape(raw[1], [40, 30]))))
+
+
+def test_datareader_2():
+    """
+    Big endian .dax reading.
+    """
+    raw = makeDax("reader_02", 4, 16, 16, big_endian = True)
+    movie = datareader.reader(os.path.join(test.dataDirectory(), "reader_02.dax"))
+
+    image = movie.loadAFrame(3)
+    assert(image.dtype == numpy.uint16)
+    assert(numpy.array_equal(image, numpy.transpose(numpy.reshape(raw[3], [16, 16]))))
+
+    frames = movie.loadFrames(copy = True)
+    assert(frames.dtype == numpy.uint16)
+    assert(numpy.array_equal(frames[3], image))
+    movie.closeFilePtr()
+
+
+def test_datareader_3():
+    """
+    Truncated .dax file.
+    """
+    makeDax("reader_03", 4, 16, 16)
+    filename = os.path.join(test.dataDirectory(), "reader_03.dax")
+    with open(filename, "r+b") as fp:
+        fp.truncate(2 * 16 * 16 * 3 - 10)
+
+    movie = datareader.reader(filename)
+    assert(movie.filmSize() == [16, 16, 4])
+    assert(movie.loadFrames().shape[0] == 2)
+    try:
+        movie.loadAFrame(3)
+    except IOError:
+        pass
+    else:
+        assert False, "IOError not raised."
+    movie.closeFilePtr()
+
+
+def test_datareader_4():
+    """
+    TIF reading, contiguous (memory mapped) and not.
+    """
+    for [name, filetype, kwds] in [["reader_04a", ".tif", {"contiguous" : True}],
+                                   ["reader_04b", ".big.tif", {"contiguous" : True}],
+                                   ["reader_04c", ".tif", {"compression" : "zlib"}]]:
+        movie = makeTif(name, filetype, 6, 40, 30, **kwds)
+        reader = datareader.reader(os.path.join(test.dataDirectory(), name + filetype))
+        assert(reader.filmSize() == [40, 30, 6])
+        if ("contiguous" in kwds):
+            assert(reader.movie_data is not None)
+        else:
+            assert(reader.movie_data is None)
+
+        for i in [0, 5]:
+            image = reader.loadAFrame(i)
+            assert(image.dtype == numpy.int16)
+            assert(numpy.array_equal(image, numpy.transpose(movie[i]).astype(numpy.int16)))
+            assert(numpy.array_equal(reader.loadAFrame(i, cast_to_int16 = False), numpy.transpose(movie[i])))
+        assert(reader.loadFrames(1, 4).shape == (3, 40, 30))
+        reader.closeFilePtr()
+
+
+def test_datareader_5():
+    """
+    TIF size does not match the XML.
+    """
+    makeTif("reader_05", ".tif", 2, 40, 30)
+    basename = os.path.join(test.dataDirectory(), "reader_05")
+    makeXml(basename, ".tif", 2, 30, 40)
+    try:
+        datareader.reader(basename + ".tif")
+    except IOError:
+        pass
+    else:
+        assert False, "IOError not raised."
+
+
+def test_datareader_6():
+    """
+    LRU cache.
+    """
+    cache = datareader.LRUCache(max_size = 3)
+    for i in range(3):
+        cache.put(i, str(i))
+    assert(cache.get(0) == "0")
+    cache.put(3, "3")
+    assert(cache.get(1) is None)
+    assert(cache.get(0) == "0")
+    assert(cache.getStatistics()["entries"] == 3)
+    assert(cache.getStatistics()["hits"] == 2)
+    assert(cache.getStatistics()["misses"] == 1)
+
+    cache.setMaxSize(1)
+    assert(cache.get(0) == "0")
+    assert(cache.get(3) is None)
+
+
+def test_datareader_7():
+    """
+    Frame and parameters caches.
+    """
+    datareader.frame_cache.clear()
+    datareader.parameters_cache.clear()
+    raw = makeDax("reader_07", 4, 20, 20)
+    filename = os.path.join(test.dataDirectory(), "reader_07.dax")
+
+    stats = datareader.cacheStatistics()
+    [frame, film_size, xml] = datareader.loadImage(filename, 2)
+    assert(film_size == [20, 20, 4])
+    assert(numpy.array_equal(frame, numpy.transpose(numpy.reshape(raw[2], [20, 20]))))
+    assert(not frame.flags.writeable)
+
+    [frame2, film_size, xml2] = datareader.loadImage(filename, 2)
+    assert(frame2 is frame)
+    assert(xml2 is xml)
+
+    new_stats = datareader.cacheStatistics()
+    assert(new_stats["frames"]["hits"] == (stats["frames"]["hits"] + 1))
+    assert(new_stats["frames"]["misses"] == (stats["frames"]["misses"] + 1))
+    assert(new_stats["frames"]["size"] == frame.nbytes)
+
+    # Re-opening the movie uses the cached parameters.
+    datareader.loadImage(filename, 1)
+    assert(datareader.cacheStatistics()["parameters"]["hits"] == (new_stats["parameters"]["hits"] + 1))
+
+    # Readers get their own copy of the cached parameters.
+    movie = datareader.reader(filename)
+    movie.filmParameters().set("film.filetype", ".tif")
+    movie.closeFilePtr()
+    movie = datareader.reader(filename)
+    assert(movie.filmParameters().get("film.filetype") == ".dax")
+    movie.closeFilePtr()
+    assert(datareader.loadImage(filename, 1)[2].get("film.filetype") == ".dax")
+
+    # A changed movie is not in the cache.
+    makeDax("reader_07", 4, 20, 20, big_endian = True)
+    os.utime(filename, ns = (0, 0))
+    [frame3, film_size, xml3] = datareader.loadImage(filename, 2)
+    assert(frame3 is not frame)
+    assert(numpy.array_equal(frame3, frame))
+
+
+if (__name__ == "__main__"):
+    test_datareader_1()
+    test_datareader_2()
+    test_datareader_3()
+    test_datareader_4()
+    test_datareader_5()
+    test_datareader_6()
+    test_datareader_7()
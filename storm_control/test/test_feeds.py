@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+"""
+Tests of the feeds (without HAL).
+"""
+import numpy
+import sys
+import time
+
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraControl as cameraControl
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.feeds.feeds as feeds
+
+
+def makeCameraFunctionality(x_pixels = 16, y_pixels = 8):
+    control = cameraControl.CameraControl(camera_name = "camera1",
+                                          config = params.StormXMLObject())
+    p = control.getParameters()
+    p.setv("x_end", x_pixels)
+    p.setv("x_pixels", x_pixels)
+    p.setv("y_end", y_pixels)
+    p.setv("y_pixels", y_pixels)
+    p.setv("bytes_per_frame", 2 * x_pixels * y_pixels)
+    return cameraFunctionality.CameraFunctionality(camera_name = "camera1",
+                                                   parameters = p)
+
+def makeFeed(cam_fn, feed_name, **kwds):
+    """
+    kwds are the feed parameters.
+    """
+    feed_p = params.StormXMLObject()
+    feed_p.add(params.ParameterString(name = "source", value = "camera1"))
+    for [pname, pvalue] in kwds.items():
+        if isinstance(pvalue, str):
+            feed_p.add(params.ParameterString(name = pname, value = pvalue))
+        else:
+            feed_p.add(params.ParameterInt(name = pname, value = pvalue))
+
+    feeds_p = params.StormXMLObject()
+    feeds_p.addSubSection(feed_name, feed_p)
+    controller = feeds.FeedController(parameters = feeds_p)
+    feed = controller.getFeed("camera1." + feed_name)
+    feed.setCameraFunctionality(cam_fn)
+    return feed
+
+def makeFrames(cam_fn, n_frames, start = 0):
+    x_pixels = cam_fn.getParameter("x_pixels")
+    y_pixels = cam_fn.getParameter("y_pixels")
+    frames = []
+    for i in range(start, start + n_frames):
+        np_data = numpy.arange(x_pixels * y_pixels, dtype = numpy.uint16) + i
+        frames.append(frame.Frame(np_data, i, x_pixels, y_pixels, "camera1"))
+    return frames
+
+def record(functionality):
+    """
+    Record the batches and the individual frames emitted by a camera
+    or feed functionality.
+    """
+    batches = []
+    frames = []
+    functionality.newFrames.connect(batches.append)
+    functionality.newFrame.connect(frames.append)
+    return [batches, frames]
+
+
+def test_feeds_1():
+    """
+    A batch of camera frames is one batch of feed frames, and the
+    per-frame signal still works.
+    """
+    cam_fn = makeCameraFunctionality()
+    feed = makeFeed(cam_fn, "slice", feed_type = "slice", x_start = 5, x_end = 12, y_start = 3, y_end = 6)
+    [batches, frames] = record(feed)
+
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 10))
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 10))
+    assert([len(x) for x in batches] == [10, 5])
+    assert(len(frames) == 15)
+
+    expected = numpy.arange(16 * 8).reshape(8, 16)[2:6, 4:12] + 3
+    assert(numpy.all(frames[3].getData().reshape(4, 8) == expected))
+    assert(frames[3].image_x == 8)
+    assert(frames[3].frame_number == 3)
+
+
+def test_feeds_2():
+    """
+    Averaging and interval feeds, batches that don't produce any feed
+    frames are not emitted.
+    """
+    cam_fn = makeCameraFunctionality()
+    average = makeFeed(cam_fn, "average", feed_type = "average", frames_to_average = 4)
+    interval = makeFeed(cam_fn, "interval", feed_type = "interval", cycle_length = 3, capture_frames = "0,2")
+    [avg_batches, avg_frames] = record(average)
+    [int_batches, int_frames] = record(interval)
+
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 2))
+    assert(len(avg_batches) == 0)
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 8, start = 2))
+    assert([len(x) for x in avg_batches] == [2])
+    assert([x.frame_number for x in avg_frames] == [0, 1])
+    assert(numpy.all(avg_frames[1].getData() == (numpy.arange(16 * 8) + 5)))
+
+    assert([len(x) for x in int_batches] == [1, 6])
+    assert([x.frame_number for x in int_frames] == list(range(7)))
+
+
+def test_feeds_3():
+    """
+    Running average, exponential moving average and background feeds.
+    """
+    cam_fn = makeCameraFunctionality()
+    running = makeFeed(cam_fn, "running", feed_type = "running_average", frames_to_average = 3)
+    ema = makeFeed(cam_fn, "ema", feed_type = "ema", x_start = 5, x_end = 12)
+    median = makeFeed(cam_fn, "median", feed_type = "median", frames_to_average = 4, cycle_length = 2)
+    minimum = makeFeed(cam_fn, "min", feed_type = "min", frames_to_average = 3)
+    [run_batches, run_frames] = record(running)
+    [ema_batches, ema_frames] = record(ema)
+    [med_batches, med_frames] = record(median)
+    [min_batches, min_frames] = record(minimum)
+
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 6))
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 3, start = 10))
+
+    # Frames 0, 1, 2, 3, 4, 5, 10, 11, 12.
+    ramp = numpy.arange(16 * 8)
+    assert([x.frame_number for x in run_frames] == list(range(9)))
+    assert(numpy.all(run_frames[0].getData() == ramp))
+    assert(numpy.all(run_frames[1].getData() == (ramp + 0)))
+    assert(numpy.all(run_frames[5].getData() == (ramp + 4)))
+    assert(numpy.all(run_frames[6].getData() == (ramp + 6)))
+    assert(numpy.all(run_frames[8].getData() == (ramp + 11)))
+
+    expected = 0.0
+    for i, j in enumerate([0, 1, 2, 3, 4, 5, 10, 11, 12]):
+        if (i == 0):
+            expected = float(j)
+        else:
+            expected = 0.9 * expected + 0.1 * j
+        sliced = numpy.arange(16 * 8).reshape(8, 16)[:, 4:12]
+        assert(numpy.all(numpy.abs(ema_frames[i].getData() - (sliced.ravel() + expected)) <= 0.5))
+    assert(ema_frames[0].image_x == 8)
+
+    assert([len(x) for x in med_batches] == [3, 1])
+    assert(numpy.all(med_frames[0].getData() == (ramp + 0)))
+    assert(numpy.all(med_frames[2].getData() == (ramp + 3)))
+    assert(numpy.all(med_frames[3].getData() == (ramp + 7)))
+
+    assert(numpy.all(min_frames[0].getData() == ramp))
+    assert(numpy.all(min_frames[2].getData() == (ramp + 10)))
+
+    # Reset starts over.
+    running.reset()
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 1, start = 20))
+    assert(numpy.all(run_frames[-1].getData() == (ramp + 20)))
+    assert(run_frames[-1].frame_number == 0)
+
+
+def test_feeds_4():
+    """
+    Feeds processed by workers give the same frames, in the same order,
+    as feeds processed in the GUI thread.
+    """
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+
+    threadpool = QtCore.QThreadPool()
+    threadpool.setMaxThreadCount(4)
+
+    cam_fn = makeCameraFunctionality()
+    results = []
+    for use_workers in [False, True]:
+        average = makeFeed(cam_fn, "average", feed_type = "average", frames_to_average = 3)
+        running = makeFeed(cam_fn, "running", feed_type = "running_average", frames_to_average = 4)
+        slice1 = makeFeed(cam_fn, "slice1", feed_type = "slice", x_start = 5, x_end = 12)
+        feeds = [average, running, slice1]
+        stopped = []
+        if use_workers:
+            for feed in feeds:
+                feed.useWorkers(threadpool, 100)
+                feed.stopped.connect(lambda : stopped.append(True))
+        recorded = [record(feed)[1] for feed in feeds]
+
+        for i in range(10):
+            cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 5 * i))
+        cam_fn.stopped.emit()
+
+        start_time = time.time()
+        while use_workers and (len(stopped) < 3) and ((time.time() - start_time) < 5.0):
+            app.processEvents()
+            time.sleep(0.001)
+
+        results.append(recorded)
+        for feed in feeds:
+            feed.disconnectCameraFunctionality()
+
+    for [sync_frames, worker_frames] in zip(*results):
+        assert(len(sync_frames) == len(worker_frames))
+        for [f1, f2] in zip(sync_frames, worker_frames):
+            assert(f1.frame_number == f2.frame_number)
+            assert(numpy.array_equal(f1.getData(), f2.getData()))
+
+    assert(len(stopped) == 3)
+    stats = slice1.getWorkerStatistics()
+    assert(stats["frames"] == 50)
+    assert(stats["dropped"] == 0)
+
+    app = None
+
+
+def test_feeds_5():
+    """
+    Feeds derived from other feeds, and feeds only process frames
+    when something is subscribed to them.
+    """
+    feeds_p = params.StormXMLObject()
+    for [feed_name, source, feed_type] in [["slice1", "camera1", "slice"],
+                                           ["sub", "slice1", "average"],
+                                           ["unused", "camera1", "average"]]:
+        feed_p = feeds_p.addSubSection(feed_name)
+        feed_p.add(params.ParameterString(name = "source", value = source))
+        feed_p.add(params.ParameterString(name = "feed_type", value = feed_type))
+    for [pname, pvalue] in [["x_start", 5], ["x_end", 12], ["y_start", 3], ["y_end", 6]]:
+        feeds_p.get("slice1").add(params.ParameterInt(name = pname, value = pvalue))
+    feeds_p.get("sub").add(params.ParameterInt(name = "x_end", value = 4))
+    feeds_p.get("sub").add(params.ParameterInt(name = "frames_to_average", value = 2))
+
+    cam_fn = makeCameraFunctionality()
+    controller = feeds.FeedController(parameters = feeds_p)
+    assert(sorted(controller.getFeedNames()) == ["camera1.slice1", "camera1.sub", "camera1.unused"])
+    assert([x.getCameraName() for x in controller.getCameraFeeds()] == ["camera1.slice1", "camera1.unused"])
+    for feed in controller.getCameraFeeds():
+        controller.setCameraFunctionality(feed.getCameraName(), cam_fn)
+    assert(controller.allFeedsFunctional())
+
+    [slice1, sub, unused] = [controller.getFeed("camera1." + x) for x in ["slice1", "sub", "unused"]]
+    assert(sub.getCameraFunctionality() is slice1)
+    assert([sub.x_pixels, sub.y_pixels] == [4, 4])
+    assert(not any([x.isActive() for x in [slice1, sub, unused]]))
+
+    # Subscribing to the derived feed activates it's source too.
+    [batches, frames] = record(sub)
+    assert(slice1.isActive() and sub.isActive() and not unused.isActive())
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 4))
+    assert(len(frames) == 2)
+    expected = numpy.arange(16 * 8).reshape(8, 16)[2:6, 4:8] + 2
+    assert(numpy.all(frames[1].getData().reshape(4, 4) == expected))
+    assert(unused.frame_number == 0)
+
+    sub.newFrames.disconnect(batches.append)
+    assert(sub.isActive())
+    sub.newFrame.disconnect(frames.append)
+    assert(not (slice1.isActive() or sub.isActive()))
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 4, start = 4))
+    assert(len(frames) == 2)
+
+    controller.disconnectFeeds()
+
+
+def test_feeds_6():
+    """
+    Slice feeds don't copy the camera frame data, the contiguous copy
+    is made once when something asks for it.
+    """
+    cam_fn = makeCameraFunctionality()
+    slice1 = makeFeed(cam_fn, "slice1", feed_type = "slice", x_start = 5, x_end = 12, y_start = 3, y_end = 6)
+    [batches, frames] = record(slice1)
+
+    camera_frames = makeFrames(cam_fn, 2)
+    cam_fn.emitNewFrames(camera_frames)
+
+    aframe = frames[1]
+    assert(not aframe.isContiguous())
+    assert(numpy.shares_memory(aframe.getView(), camera_frames[1].getData()))
+    assert(aframe.getView().shape == (4, 8))
+    assert(aframe.getStrides() == (32, 2))
+
+    expected = numpy.arange(16 * 8).reshape(8, 16)[2:6, 4:12] + 1
+    data = aframe.getData()
+    assert(aframe.isContiguous())
+    assert(data.flags["C_CONTIGUOUS"] and (data.size == 32))
+    assert(numpy.array_equal(data.reshape(4, 8), expected))
+    assert(aframe.getData() is data)
+    assert(aframe.getDataPtr() == data.ctypes.data)
+
+
+def test_feeds_7():
+    """
+    Binning, decimation and maximum projection feeds.
+    """
+    cam_fn = makeCameraFunctionality(x_pixels = 32, y_pixels = 16)
+    bin_mean = makeFeed(cam_fn, "bin_mean", feed_type = "bin", bin_x = 4, bin_y = 2, x_start = 9, y_start = 3, y_end = 14)
+    bin_sum = makeFeed(cam_fn, "bin_sum", feed_type = "bin", bin_mode = "sum", bin_x = 2, bin_y = 2)
+    decimate = makeFeed(cam_fn, "decimate", feed_type = "decimate", target_size = 8)
+    max_proj = makeFeed(cam_fn, "max_proj", feed_type = "max_projection", frames_to_average = 3)
+    recorded = [record(feed)[1] for feed in [bin_mean, bin_sum, decimate, max_proj]]
+
+    frames = makeFrames(cam_fn, 4)
+    frames[1].getData()[:2] = 60000
+    cam_fn.emitNewFrames(frames)
+    image = numpy.arange(32 * 16).reshape(16, 32)
+
+    # Binned feeds are displayed as if the camera was binning.
+    # The 24 pixel wide ROI bins to 6 pixels, which is trimmed to 4.
+    assert([bin_mean.getParameter(x) for x in ["x_pixels", "y_pixels", "x_bin", "y_bin", "x_start", "y_start"]] == [4, 6, 4, 2, 3, 2])
+    assert((bin_mean.getParameter("x_pixels") % 4) == 0)
+    expected = image[2:14, 8:24].reshape(6, 2, 4, 4).sum(axis = (1, 3))//8 + 2
+    assert(numpy.array_equal(recorded[0][2].getData().reshape(6, 4), expected))
+    assert(recorded[0][2].frame_number == 2)
+
+    assert(bin_sum.getParameter("bytes_per_frame") == 2 * 16 * 8)
+    assert(recorded[1][1].getData()[0] == 65535)
+    expected = image.reshape(8, 2, 16, 2).sum(axis = (1, 3)) + 4 * 3
+    assert(numpy.array_equal(recorded[1][3].getData().reshape(8, 16), expected))
+
+    # 32 x 16 is decimated by 4 to 8 x 4.
+    assert([decimate.x_pixels, decimate.y_pixels] == [8, 4])
+    assert(decimate.getParameter("x_bin") == 4)
+    assert(numpy.array_equal(recorded[2][0].getData().reshape(4, 8), image[::4, ::4]))
+
+    assert(len(recorded[3]) == 4)
+    assert(recorded[3][2].getData()[0] == 60000)
+    assert(numpy.array_equal(recorded[3][3].getData()[2:], image.ravel()[2:] + 3))
+
+    # The feed sizes can be checked before the feeds are created.
+    parameters = params.StormXMLObject()
+    camera_p = parameters.addSubSection("camera1")
+    camera_p.add(params.ParameterInt(name = "x_pixels", value = 512))
+    camera_p.add(params.ParameterInt(name = "y_pixels", value = 512))
+    feed_p = parameters.addSubSection("feeds").addSubSection("overview")
+    feed_p.add(params.ParameterString(name = "source", value = "camera1"))
+    feed_p.add(params.ParameterString(name = "feed_type", value = "decimate"))
+    feed_p.add(params.ParameterInt(name = "target_size", value = 100))
+    assert(feeds.feedSize(parameters, "overview") == [84, 86])
+    feeds.checkParameters(parameters)
+
+
+def test_feeds_8():
+    """
+    Worker drops are only counted once, a batch that fails does not
+    stall the feed and the worker can be drained.
+    """
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(sys.argv)
+
+    threadpool = QtCore.QThreadPool()
+    threadpool.setMaxThreadCount(1)
+
+    cam_fn = makeCameraFunctionality()
+    slice1 = makeFeed(cam_fn, "slice1", feed_type = "slice", x_start = 5, x_end = 12)
+    slice1.useWorkers(threadpool, 5)
+    [batches, frames] = record(slice1)
+
+    def waitIdle():
+        start_time = time.time()
+        while slice1.worker.isBusy() and ((time.time() - start_time) < 5.0):
+            app.processEvents()
+            time.sleep(0.001)
+        app.processEvents()
+
+    # The second batch does not fit.
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 0))
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 5))
+    waitIdle()
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 10))
+    waitIdle()
+    assert([aframe.frame_number for aframe in frames] == list(range(5)) + list(range(10, 15)))
+    assert(slice1.getWorkerStatistics()["dropped"] == 5)
+    assert(slice1.gap_detector.getStatistics()["gaps"] == [[5, 5]])
+
+    # A batch that fails.
+    process_frames = slice1.processFrames
+    slice1.processFrames = lambda new_frames : 1/0
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 15))
+    waitIdle()
+    slice1.processFrames = process_frames
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 5, start = 20))
+    waitIdle()
+    assert(frames[-1].frame_number == 24)
+    assert(slice1.getWorkerStatistics()["errors"] == 1)
+
+    # Draining.
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 2, start = 25))
+    slice1.worker.drain()
+    assert(not slice1.worker.isBusy())
+    n_frames = len(frames)
+    waitIdle()
+    assert(len(frames) == n_frames)
+    cam_fn.emitNewFrames(makeFrames(cam_fn, 2, start = 0))
+    waitIdle()
+    assert([aframe.frame_number for aframe in frames[-2:]] == [0, 1])
+
+    slice1.disconnectCameraFunctionality()
+    app = None
+
+
+def test_feeds_9():
+    """
+    Binning / decimation that would give an empty feed is rejected.
+    """
+    def checkFeed(**kwds):
+        parameters = params.StormXMLObject()
+        camera_p = parameters.addSubSection("camera1")
+        camera_p.add(params.ParameterInt(name = "x_pixels", value = 16))
+        camera_p.add(params.ParameterInt(name = "y_pixels", value = 8))
+        feed_p = parameters.addSubSection("feeds").addSubSection("feed1")
+        feed_p.add(params.ParameterString(name = "source", value = "camera1"))
+        for [name, value] in kwds.items():
+            if isinstance(value, str):
+                feed_p.add(params.ParameterString(name = name, value = value))
+            else:
+                feed_p.add(params.ParameterInt(name = name, value = value))
+        try:
+            feeds.checkParameters(parameters)
+        except feeds.FeedException as e:
+            print(e)
+            return False
+        return True
+
+    assert(checkFeed(feed_type = "bin", bin_x = 4, bin_y = 8))
+
+    # No binning.
+    assert(not checkFeed(feed_type = "bin", bin_x = 0, bin_y = 2))
+    assert(not checkFeed(feed_type = "bin", bin_x = 2, bin_y = 0))
+    assert(not checkFeed(feed_type = "decimate", target_size = 0))
+
+    # Binned to less than 4 pixels in x or to nothing in y.
+    assert(not checkFeed(feed_type = "bin", bin_x = 8, bin_y = 2))
+    assert(not checkFeed(feed_type = "bin", bin_x = 2, bin_y = 16))
+
+    # Decimated to less than 4 pixels in x.
+    assert(not checkFeed(feed_type = "decimate", target_size = 2))
+
+
+if (__name__ == "__main__"):
+    test_feeds_1()
+    test_feeds_2()
+    test_feeds_3()
+    test_feeds_4()
+    test_feeds_5()
+    test_feeds_6()
+    test_feeds_7()
+    test_feeds_8()
+    test_feeds_9()
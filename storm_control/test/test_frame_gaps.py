@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Tests of the dropped / duplicated frame detection.
+"""
+import os
+
+import storm_control.hal4000.camera.frameGaps as frameGaps
+import storm_control.hal4000.film.filmSettings as filmSettings
+import storm_control.hal4000.halLib.imagewriters as imagewriters
+
+import storm_control.test as test
+import storm_control.test.test_feeds as test_feeds
+
+
+def test_frame_gaps_1():
+    """
+    Gaps, duplicates and restarts.
+    """
+    detector = frameGaps.GapDetector()
+    for i in [0, 1, 2, 5, 6, 6, 3, 7, 8, 10]:
+        detector.checkFrame(i)
+    detector.addDropped(11)
+
+    stats = detector.getStatistics()
+    assert(stats["dropped"] == 4)
+    assert(stats["duplicated"] == 2)
+    assert(stats["gaps"] == [[3, 2], [9, 1], [11, 1]])
+
+    # Frame 0 (or a restart) starts a new sequence.
+    assert(detector.checkFrame(0))
+    assert(detector.checkFrame(1))
+    detector.restart()
+    assert(detector.checkFrame(20))
+    assert(detector.getStatistics()["dropped"] == 4)
+
+    detector.reset()
+    assert(detector.getStatistics() == {"dropped" : 0, "duplicated" : 0, "gaps" : []})
+
+
+def test_frame_gaps_2():
+    """
+    Frames that are missing from the camera are detected by the feeds
+    and the writers.
+    """
+    monitor = frameGaps.monitor
+    monitor.reset()
+
+    cam_fn = test_feeds.makeCameraFunctionality()
+    feed = test_feeds.makeFeed(cam_fn, "slice", feed_type = "slice", x_start = 5, x_end = 12, y_start = 3, y_end = 6)
+    test_feeds.record(feed)
+    basename = os.path.join(test.dataDirectory(), "gaps_01")
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax")
+    writer = imagewriters.createFileWriter(cam_fn, film_settings)
+
+    frames = test_feeds.makeFrames(cam_fn, 10)
+    cam_fn.emitNewFrames(frames[:4])
+    cam_fn.emitNewFrames(frames[6:])
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+
+    stats = monitor.getStatistics("camera1")
+    assert(stats["camera1"]["writer"]["gaps"] == [[4, 2]])
+    assert(stats["camera1.slice"]["feed"]["dropped"] == 2)
+    assert(monitor.getWorst("camera1") == [2, 0])
+
+    monitor.reset("camera1")
+    assert(monitor.getWorst() == [0, 0])
+
+
+if (__name__ == "__main__"):
+    test_frame_gaps_1()
+    test_frame_gaps_2()
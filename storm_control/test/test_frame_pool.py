@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Tests of the camera frame pool.
+"""
+import gc
+import numpy
+
+import storm_control.sc_library.framePool as framePool
+
+import storm_control.hal4000.camera.frame as frame
+
+
+def test_frame_pool_1():
+    """
+    Buffers are aligned and return to the pool when they are released.
+    """
+    pool = framePool.FramePool(frame_bytes = 64 * 32 * 2, n_buffers = 3)
+
+    data = []
+    for i in range(3):
+        frame_data = pool.getFrameData()
+        assert(frame_data.getData().size == 64 * 32)
+        assert(frame_data.getData().dtype == numpy.uint16)
+        assert((frame_data.getDataPtr() % 4096) == 0)
+        data.append(frame_data)
+    assert(pool.getStatistics()["in_use"] == 3)
+
+    del data, frame_data
+    gc.collect()
+    stats = pool.getStatistics()
+    assert(stats["in_use"] == 0)
+    assert(stats["max_in_use"] == 3)
+    assert(stats["exhausted"] == 0)
+
+
+def test_frame_pool_2():
+    """
+    Buffers are not re-used while any consumer has the frame (or a view
+    of its data) and the pool allocates new storage when it is exhausted.
+    """
+    pool = framePool.FramePool(frame_bytes = 16 * 8 * 2, n_buffers = 2)
+
+    src = numpy.arange(16 * 8, dtype = numpy.uint16)
+    frame_data = pool.getFrameData()
+    frame_data.copyData(src.ctypes.data)
+    aframe = frame.Frame(frame_data.getData(), 0, 16, 8, "camera1")
+    image = aframe.getData().reshape(8, 16)[2:4, :]
+    del frame_data, aframe
+    gc.collect()
+    assert(pool.getStatistics()["in_use"] == 1)
+
+    # Exhaust the pool.
+    other = [pool.getFrameData(), pool.getFrameData()]
+    stats = pool.getStatistics()
+    assert(stats["in_use"] == 2)
+    assert(stats["exhausted"] == 1)
+    assert(numpy.all(image[0] == numpy.arange(32, 48)))
+
+    del image, other
+    gc.collect()
+    assert(pool.getStatistics()["in_use"] == 0)
+
+    pool.resetStatistics()
+    assert(pool.getStatistics()["exhausted"] == 0)
+
+
+if (__name__ == "__main__"):
+    test_frame_pool_1()
+    test_frame_pool_2()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Tests of the emulated camera frame generation.
+"""
+import numpy
+import time
+
+from PyQt5 import QtCore
+
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.frameSimulator as frameSimulator
+import storm_control.hal4000.camera.noneCameraControl as noneCameraControl
+
+
+def test_frame_simulator_1():
+    """
+    The "static" content is the original (rolled) test pattern.
+    """
+    [x_pixels, y_pixels] = [40, 30]
+    pattern = numpy.zeros(x_pixels * y_pixels, dtype = numpy.uint16)
+    for i in range(x_pixels):
+        for j in range(y_pixels):
+            pattern[j*x_pixels+i] = i % 128 + j % 128
+
+    simulator = frameSimulator.FrameSimulator(roll = 1.5,
+                                              x_pixels = x_pixels,
+                                              y_pixels = y_pixels)
+    np_data = numpy.zeros(x_pixels * y_pixels, dtype = numpy.uint16)
+    for frame_number in [0, 3, 2000]:
+        simulator.newFrame(frame_number, np_data)
+        assert(numpy.all(np_data == numpy.roll(pattern, int(1.5 * frame_number))))
+
+
+def test_frame_simulator_2():
+    """
+    Emitters are where the ground truth says they are, and get
+    blurrier out of focus.
+    """
+    [x_pixels, y_pixels] = [128, 64]
+    peaks = []
+    for focus_offset in [0.0, 1.0]:
+        simulator = frameSimulator.FrameSimulator(background = 1.0,
+                                                  content = "focus",
+                                                  emitters = 5,
+                                                  focus_offset = focus_offset,
+                                                  offset = 0,
+                                                  seed = 1,
+                                                  x_pixels = x_pixels,
+                                                  y_pixels = y_pixels)
+        np_data = numpy.zeros(x_pixels * y_pixels, dtype = numpy.uint16)
+        simulator.newFrame(0, np_data)
+        image = np_data.reshape(y_pixels, x_pixels)
+
+        [x, y, on] = simulator.getEmitters()
+        assert(numpy.all(on))
+        peaks.append(image[y.astype(int), x.astype(int)])
+        assert(numpy.all(peaks[-1] > 10))
+
+    assert(numpy.all(peaks[0] > peaks[1]))
+
+    # Blinking.
+    simulator = frameSimulator.FrameSimulator(content = "emitters",
+                                              emitters = 1000,
+                                              seed = 1,
+                                              x_pixels = x_pixels,
+                                              y_pixels = y_pixels)
+    on = simulator.getEmitters()[2]
+    simulator.newFrame(1, np_data)
+    assert(numpy.any(on != simulator.getEmitters()[2]))
+
+
+def test_frame_simulator_3():
+    """
+    The emulated camera is paced by the clock.
+    """
+    config = params.StormXMLObject()
+    config.add(params.ParameterFloat(name = "mean_pause", value = 0.001))
+    config.add(params.ParameterString(name = "content", value = "emitters"))
+    config.add(params.ParameterFloat(name = "roll", value = 1.0))
+    control = noneCameraControl.NoneCameraControl(camera_name = "camera1",
+                                                  config = config)
+    control.parameters.setv("exposure_time", 0.002)
+
+    batches = []
+    control.newData.connect(batches.append, type = QtCore.Qt.DirectConnection)
+    control.film_length = 50
+
+    start_time = time.perf_counter()
+    control.run()
+    elapsed = time.perf_counter() - start_time
+
+    frames = [aframe for batch in batches for aframe in batch]
+    assert([aframe.frame_number for aframe in frames] == list(range(50)))
+    assert(elapsed > 0.09)
+    assert(abs((frames[-1].acquisition_time - frames[0].acquisition_time) - 0.098) < 1.0e-6)
+
+
+if (__name__ == "__main__"):
+    test_frame_simulator_1()
+    test_frame_simulator_2()
+    test_frame_simulator_3()
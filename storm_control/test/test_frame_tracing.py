@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Tests of the frame latency tracing.
+"""
+import os
+import time
+
+import storm_control.hal4000.camera.frameTracing as frameTracing
+import storm_control.hal4000.film.filmSettings as filmSettings
+import storm_control.hal4000.halLib.imagewriters as imagewriters
+
+import storm_control.test as test
+import storm_control.test.test_imagewriters as test_imagewriters
+
+
+def test_frame_tracing_1():
+    """
+    Latency histogram statistics.
+    """
+    histogram = frameTracing.LatencyHistogram()
+    assert(histogram.getStatistics()["count"] == 0)
+
+    for i in range(99):
+        histogram.add(1.0e-3)
+    histogram.add(0.1)
+
+    stats = histogram.getStatistics()
+    assert(stats["count"] == 100)
+    assert(abs(stats["mean"] - 1.99) < 1.0e-6)
+    assert(stats["max"] == 100.0)
+    assert(1.0 <= stats["p50"] <= 1.26)
+    assert(1.0 <= stats["p99"] <= 1.26)
+    assert(sum(stats["histogram"]) == 100)
+
+    # Out of range latencies go in the first or last bins.
+    histogram.add(0.0)
+    histogram.add(1000.0)
+    assert(histogram.counts[0] == 1)
+    assert(histogram.counts[-1] == 1)
+
+
+def test_frame_tracing_2():
+    """
+    Frames are only traced when tracing is enabled and the statistics
+    are kept per camera / feed and stage.
+    """
+    tracer = frameTracing.tracer
+    tracer.reset()
+
+    cam_fn = test_imagewriters.makeCameraFunctionality()
+    basename = os.path.join(test.dataDirectory(), "tracing_01")
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax")
+
+    frames = test_imagewriters.makeFrames(cam_fn, 10)
+    for aframe in frames:
+        aframe.acquisition_time = time.perf_counter()
+
+    # Tracing is disabled, so the frames are time stamped but nothing is recorded.
+    writer = imagewriters.createFileWriter(cam_fn, film_settings)
+    cam_fn.emitNewFrames(frames[:5])
+    assert(frames[0].commit_time is not None)
+    assert(tracer.getStatistics() == {})
+
+    tracer.setEnabled(True)
+    try:
+        cam_fn.emitNewFrames(frames[5:])
+        frameTracing.tracer.record("camera2", "emit", 1.0e-3)
+        frameTracing.tracer.record("camera1.feed1", "emit", 1.0e-3)
+    finally:
+        tracer.setEnabled(False)
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+
+    stats = tracer.getStatistics("camera1")
+    assert(sorted(stats) == ["camera1", "camera1.feed1"])
+    assert(sorted(stats["camera1"]) == ["commit", "enqueue", "write"])
+    assert(stats["camera1"]["commit"]["count"] == 5)
+    assert(stats["camera1"]["commit"]["max"] >= stats["camera1"]["enqueue"]["max"])
+
+    tracer.reset("camera1")
+    assert(sorted(tracer.getStatistics()) == ["camera2"])
+    tracer.reset()
+
+
+if (__name__ == "__main__"):
+    test_frame_tracing_1()
+    test_frame_tracing_2()
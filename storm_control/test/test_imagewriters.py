@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Tests of the image writers.
+"""
+import numpy
+import os
+import tifffile
+import time
+
+import storm_control.sc_library.datareader as datareader
+import storm_control.sc_library.frameIndex as frameIndex
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.film.filmSettings as filmSettings
+import storm_control.hal4000.halLib.imagewriters as imagewriters
+
+import storm_control.test as test
+import storm_control.test.benchmark_imagewriters as benchmark
+
+
+def makeCameraFunctionality(x_pixels = 64, y_pixels = 32):
+    p = params.StormXMLObject()
+    p.add(params.ParameterInt(name = "bytes_per_frame", value = 2 * x_pixels * y_pixels))
+    p.add(params.ParameterString(name = "extension", value = ""))
+    p.add(params.ParameterInt(name = "x_pixels", value = x_pixels))
+    p.add(params.ParameterInt(name = "y_pixels", value = y_pixels))
+    return cameraFunctionality.CameraFunctionality(camera_name = "camera1",
+                                                   parameters = p)
+
+def makeFrames(cam_fn, n_frames, ramp = False):
+    """
+    Frame i is either constant (i) or, if ramp is True, a ramp starting at
+    i so that every pixel of every frame is different.
+    """
+    x_pixels = cam_fn.getParameter("x_pixels")
+    y_pixels = cam_fn.getParameter("y_pixels")
+    frames = []
+    for i in range(n_frames):
+        if ramp:
+            np_data = numpy.arange(x_pixels * y_pixels, dtype = numpy.uint16) + i * x_pixels * y_pixels
+        else:
+            np_data = numpy.full(x_pixels * y_pixels, i, dtype = numpy.uint16)
+        frames.append(frame.Frame(np_data, i, x_pixels, y_pixels, "camera1"))
+    return frames
+
+def recordFilm(cam_fn, film_settings, n_frames, ramp = False):
+    writer = imagewriters.createFileWriter(cam_fn, film_settings)
+    for aframe in makeFrames(cam_fn, n_frames, ramp = ramp):
+        cam_fn.emitNewFrames([aframe])
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+    return writer
+
+def loadDax(basename, cam_fn):
+    data = numpy.fromfile(basename + ".dax", dtype = numpy.uint16)
+    return data.reshape(-1, cam_fn.getParameter("y_pixels"), cam_fn.getParameter("x_pixels"))
+
+
+def test_imagewriters_1():
+    """
+    Synchronous .dax writing.
+    """
+    basename = os.path.join(test.dataDirectory(), "writer_01")
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax")
+    writer = recordFilm(cam_fn, film_settings, 10)
+
+    movie = loadDax(basename, cam_fn)
+    assert(movie.shape[0] == 10)
+    assert(numpy.all(movie[:,0,0] == numpy.arange(10)))
+
+    acq_p = {p.getName() : p.getv() for p in writer.getAcquisitionParameters()}
+    assert(acq_p["camera1_dropped_frames"] == 0)
+    assert(acq_p["camera1_max_queue_depth"] == 0)
+
+
+def test_imagewriters_2():
+    """
+    Threaded .dax writing, all the frames should be saved in order.
+    """
+    basename = os.path.join(test.dataDirectory(), "writer_02")
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax",
+                                              writer_async = True,
+                                              writer_queue_depth = 4)
+    writer = recordFilm(cam_fn, film_settings, 50)
+
+    movie = loadDax(basename, cam_fn)
+    assert(movie.shape[0] == 50)
+    assert(numpy.all(movie[:,0,0] == numpy.arange(50)))
+
+    acq_p = {p.getName() : p.getv() for p in writer.getAcquisitionParameters()}
+    assert(acq_p["camera1_dropped_frames"] == 0)
+    assert(acq_p["camera1_max_queue_depth"] <= 4)
+
+
+def test_imagewriters_3():
+    """
+    Threaded writing with a slow disk and the 'drop' policy.
+    """
+    class SlowDaxFile(imagewriters.DaxFile):
+        def writeFrame(self, frame):
+            time.sleep(0.01)
+            super().writeFrame(frame)
+
+    basename = os.path.join(test.dataDirectory(), "writer_03")
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax",
+                                              writer_async = True,
+                                              writer_overflow = "drop",
+                                              writer_queue_depth = 2)
+    writer = SlowDaxFile(camera_functionality = cam_fn,
+                         film_settings = film_settings)
+    for aframe in makeFrames(cam_fn, 20):
+        cam_fn.emitNewFrames([aframe])
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+
+    movie = loadDax(basename, cam_fn)
+    acq_p = {p.getName() : p.getv() for p in writer.getAcquisitionParameters()}
+    assert(acq_p["camera1_dropped_frames"] > 0)
+    assert((movie.shape[0] + acq_p["camera1_dropped_frames"]) == 20)
+    assert(writer.number_frames == movie.shape[0])
+
+
+def test_imagewriters_4():
+    """
+    Batched .dax writing. The batch size is not a multiple of the frame
+    size, and the film is shorter than the pre-allocated length.
+    """
+    for [name, writer_async, direct_io] in [["writer_04a", False, False],
+                                            ["writer_04b", True, False],
+                                            ["writer_04c", True, True]]:
+        basename = os.path.join(test.dataDirectory(), name)
+        cam_fn = makeCameraFunctionality(x_pixels = 1000, y_pixels = 700)
+        film_settings = filmSettings.FilmSettings(basename = basename,
+                                                  filetype = ".fast.dax",
+                                                  film_length = 20,
+                                                  writer_async = writer_async,
+                                                  writer_batch_size = 1,
+                                                  writer_direct_io = direct_io)
+        recordFilm(cam_fn, film_settings, 15)
+
+        assert(os.path.getsize(basename + ".dax") == 15 * 1000 * 700 * 2)
+        movie = loadDax(basename, cam_fn)
+        assert(numpy.all(movie[:,0,0] == numpy.arange(15)))
+        assert(numpy.all(movie[:,-1,-1] == numpy.arange(15)))
+        with open(basename + ".inf") as fp:
+            assert("number of frames = 15" in fp.read())
+
+
+def test_imagewriters_5():
+    """
+    HDF5 writing, the movie should be readable with only the .h5 file.
+    """
+    basename = os.path.join(test.dataDirectory(), "writer_05")
+    for ext in [".h5", ".xml"]:
+        if os.path.exists(basename + ext):
+            os.remove(basename + ext)
+
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".h5",
+                                              writer_async = True)
+    writer = recordFilm(cam_fn, film_settings, 10, ramp = True)
+
+    to_save = params.StormXMLObject()
+    film_p = to_save.addSubSection("film")
+    film_p.add(params.ParameterString(name = "filetype", value = ".h5"))
+    writer.saveParameters(to_save)
+
+    # Ramps should still compress well.
+    assert(os.path.getsize(basename + ".h5") < (10 * 64 * 32 * 2))
+
+    # Every frame should be read back in the right order and with the
+    # same orientation as the other readers (see DaxReader).
+    movie = datareader.reader(basename + ".h5")
+    assert(movie.filmSize() == [64, 32, 10])
+    assert(movie.filmParameters().get("film.filetype") == ".h5")
+    for [i, aframe] in enumerate(makeFrames(cam_fn, 10, ramp = True)):
+        image = movie.loadAFrame(i)
+        assert(image.shape == (32, 64))
+        assert(numpy.array_equal(image, numpy.transpose(aframe.getData().reshape(64, 32))))
+    movie.closeFilePtr()
+
+
+def test_imagewriters_6():
+    """
+    Frame index file and movie recovery.
+    """
+    basename = os.path.join(test.dataDirectory(), "writer_06")
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".dax")
+    recordFilm(cam_fn, film_settings, 12)
+
+    [info, records] = frameIndex.readFrameIndex(basename + ".idx")
+    assert(info["extension"] == ".dax")
+    assert(info["x_pixels"] == 64)
+    assert(records.size == 12)
+    assert(numpy.all(records["frame_number"] == numpy.arange(12)))
+    assert(numpy.all(records["stripe"] == 0))
+    assert(numpy.all(records["offset"] == numpy.arange(12) * 64 * 32 * 2))
+    assert(numpy.all(numpy.diff(records["timestamp"]) >= 0.0))
+    assert(frameIndex.timingStatistics(records)["camera_frames_missing"] == 0)
+
+    # Simulate a crash with a partially written frame and no meta-data.
+    with open(basename + ".dax", "ab") as fp:
+        fp.write(b"\0" * 100)
+    for ext in [".inf", ".xml"]:
+        if os.path.exists(basename + ext):
+            os.remove(basename + ext)
+
+    assert(frameIndex.recoverFilm(basename + ".idx", verbose = False) == 12)
+    with open(basename + ".inf") as fp:
+        assert("number of frames = 12" in fp.read())
+
+    movie = datareader.reader(basename + ".dax")
+    assert(movie.filmSize() == [64, 32, 12])
+    assert(movie.filmParameters().get("acquisition.recovered"))
+    movie.closeFilePtr()
+
+    # A pre-allocated .fast.dax film, only the frames that were written
+    # are in the index.
+    basename = os.path.join(test.dataDirectory(), "writer_06b")
+    for ext in [".inf", ".xml"]:
+        if os.path.exists(basename + ext):
+            os.remove(basename + ext)
+    cam_fn = makeCameraFunctionality(x_pixels = 512, y_pixels = 512)
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".fast.dax",
+                                              film_length = 20,
+                                              writer_batch_size = 1)
+    writer = imagewriters.createFileWriter(cam_fn, film_settings)
+    for aframe in makeFrames(cam_fn, 9):
+        cam_fn.emitNewFrames([aframe])
+
+    # 2 frames per batch, so 8 frames have been written.
+    writer.frame_index.lock.acquire()
+    writer.frame_index.flush()
+    writer.frame_index.lock.release()
+    assert(os.path.getsize(basename + ".dax") == 20 * 512 * 512 * 2)
+    assert(frameIndex.recoverFilm(basename + ".idx", verbose = False) == 8)
+
+    cam_fn.stopped.emit()
+    writer.closeWriter()
+    [info, records] = frameIndex.readFrameIndex(basename + ".idx")
+    assert(numpy.all(records["index"] == numpy.arange(9)))
+
+
+def test_imagewriters_7():
+    """
+    Striped writing.
+    """
+    basename = os.path.join(test.dataDirectory(), "writer_07")
+    stripe_dirs = ["stripe_a", "stripe_b"]
+    for stripe_dir in stripe_dirs:
+        os.makedirs(os.path.join(test.dataDirectory(), stripe_dir), exist_ok = True)
+
+    cam_fn = makeCameraFunctionality()
+    film_settings = filmSettings.FilmSettings(basename = basename,
+                                              filetype = ".stripes",
+                                              writer_stripe_directories = stripe_dirs,
+                                              writer_stripe_frames = 3)
+    recordFilm(cam_fn, film_settings, 20)
+
+    # 20 frames in blocks of 3, so 4 blocks in the first stripe and 3 in the second.
+    frame_bytes = 64 * 32 * 2
+    assert(os.path.getsize(os.path.join(test.dataDirectory(), "stripe_a", "writer_07_s0.dax")) == 11 * frame_bytes)
+    assert(os.path.getsize(os.path.join(test.dataDirectory(), "stripe_b", "writer_07_s1.dax")) == 9 * frame_bytes)
+
+    to_save = params.StormXMLObject()
+    film_p = to_save.addSubSection("film")
+    film_p.add(params.ParameterString(name = "filetype", value = ".stripes"))
+    to_save.saveToFile(basename + ".xml")
+
+    movie = datareader.reader(basename + ".stripes")
+    assert(movie.filmSize() == [64, 32, 20])
+    for i in range(20):
+        assert(numpy.all(movie.loadAFrame(i) == i))
+    movie.closeFilePtr()
+
+    # The index has the stripe and the offset in the stripe of each frame.
+    [info, records] = frameIndex.readFrameIndex(basename + ".idx")
+    records = numpy.sort(records, order = "index")
+    assert(numpy.all(records["index"] == numpy.arange(20)))
+    assert(numpy.all(records["frame_number"] == numpy.arange(20)))
+    assert(list(records["stripe"][:7]) == [0, 0, 0, 1, 1, 1, 0])
+    assert(list(records["offset"][:7] // frame_bytes) == [0, 1, 2, 0, 1, 2, 3])
+
+    # Recovery after a crash, the manifest was written with 0 frames.
+    with open(basename + ".stripes") as fp:
+        manifest = fp.read()
+    with open(basename + ".stripes", "w") as fp:
+        fp.write(manifest.replace("number of frames = 20", "number of frames = 0"))
+    assert(frameIndex.recoverFilm(basename + ".idx", verbose = False) == 20)
+    movie = datareader.reader(basename + ".stripes")
+    assert(movie.filmSize() == [64, 32, 20])
+    movie.closeFilePtr()
+
+
+def test_imagewriters_8():
+    """
+    TIF and big TIF writing.
+    """
+    for [filetype, writer_async] in [[".tif", False], [".big.tif", True]]:
+        basename = os.path.join(test.dataDirectory(), "writer_08")
+        cam_fn = makeCameraFunctionality(x_pixels = 512, y_pixels = 400)
+        film_settings = filmSettings.FilmSettings(basename = basename,
+                                                  filetype = filetype,
+                                                  writer_async = writer_async)
+        recordFilm(cam_fn, film_settings, 15)
+
+        with tifffile.TiffFile(basename + filetype) as tf:
+            assert(len(tf.pages) == 15)
+            movie = tf.asarray()
+            assert(movie.shape == (15, 400, 512))
+            assert(numpy.all(movie[:,0,0] == numpy.arange(15)))
+            if (filetype == ".tif"):
+                assert(tf.imagej_metadata["images"] == 15)
+
+
+def test_imagewriters_9():
+    """
+    Writer benchmark.
+    """
+    result = benchmark.runBenchmark(directory = test.dataDirectory(),
+                                    filetype = ".dax",
+                                    frame_rate = 1000.0,
+                                    n_frames = 20,
+                                    x_pixels = 64,
+                                    y_pixels = 32,
+                                    writer_async = True)
+    assert(result["frames_saved"] == 20)
+    assert(result["frames_dropped"] == 0)
+    assert(result["throughput_mb_s"] > 0.0)
+    assert(result["latency_ms"]["p50"] <= result["latency_ms"]["max"])
+    assert(not os.path.exists(os.path.join(test.dataDirectory(), "benchmark_dax_64x32.dax")))
+
+
+if (__name__ == "__main__"):
+    test_imagewriters_1()
+    test_imagewriters_2()
+    test_imagewriters_3()
+    test_imagewriters_4()
+    test_imagewriters_5()
+    test_imagewriters_6()
+    test_imagewriters_7()
+    test_imagewriters_8()
+    test_imagewriters_9()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Tests of the film replay camera.
+"""
+import numpy
+import os
+import time
+
+from PyQt5 import QtCore
+
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.replayCameraControl as replayCameraControl
+
+import storm_control.test as test
+import storm_control.test.test_datareader as test_datareader
+
+
+def makeControl(filename, fps = 500.0, read_ahead = 4):
+    config = params.StormXMLObject()
+    config.add(params.ParameterString(name = "film", value = os.path.join(test.dataDirectory(), filename)))
+    config.add(params.ParameterFloat(name = "fps", value = fps))
+    config.add(params.ParameterFloat(name = "mean_pause", value = 0.001))
+    config.add(params.ParameterInt(name = "read_ahead", value = read_ahead))
+    return replayCameraControl.ReplayCameraControl(camera_name = "camera1",
+                                                   config = config)
+
+def record(control, n_frames):
+    batches = []
+    control.newData.connect(batches.append, type = QtCore.Qt.DirectConnection)
+    control.film_length = n_frames
+    control.frame_number = 0
+    control.run()
+    return [aframe for batch in batches for aframe in batch]
+
+
+def test_replay_camera_1():
+    """
+    Replay (and loop) a big endian .dax film at the requested rate.
+    """
+    raw = test_datareader.makeDax("replay_01", 10, 40, 30, big_endian = True)
+    control = makeControl("replay_01.dax")
+    assert(control.getParameters().get("x_pixels") == 40)
+    assert(control.getParameters().get("y_pixels") == 30)
+
+    start_time = time.perf_counter()
+    frames = record(control, 25)
+    elapsed = time.perf_counter() - start_time
+
+    assert([aframe.frame_number for aframe in frames] == list(range(25)))
+    for aframe in frames:
+        assert([aframe.image_x, aframe.image_y] == [40, 30])
+        assert(numpy.array_equal(aframe.getData(), raw[aframe.frame_number % 10]))
+    assert(elapsed > 0.045)
+    assert(abs((frames[-1].acquisition_time - frames[0].acquisition_time) - 0.048) < 1.0e-6)
+    control.cleanUp()
+
+
+def test_replay_camera_2():
+    """
+    Replay the ROI of a .tif film, using the film frame rate.
+    """
+    movie = test_datareader.makeTif("replay_02", ".tif", 5, 40, 30)
+    control = makeControl("replay_02.tif", fps = 0.0)
+    assert(abs(control.getParameters().get("exposure_time") - 0.1) < 1.0e-6)
+
+    parameters = control.getParameters().copy()
+    parameters.setv("exposure_time", 0.002)
+    for [pname, value] in [["x_start", 5], ["x_end", 12], ["y_start", 3], ["y_end", 6]]:
+        parameters.setv(pname, value)
+    control.newParameters(parameters)
+
+    frames = record(control, 7)
+    assert([aframe.frame_number for aframe in frames] == list(range(7)))
+    for aframe in frames:
+        expected = movie[aframe.frame_number % 5, 2:6, 4:12].ravel()
+        assert([aframe.image_x, aframe.image_y] == [8, 4])
+        assert(numpy.array_equal(aframe.getData(), expected))
+    control.cleanUp()
+
+
+if (__name__ == "__main__"):
+    test_replay_camera_1()
+    test_replay_camera_2()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Tests of the shared memory frame rings.
+"""
+import multiprocessing
+import numpy
+import os
+import pytest
+
+# multiprocessing.shared_memory was added in Python 3.8.
+pytest.importorskip("multiprocessing.shared_memory")
+
+import storm_control.sc_library.sharedFrames as sharedFrames
+
+
+def ringName():
+    return "sc_test_" + str(os.getpid())
+
+def readFrames(name, n_frames, queue):
+    reader = sharedFrames.FrameRingReader(name = name, from_start = True)
+    sums = []
+    for i in range(n_frames):
+        aframe = reader.getFrame(timeout = 5.0)
+        sums.append([aframe.frame_number, int(aframe.getData().sum())])
+    reader.close()
+    queue.put(sums)
+
+
+def test_shared_frames_1():
+    """
+    Publish and read frames, including frames that were over-written
+    before they were read.
+    """
+    writer = sharedFrames.FrameRingWriter(name = ringName(), n_slots = 4, slot_bytes = 2 * 16 * 8)
+    reader = sharedFrames.FrameRingReader(name = ringName())
+    assert(reader.getFrame(timeout = 0.01) is None)
+
+    for i in range(3):
+        writer.addFrame(numpy.full(16 * 8, i, dtype = numpy.uint16), i, 16, 8, acquisition_time = 0.5 * i)
+    frames = reader.getFrames()
+    assert([aframe.frame_number for aframe in frames] == [0, 1, 2])
+    assert(frames[1].getData().shape == (8, 16))
+    assert(numpy.all(frames[1].getData() == 1))
+    assert(frames[2].acquisition_time == 1.0)
+    assert(reader.getMissed() == 0)
+
+    # Frames 3 - 9, only the last 4 are still in the ring.
+    for i in range(3, 10):
+        writer.addFrame(numpy.full(16 * 8, i, dtype = numpy.uint16), i, 16, 8)
+        if (i == 3):
+            assert(reader.isValid(frames[2]))
+    assert(not reader.isValid(frames[2]))
+
+    frames = reader.getFrames(copy = True)
+    assert([aframe.frame_number for aframe in frames] == [6, 7, 8, 9])
+    assert(reader.getMissed() == 3)
+
+    # Strided views of frames are also fine.
+    image = numpy.arange(32 * 16, dtype = numpy.uint16).reshape(16, 32)
+    writer.addFrame(image[2:10, 4:20], 10, 16, 8)
+    aframe = reader.getFrame(timeout = 0.01)
+    assert(numpy.array_equal(aframe.getData(), image[2:10, 4:20]))
+
+    writer.close()
+    assert(reader.isClosed())
+    assert(numpy.all(frames[3].getData() == 9))
+    reader.close()
+
+
+def test_shared_frames_2():
+    """
+    Read frames in another process.
+    """
+    writer = sharedFrames.FrameRingWriter(name = ringName(), n_slots = 16, slot_bytes = 2 * 32 * 32)
+    for i in range(5):
+        writer.addFrame(numpy.full(32 * 32, i, dtype = numpy.uint16), i, 32, 32)
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = readFrames, args = (ringName(), 5, queue))
+    process.start()
+    sums = queue.get(timeout = 10.0)
+    process.join()
+    writer.close()
+
+    assert(sums == [[i, 32 * 32 * i] for i in range(5)])
+
+
+if (__name__ == "__main__"):
+    test_shared_frames_1()
+    test_shared_frames_2()